@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# Copyright (C) 2012 Robert Lanfear and Brett Calcott
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details. You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# PartitionFinder also includes the PhyML program, the RAxML program, and the
+# PyParsing library, all of which are protected by their own licenses and
+# conditions, using PartitionFinder implies that you agree with those licences
+# and conditions as well.
+
+# Runs analyses for a PartitionFinder started with '--executor remote':
+#   python PartitionFinderWorker.py [-p N] [--authkey KEY] [HOST:PORT]
+
+import sys
+
+from partitionfinder.core._legacy_shim import import_legacy_module
+
+if __name__ == "__main__":
+    remote = import_legacy_module("remote")
+    sys.exit(remote.worker_main(sys.argv[1:]))
@@ -8,6 +8,6 @@ The goal is to isolate performance work without changing scientific results.
 
 from __future__ import annotations
 
-from ._api import add_i64, backend, subset_list_score, subset_list_stats
+from ._api import add_i64, backend, subset_list_score, subset_list_stats, tiger_agreement
 
-__all__ = ["add_i64", "backend", "subset_list_score", "subset_list_stats"]
+__all__ = ["add_i64", "backend", "subset_list_score", "subset_list_stats", "tiger_agreement"]
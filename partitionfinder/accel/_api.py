@@ -158,3 +158,90 @@ def subset_list_score(
         return (-2.0 * float(lnL)) + (k * math.log(n))
 
     raise ValueError(f"Unknown model_selection: {model_selection!r}")
+
+
+# Roughly how many (pattern, part) pairs we test at once
+_TIGER_CHUNK = 1 << 20
+
+
+def _tiger_agreement_rows(parts, rows, out) -> None:
+    import numpy as np
+
+    bits, first_taxon, owner, nparts, taxon_part = parts
+    step = max(1, _TIGER_CHUNK // max(1, len(owner)))
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        # Only the part of p holding the first taxon of a part of q can hold
+        # all of it, and it does if q's part has no bits outside it
+        holder = taxon_part[block][:, first_taxon]
+        outside = bits[np.newaxis] & ~bits[np.maximum(holder, 0)]
+        inside = (holder >= 0) & ~outside.any(axis=2)
+        for i, p in enumerate(block):
+            counts = np.bincount(owner, weights=inside[i], minlength=len(nparts))
+            with np.errstate(invalid="ignore"):
+                out[p] = counts / nparts
+
+
+def tiger_agreement(labels, *, threads: int = 1):
+    """TIGER partition agreement between every pair of site patterns.
+
+    `labels` is a (patterns, taxa) integer array. Taxa with the same label in
+    a row are in the same part of that pattern's set partition, and -1 means
+    missing data.
+
+    Returns a (patterns, patterns) float64 array where ``[p, q]`` is the
+    fraction of q's parts that are a subset of one of p's parts (``axpi`` in
+    the legacy `morph_tiger`). Every value is ``count / parts`` as a single
+    float division, so it matches the legacy code exactly. A pattern with no
+    parts at all (only missing data) gets NaN in its column.
+    """
+
+    import numpy as np
+
+    labels = np.ascontiguousarray(labels, dtype=np.int32)
+    if labels.ndim != 2:
+        raise ValueError("labels must be a 2-D (patterns, taxa) array")
+    npatterns, ntaxa = labels.shape
+    threads = max(1, int(threads))
+
+    if _RUST is not None and backend() == "rust":
+        flat = _RUST.tiger_agreement(labels.ravel().tolist(), npatterns, ntaxa, threads)
+        return np.asarray(flat, dtype=np.float64).reshape(npatterns, npatterns)
+
+    # Sort the taxa of each pattern by label, so each part is a run, and
+    # then make a taxon bitset for each part
+    order = np.argsort(labels, axis=1, kind="stable")
+    sorted_labels = np.take_along_axis(labels, order, axis=1)
+    keep = (sorted_labels >= 0).ravel()
+    owner_of_entry = np.repeat(np.arange(npatterns), ntaxa)[keep]
+    label_of_entry = sorted_labels.ravel()[keep]
+    taxa = order.ravel()[keep]
+    new_part = np.ones(len(taxa), dtype=bool)
+    new_part[1:] = (owner_of_entry[1:] != owner_of_entry[:-1]) | (label_of_entry[1:] != label_of_entry[:-1])
+    part_of_entry = np.cumsum(new_part) - 1
+    starts = np.flatnonzero(new_part)
+
+    out = np.empty((npatterns, npatterns), dtype=np.float64)
+    if not len(starts):
+        out.fill(np.nan)
+        return out
+
+    bits = np.zeros((len(starts), (ntaxa + 63) // 64), dtype=np.uint64)
+    np.bitwise_or.at(bits, (part_of_entry, taxa // 64),
+                     np.left_shift(np.uint64(1), (taxa % 64).astype(np.uint64)))
+    taxon_part = np.full((npatterns, ntaxa), -1, dtype=np.int64)
+    taxon_part[owner_of_entry, taxa] = part_of_entry
+    owner = owner_of_entry[starts]
+    nparts = np.bincount(owner, minlength=npatterns).astype(np.float64)
+    # The taxa in each part are in order, so the first is the smallest
+    parts = (bits, taxa[starts], owner, nparts, taxon_part)
+
+    if threads == 1 or npatterns < 2 * threads:
+        _tiger_agreement_rows(parts, np.arange(npatterns), out)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        chunks = [np.arange(i, npatterns, threads) for i in range(threads)]
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda rows: _tiger_agreement_rows(parts, rows, out), chunks))
+    return out
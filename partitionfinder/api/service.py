@@ -37,6 +37,7 @@ from pydantic import BaseModel, Field
 import re
 
 from partitionfinder.core import run_folder
+from partitionfinder.core._legacy_shim import import_legacy_module
 
 
 JobState = Literal["queued", "running", "succeeded", "failed"]
@@ -281,7 +282,11 @@ class JobStore:
     def list_job_ids(self) -> list[str]:
         if not self.root.exists():
             return []
-        return [p.name for p in self.root.iterdir() if p.is_dir()]
+        # Hidden folders are shared between jobs, see shared_cache_dir
+        return [p.name for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")]
+
+    def shared_cache_dir(self) -> Path:
+        return self.root / ".alignments"
 
     def append_log(self, job_id: str, line: str) -> None:
         lp = self.log_path(job_id)
@@ -465,6 +470,13 @@ def _run_job(job_id: str, store_root: str) -> None:
 
     meta = local_store.read_meta(job_id)
 
+    # Each job works on its own copy of the input, so jobs on the same
+    # alignment share the parsed copy through the store instead.
+    os.environ.setdefault(
+        import_legacy_module("alignment").SHARED_CACHE_VARIABLE,
+        str(local_store.shared_cache_dir()),
+    )
+
     # Capture Python logging output (including legacy engine logs) into the
     # per-job log file so WS streaming shows meaningful progress.
     file_handler = logging.FileHandler(local_store.log_path(job_id), mode="a", encoding="utf-8")
@@ -26,6 +26,11 @@ import os
 from util import PartitionFinderError
 import numpy as np
 import io
+import re
+import mmap
+import hashlib
+import json
+import collections
 from itertools import chain
 
 log = logtools.get_logger()
@@ -104,14 +109,144 @@ class AlignmentError(PartitionFinderError):
     pass
 
 
+_state_masks = {}
+
+
+def state_masks(datatype):
+    """A bitmask of the expanded states for each byte, and one of all states
+
+    Each of the states for the datatype gets a bit in a uint32, so a column
+    (or a subset) is just the OR of the masks of the bases in it.
+    """
+    found = _state_masks.get(datatype)
+    if found is not None:
+        return found
+
+    if datatype == 'protein':
+        all_states, state_dict = amino_states, amino_dict
+    elif datatype == 'DNA':
+        all_states, state_dict = dna_states, dna_dict
+    elif datatype == 'morphology':
+        all_states, state_dict = morph_states, morph_dict
+    else:
+        all_states, state_dict = set(), {}
+
+    bits = dict((state, 1 << i) for i, state in enumerate(sorted(all_states)))
+    table = np.zeros(256, dtype=np.uint32)
+    for byte in range(256):
+        char = chr(byte)
+        for state in state_dict.get(char, set(char)):
+            table[byte] |= bits.get(state, 0)
+
+    found = table, np.uint32(sum(bits.values()))
+    _state_masks[datatype] = found
+    return found
+
+
+# The binary copy of the source alignment that we keep in the start_tree
+# folder, so a restart doesn't have to parse it again
+CACHE_DATA = 'source.npy'
+CACHE_INDEX = 'source.json'
+CACHE_VERSION = 1
+
+# Analyses of the same file in different folders (such as API jobs, which
+# each get their own copy of the input) can share a cache through the folder
+# this names. Each source file gets a folder in there, named by its
+# file_digest.
+SHARED_CACHE_VARIABLE = "PARTITIONFINDER_ALIGNMENT_CACHE"
+
+# How many gathered subset matrices an alignment keeps
+SUBSET_DATA_CACHE = 8
+
+
+def read_digest(pth):
+    if not os.path.exists(pth):
+        return None
+    with open(pth, 'r') as f:
+        return f.read().strip()
+
+
+def write_digest(pth, digest):
+    with open(pth, 'w') as f:
+        f.write(digest)
+
+
+def file_digest(pth):
+    """A hash of the raw bytes of a file"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(pth, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def shared_cache_folder(source_digest):
+    """The shared cache folder for this source file, or None"""
+    root = os.environ.get(SHARED_CACHE_VARIABLE)
+    if not root:
+        return None
+    return os.path.join(root, source_digest)
+
+
+def read_cache_index(folder):
+    """The index of the alignment cache in this folder, or None"""
+    pth = os.path.join(folder, CACHE_INDEX)
+    if not os.path.exists(pth):
+        return None
+    try:
+        with open(pth, 'r') as f:
+            index = json.load(f)
+    except ValueError:
+        log.warning("Ignoring the damaged alignment cache index '%s'", pth)
+        return None
+    if index.get('version') != CACHE_VERSION:
+        return None
+    return index
+
+
+def write_cache_index(folder, index):
+    pth = os.path.join(folder, CACHE_INDEX)
+    # Other analyses might be writing the same shared cache
+    tmp = '%s.%d.tmp' % (pth, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, pth)
+
+
+# Byte translation table that upper cases, so that whole lines of bases can be
+# converted by bytes.translate rather than one character at a time
+_UPPER = bytes(bytearray(range(256))).upper()
+
+
+def _as_buffer(source):
+    """Turn a stream, or some text, into something we can search as bytes"""
+    if hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    return source
+
+
 class AlignmentParser(object):
+    """Read a phylip alignment
+
+    This works on the raw bytes (a memory-mapped file, ideally). Each line is
+    found with a byte search, the bases are upper cased and checked with
+    bytes.translate, and then copied straight into the preallocated data
+    array, so no Python code runs for each base.
+    """
     def __init__(self, stream, valid_bases=None):
-        self.stream = stream
+        self.buffer = _as_buffer(stream)
+        self.size = len(self.buffer)
+        self.pos = 0
         self.current_line = 0
         self.cur_len = 0
         self.start_base = 0
         self.end_base = 0
         self.valid_bases = valid_bases
+        self.valid = None
+        if valid_bases is not None:
+            self.valid = valid_bases.encode('ascii')
         self.block_len = None
         self.interleave_blocks_done = 0
 
@@ -121,21 +256,34 @@ class AlignmentParser(object):
         self.sequence_length = 0
         self.data = None
 
-    def bases_to_array(self, bases=""):
-        upper_bases = bases.upper()
-        if self.valid_bases is not None:
-            # Create translation table to remove valid bases
-            translation_table = str.maketrans('', '', self.valid_bases)
-            should_be_empty = upper_bases.translate(translation_table)
-            if should_be_empty != "":
+    def readline(self):
+        """The next line as bytes, or None at the end of the file"""
+        if self.pos >= self.size:
+            return None
+        start = self.pos
+        end = self.buffer.find(b'\n', start)
+        if end == -1:
+            end = self.size
+        self.pos = end + 1
+        self.current_line += 1
+        return self.buffer[start:end]
+
+    def clean_bases(self, bases):
+        """The bases, upper cased and checked, as bytes"""
+        if not isinstance(bases, bytes):
+            bases = _as_buffer(bases)
+        upper = bases.translate(_UPPER)
+        if self.valid is not None:
+            should_be_empty = upper.translate(None, self.valid)
+            if should_be_empty:
                 log.error("Line %d: Invalid bases '%s' found.",
-                          self.current_line, should_be_empty)
+                          self.current_line,
+                          should_be_empty.decode('latin-1'))
                 raise AlignmentError
+        return upper
 
-        # Which is faster?
-        # return array.array("B", upper_bases)
-        # Convert string to bytes array for numpy
-        return np.array([ord(c) for c in upper_bases], dtype='u1')
+    def bases_to_array(self, bases=""):
+        return np.frombuffer(self.clean_bases(bases), dtype='u1')
 
     def parse(self):
         # Parse the header...
@@ -156,32 +304,35 @@ class AlignmentParser(object):
 
     def parse_header(self):
         while 1:
-            line = self.stream.readline()
-            self.current_line += 1
+            line = self.readline()
 
-            if len(line) == 0:
+            if line is None:
                 log.error("Line %d, Found no data in file", self.current_line)
-
-            # Skip blank lines
-            if len(line.strip()) == 0:
-                continue
+                raise AlignmentError
 
             # `split` works on whitespace
             bits = line.split()
 
+            # Skip blank lines
+            if len(bits) == 0:
+                continue
+
             # We're looking for 2 bits, species count and bases
             if len(bits) == 2:
                 # Convert them to integers
-                S, C = map(int, bits)
-                self.species_count = S
-                self.sequence_length = C
-                # We're done!
-                return
-            else:
-                log.error("""Line %d: Failed to find the Phyml header that
-                          specifies the species count, and sequence length""",
-                          self.current_line)
-                raise AlignmentError
+                try:
+                    S, C = [int(x) for x in bits]
+                except ValueError:
+                    S = None
+                if S is not None:
+                    self.species_count = S
+                    self.sequence_length = C
+                    # We're done!
+                    return
+            log.error("""Line %d: Failed to find the Phyml header that
+                      specifies the species count, and sequence length""",
+                      self.current_line)
+            raise AlignmentError
 
     def check_block(self):
         # Do some checking on the line in the block
@@ -189,7 +340,7 @@ class AlignmentParser(object):
             # Mark the length we got.
             self.block_len = self.cur_len
             self.end_base = self.start_base + self.block_len
-            if self.end_base > self.sequence_length + 1:
+            if self.end_base > self.sequence_length:
                 log.error("""Line %d: More supplied than defined in the
                             header""", self.current_line)
                 raise AlignmentError
@@ -212,10 +363,9 @@ class AlignmentParser(object):
         # Look for species followed by bases, separated by whitespace.
         cur_species = 0
         while cur_species < self.species_count:
-            line = self.stream.readline()
-            self.current_line += 1
+            line = self.readline()
 
-            if len(line) == 0:
+            if line is None:
                 # We've run out of species! There must be too many species in
                 # the header.
                 log.error("""Phyml format error. Only found {} species,
@@ -236,14 +386,15 @@ class AlignmentParser(object):
                 raise AlignmentError
 
             spec, bases = bits
+            spec = spec.decode('utf-8')
             self.cur_len = len(bases)
 
             self.check_block()
             self.species.append(spec)
 
             # Write into the array at the right position.
-            arr = self.bases_to_array(bases)
-            self.data[cur_species, self.start_base:self.end_base] = arr
+            self.data[cur_species, self.start_base:self.end_base] = \
+                self.bases_to_array(bases)
 
             cur_species += 1
 
@@ -254,12 +405,14 @@ class AlignmentParser(object):
         blank_lines = 0
         self.block_len = None
 
+        # Interleaved lines are short, so we collect the whole block and copy
+        # it into the array in one go
+        rows = []
+
         while species_num < self.species_count:
-            curline = self.stream.readline()
-            self.current_line += 1
-            self.cur_len = len(curline)
+            line = self.readline()
 
-            if self.cur_len == 0:
+            if line is None:
                 # If we read nothing, it is the end of the file
                 if species_num != 0:
                     log.error("""Line %d: "Did not find enough lines for all
@@ -269,10 +422,9 @@ class AlignmentParser(object):
                 return False
 
             # Strip any whitespace
-            bases = curline.strip()
-            self.cur_len = len(bases)
+            bits = line.split()
 
-            if self.cur_len == 0:
+            if not bits:
                 # Skip blanks
                 if species_num != 0:
                     log.error("""Line %d: Found blank line in interleave
@@ -282,6 +434,9 @@ class AlignmentParser(object):
                 blank_lines += 1
                 continue
 
+            bases = b"".join(bits)
+            self.cur_len = len(bases)
+
             if blank_lines == 0:
                 if self.interleave_blocks_done == 0:
                     # No blank line. And we've not yet done an interleave
@@ -294,16 +449,228 @@ class AlignmentParser(object):
                 raise AlignmentError
 
             self.check_block()
-
-            arr = self.bases_to_array(bases)
-            self.data[species_num, self.start_base:self.end_base] = arr
+            rows.append(self.clean_bases(bases))
 
             species_num += 1
 
+        block = np.frombuffer(b"".join(rows), dtype='u1')
+        self.data[:, self.start_base:self.end_base] = \
+            block.reshape(self.species_count, self.block_len)
         self.start_base += self.block_len
         return True
 
 
+def is_nexus(buffer):
+    return buffer[:64].lstrip().upper().startswith(b'#NEXUS')
+
+
+_NEXUS_DIMENSION = re.compile(br'\b(NTAX|NCHAR)\s*=\s*(\d+)', re.IGNORECASE)
+_NEXUS_MATRIX = re.compile(br'\bMATRIX\b', re.IGNORECASE)
+
+
+class NexusParser(AlignmentParser):
+    """Read the MATRIX of a NEXUS file, sequential or interleaved
+
+    This goes through the file a line at a time, like the phylip parser. The
+    pieces of each sequence are checked as we go, and each one is joined up
+    and copied into the data array once we reach the end of the matrix. We
+    use the NTAX and NCHAR from the DIMENSIONS, if they are there, to catch
+    mistakes early.
+    """
+    def __init__(self, stream, valid_bases=None):
+        AlignmentParser.__init__(self, stream, valid_bases)
+        self.in_comment = False
+        self.rows = {}
+        self.filled = []
+        self.pieces = []
+
+    def strip_comments(self, line):
+        """Remove [comments], which can run over several lines"""
+        if not self.in_comment and b'[' not in line:
+            return line
+        out = []
+        pos = 0
+        while pos < len(line):
+            if self.in_comment:
+                end = line.find(b']', pos)
+                if end == -1:
+                    break
+                self.in_comment = False
+                pos = end + 1
+            else:
+                start = line.find(b'[', pos)
+                if start == -1:
+                    out.append(line[pos:])
+                    break
+                out.append(line[pos:start])
+                self.in_comment = True
+                pos = start + 1
+        return b" ".join(out)
+
+    def parse(self):
+        first = self.parse_preamble()
+        self.parse_matrix(first)
+        self.finish()
+
+    def parse_preamble(self):
+        """Read up to the MATRIX, picking up the dimensions on the way"""
+        while 1:
+            line = self.readline()
+            if line is None:
+                log.error("No MATRIX block found in NEXUS file")
+                raise AlignmentError
+            line = self.strip_comments(line)
+            for name, value in _NEXUS_DIMENSION.findall(line):
+                if name.upper() == b'NTAX':
+                    self.species_count = int(value)
+                else:
+                    self.sequence_length = int(value)
+            found = _NEXUS_MATRIX.search(line)
+            if found:
+                # There might be data on the same line as MATRIX
+                return line[found.end():]
+
+    def matrix_lines(self, line):
+        """The lines of the matrix, up to the closing semicolon"""
+        while line is not None:
+            end = line.find(b';')
+            if end != -1:
+                yield line[:end]
+                return
+            yield line
+            line = self.readline()
+            if line is not None:
+                line = self.strip_comments(line)
+        log.error("The NEXUS MATRIX has no closing ';'")
+        raise AlignmentError
+
+    def parse_matrix(self, first):
+        last_row = None
+        for line in self.matrix_lines(first):
+            name, bases = self.split_name(line)
+            if name is None:
+                continue
+            if bases is None:
+                # A line on its own carries on the previous sequence, unless
+                # it is a name we already have
+                if name in self.rows or last_row is None:
+                    last_row = self.row_for(name)
+                    continue
+                row, bases = last_row, name
+            else:
+                row = last_row = self.row_for(name)
+            self.add_bases(row, bases)
+
+    def split_name(self, line):
+        """The taxon name, and the bases that follow it on this line"""
+        bits = line.split(None, 1)
+        if not bits:
+            return None, None
+        if bits[0][:1] in b"'\"":
+            line = line.lstrip()
+            end = line.find(line[:1], 1)
+            if end == -1:
+                log.error("Line %d: Unclosed quote in taxon name",
+                          self.current_line)
+                raise AlignmentError
+            name, rest = line[1:end], line[end + 1:]
+        else:
+            name, rest = bits[0], bits[1] if len(bits) == 2 else b""
+        return name, b"".join(rest.split()) or None
+
+    def row_for(self, name):
+        row = self.rows.get(name)
+        if row is not None:
+            return row
+        row = len(self.species)
+        if self.species_count and row >= self.species_count:
+            log.error("Line %d: Found more taxa in the MATRIX than the "
+                      "%d given by NTAX", self.current_line,
+                      self.species_count)
+            raise AlignmentError
+        self.rows[name] = row
+        self.species.append(name.decode('utf-8'))
+        self.filled.append(0)
+        self.pieces.append([])
+        return row
+
+    def add_bases(self, row, bases):
+        self.pieces[row].append(self.clean_bases(bases))
+        self.filled[row] += len(bases)
+        if self.sequence_length and self.filled[row] > self.sequence_length:
+            log.error("Line %d: Taxon '%s' has more than the %d "
+                      "characters given by NCHAR", self.current_line,
+                      self.species[row], self.sequence_length)
+            raise AlignmentError
+
+    def finish(self):
+        if not self.species:
+            log.error("No sequences found in NEXUS MATRIX block")
+            raise AlignmentError
+        self.species_count = self.species_count or len(self.species)
+        self.sequence_length = self.sequence_length or self.filled[0]
+        if len(self.species) != self.species_count:
+            log.error("Found %d taxa in the NEXUS MATRIX, but NTAX is %d",
+                      len(self.species), self.species_count)
+            raise AlignmentError
+        for name, got in zip(self.species, self.filled):
+            if got != self.sequence_length:
+                log.error("Taxon '%s' has %d characters, but it should "
+                          "have %d", name, got, self.sequence_length)
+                raise AlignmentError
+
+        self.data = np.empty((self.species_count, self.sequence_length), 'u1')
+        for row, pieces in enumerate(self.pieces):
+            self.data[row] = np.frombuffer(b"".join(pieces), dtype='u1')
+        self.pieces = None
+
+
+class SitePatterns(object):
+    """The unique columns (site patterns) of an alignment
+
+    Most per-site statistics only depend on what is in the column, and big
+    alignments have far fewer patterns than sites. So we work them out once
+    for each pattern, and look them up for the sites of any subset.
+
+    `data` holds the patterns as the columns of a (species, patterns) array,
+    so anything that takes an alignment's data can be run on it.
+    """
+    def __init__(self, data, columns=None):
+        species, sites = data.shape
+        if columns is None:
+            columns = np.ascontiguousarray(data.T)
+        rows = columns.view('V%d' % max(species, 1)).ravel()
+        if species == 0:
+            rows = np.zeros(sites, dtype='V1')
+        _, first, inverse, counts = np.unique(
+            rows, return_index=True, return_inverse=True, return_counts=True)
+        self.data = np.ascontiguousarray(data[:, first])
+        self.weights = counts
+        self.site_pattern = inverse.ravel()
+        self.stats = {}
+        log.debug("Found %d site patterns in %d sites", len(first), sites)
+
+    @property
+    def pattern_count(self):
+        return self.data.shape[1]
+
+    def stat(self, name, fn):
+        """fn(self) for each pattern, worked out the first time we ask"""
+        values = self.stats.get(name)
+        if values is None:
+            values = fn(self)
+            self.stats[name] = values
+        return values
+
+    def for_sites(self, name, fn, columns):
+        """The statistic for each of the given columns"""
+        return np.asarray(self.stat(name, fn))[self.site_pattern[columns]]
+
+    def in_sites(self, columns):
+        """The patterns in the given columns, and how often each turns up"""
+        return np.unique(self.site_pattern[columns], return_counts=True)
+
+
 class Alignment(object):
     def __init__(self):
         self.species = []
@@ -314,6 +681,57 @@ class Alignment(object):
     def species_count(self):
         return len(self.species)
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._patterns = None
+        self._column_major = None
+        self._subset_data = collections.OrderedDict()
+
+    @property
+    def patterns(self):
+        """The SitePatterns of this alignment, built when first needed"""
+        if self._patterns is None:
+            self._patterns = SitePatterns(self.data, self.column_major)
+        return self._patterns
+
+    @property
+    def column_major(self):
+        """A (sites, species) copy of the data, so a column is contiguous"""
+        if self._column_major is None:
+            self._column_major = np.ascontiguousarray(self.data.T)
+        return self._column_major
+
+    def subset_data(self, column_set):
+        """The data for just these columns
+
+        Evenly spaced columns (a data block, or a codon position) are a view
+        of our data, so there is no copy. Anything else is gathered from the
+        column-major copy, and we keep the last few of those, as the same
+        subset is often asked for more than once.
+        """
+        cut = column_set.as_slice()
+        if cut is not None:
+            data = self.data[:, cut]
+            data.flags.writeable = False
+            return data
+
+        data = self._subset_data.get(column_set)
+        if data is not None:
+            self._subset_data.move_to_end(column_set)
+            return data
+
+        data = self.column_major[column_set.to_array()].T
+        data.flags.writeable = False
+        self._subset_data[column_set] = data
+        if len(self._subset_data) > SUBSET_DATA_CACHE:
+            self._subset_data.popitem(last=False)
+        return data
+
     def __str__(self):
         return "Alignment(%s species, %s bases)"\
                % (self.species_count, self.sequence_length)
@@ -337,8 +755,99 @@ class Alignment(object):
 
         return True
 
+    def digest(self):
+        """A hash of the contents, so we can check a file without reading it"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(("%d %d\n" % (self.species_count, self.sequence_length))
+                 .encode('utf-8'))
+        for spec in self.species:
+            h.update(spec.encode('utf-8'))
+            h.update(b'\n')
+        h.update(np.ascontiguousarray(self.data))
+        return h.hexdigest()
+
+    def save_cache(self, folder, source_digest):
+        """Write the binary cache, and return its index
+
+        `source_digest` is the file_digest of the file we read this from, so
+        we can tell later whether we can use the cache instead.
+        """
+        tmp = os.path.join(folder, '%s.%d.tmp' % (CACHE_DATA, os.getpid()))
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.data))
+        os.replace(tmp, os.path.join(folder, CACHE_DATA))
+        index = {
+            'version': CACHE_VERSION,
+            'species': self.species,
+            'sequence_length': self.sequence_length,
+            'digest': self.digest(),
+            'source_digest': source_digest,
+        }
+        write_cache_index(folder, index)
+        return index
+
+    def load_cache(self, folder, index):
+        """Memory map the binary cache, if it matches its index
+
+        Returns False, leaving this alignment alone, if it doesn't.
+        """
+        pth = os.path.join(folder, CACHE_DATA)
+        try:
+            data = np.load(pth, mmap_mode='r')
+        except (IOError, ValueError):
+            log.warning("Ignoring the damaged alignment cache '%s'", pth)
+            return False
+
+        cached = Alignment()
+        cached.species = index['species']
+        cached.sequence_length = index['sequence_length']
+        cached.data = data
+        if (data.dtype != np.uint8 or
+                data.shape != (cached.species_count, cached.sequence_length) or
+                cached.digest() != index['digest']):
+            log.warning("Ignoring the alignment cache '%s', as it doesn't "
+                        "match its index", pth)
+            return False
+
+        self.species = cached.species
+        self.sequence_length = cached.sequence_length
+        self.data = cached.data
+        return True
+
+    def read_shared(self, pth, source_digest):
+        """Read a file, unless another analysis has shared a copy of it
+
+        See SHARED_CACHE_VARIABLE. If we do read it, we share it in turn.
+        """
+        shared = shared_cache_folder(source_digest)
+        if shared is not None:
+            index = read_cache_index(shared)
+            if index is not None and index['source_digest'] == source_digest:
+                if self.load_cache(shared, index):
+                    log.info("Using the shared copy of alignment file '%s'",
+                             pth)
+                    return
+
+        self.read(pth)
+
+        if shared is not None:
+            try:
+                os.makedirs(shared, exist_ok=True)
+                self.save_cache(shared, source_digest)
+            except OSError as e:
+                log.warning("Couldn't share the alignment cache in '%s': %s",
+                            shared, e)
+
     def parse_stream(self, stream):
-        p = AlignmentParser(stream)
+        """Parse a stream, or a buffer of bytes (such as an mmap)
+
+        This can be phylip or NEXUS.
+        """
+        buf = _as_buffer(stream)
+        if is_nexus(buf):
+            p = NexusParser(buf)
+        else:
+            p = AlignmentParser(buf)
         p.parse()
 
         # Copy everything from the import parser
@@ -352,147 +861,22 @@ class Alignment(object):
             log.error("Cannot find alignment file '%s'", pth)
             raise AlignmentError
 
-        # Auto-detect and convert NEXUS to phylip
-        if self._is_nexus_file(pth):
-            log.info("Detected NEXUS format, converting to phylip...")
-            pth = self._convert_nexus_to_phylip(pth)
-            log.info("Conversion complete, using temporary phylip file")
-
-        with open(pth, 'r') as stream:
-            self.parse_stream(stream)
+        with open(pth, 'rb') as stream:
+            try:
+                buf = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file can't be mapped
+                buf = b''
+            try:
+                self.parse_stream(buf)
+            finally:
+                if isinstance(buf, mmap.mmap):
+                    buf.close()
 
     def parse(self, text):
         stream = io.StringIO(text)
         self.parse_stream(stream)
 
-    def _is_nexus_file(self, pth):
-        """Check if file is in NEXUS format."""
-        try:
-            with open(pth, 'r') as f:
-                first_line = f.readline().strip().upper()
-                return first_line.startswith('#NEXUS')
-        except:
-            return False
-
-    def _convert_nexus_to_phylip(self, nexus_path):
-        """Convert NEXUS file to phylip format and return temp file path."""
-        import re
-        import tempfile
-        
-        log.info("Converting NEXUS file: %s", nexus_path)
-        
-        # Read NEXUS file
-        with open(nexus_path, 'r') as f:
-            content = f.read()
-        
-        log.debug("NEXUS file size: %d bytes", len(content))
-        
-        # Find the MATRIX block - be more precise about what comes after MATRIX
-        # Look for MATRIX keyword followed by actual sequence data (not just comments)
-        matrix_match = None
-        
-        # Try to find MATRIX followed by sequence data until END or ;
-        # Pattern 1: MATRIX in DATA or CHARACTERS block
-        pattern1 = r'BEGIN\s+(DATA|CHARACTERS)\s*;.*?MATRIX\s*\n(.*?)(?:\n\s*END\s*;|\n\s*ENDBLOCK\s*;)'
-        matrix_match = re.search(pattern1, content, re.DOTALL | re.IGNORECASE)
-        
-        if not matrix_match:
-            # Pattern 2: Just MATRIX keyword
-            pattern2 = r'MATRIX\s*\n(.*?)(?:\n\s*;|\n\s*END\s*;|\n\s*ENDBLOCK\s*;)'
-            matrix_match = re.search(pattern2, content, re.DOTALL | re.IGNORECASE)
-        
-        if not matrix_match:
-            log.error("No MATRIX block found in NEXUS file")
-            log.error("File content preview: %s", content[:1000])
-            raise AlignmentError
-        
-        # Get the matrix text (group 2 for pattern1, group 1 for pattern2)
-        matrix_text = matrix_match.group(2) if matrix_match.lastindex == 2 else matrix_match.group(1)
-        
-        log.debug("Matrix block found, length: %d bytes", len(matrix_text))
-        
-        # Parse sequences - handle both sequential and interleaved formats
-        sequences = {}
-        lines = matrix_text.strip().split('\n')
-        
-        log.debug("Processing %d lines from matrix block", len(lines))
-        
-        for line_num, line in enumerate(lines, 1):
-            original_line = line
-            line = line.strip()
-            
-            # Remove inline comments [like this]
-            line = re.sub(r'\[.*?\]', '', line).strip()
-            
-            # Skip empty lines after comment removal
-            if not line:
-                continue
-            
-            # Skip lines that look like the end marker
-            if line.upper().startswith('END') or line == ';':
-                continue
-            
-            # Split on whitespace - first part is name, rest is sequence
-            parts = line.split(None, 1)
-            if len(parts) >= 2:
-                name, seq = parts[0], parts[1]
-                # Remove all whitespace and special characters from sequence
-                seq = re.sub(r'[^A-Za-z\-\?]', '', seq)
-                
-                if name in sequences:
-                    sequences[name] += seq  # Append for interleaved format
-                else:
-                    sequences[name] = seq
-            elif len(parts) == 1 and parts[0]:
-                # Might be continuation of previous sequence (some NEXUS formats)
-                seq = re.sub(r'[^A-Za-z\-\?]', '', parts[0])
-                if sequences and seq:
-                    # Add to last sequence
-                    last_name = list(sequences.keys())[-1]
-                    sequences[last_name] += seq
-        
-        # Check if we got any sequences
-        if not sequences:
-            log.error("No sequences found in NEXUS MATRIX block")
-            log.error("Matrix text was: %s", matrix_text[:1000])
-            log.error("Lines processed: %d", len(lines))
-            log.error("Please check if your NEXUS file has the correct format:")
-            log.error("  - Should have 'BEGIN DATA;' or 'BEGIN CHARACTERS;'")
-            log.error("  - Should have 'MATRIX' keyword")
-            log.error("  - Should have sequences in format: TaxonName ACGT...")
-            log.error("  - Should end with 'END;' or ';'")
-            raise AlignmentError
-        
-        log.info("Parsed %d sequences from NEXUS file", len(sequences))
-        log.debug("Sequence names: %s", list(sequences.keys())[:10])
-        
-        # Create temporary phylip file in same directory as original
-        base_dir = os.path.dirname(nexus_path)
-        base_name = os.path.splitext(os.path.basename(nexus_path))[0]
-        temp_phylip = os.path.join(base_dir, f"{base_name}_temp.phy")
-        
-        # Validate sequences
-        if not sequences:
-            log.error("No sequences extracted from NEXUS file")
-            raise AlignmentError
-        
-        # Check all sequences are same length
-        seq_lengths = [len(seq) for seq in sequences.values()]
-        if len(set(seq_lengths)) > 1:
-            log.warning("Sequences have different lengths: %s", seq_lengths)
-        
-        # Write phylip format
-        num_seqs = len(sequences)
-        seq_length = len(list(sequences.values())[0])
-        
-        with open(temp_phylip, 'w') as f:
-            f.write(f"{num_seqs} {seq_length}\n")
-            for name, seq in sequences.items():
-                padded_name = name[:40].ljust(40)
-                f.write(f"{padded_name} {seq}\n")
-        
-        return temp_phylip
-
     def write(self, pth):
         fd = open(pth, 'w')
         log.debug("Writing phylip file '%s'", pth)
@@ -518,38 +902,20 @@ class Alignment(object):
         if not cfg.all_states:
             return False
 
-        sub_aln = SubsetAlignment(self, subset)
-
-        # 1. Get set of all states in the alignment, obs([])
-        observed_states = np.unique(sub_aln.data).tobytes().decode('latin1')
-
-        # 2. run through all states for each state, extend a set of observed
-        #    states, e.g. obs.add(x)
-        expanded_states = set([])
-        all_states = set()
-        state_dict = {}
-        
-        if cfg.datatype == 'protein':
-            all_states = amino_states
-            state_dict = amino_dict
-        elif cfg.datatype == 'DNA':
-            all_states = dna_states
-            state_dict = dna_dict
-        elif cfg.datatype == 'morphology':
-            all_states = morph_states
-            state_dict = morph_dict
-
-        for state in observed_states:
-            try:
-                ex = state_dict[state]
-            except KeyError:
-                ex = set(state)
+        # 1. Get the expanded states in each column as a bitmask. These are
+        #    worked out once for each site pattern in the alignment.
+        table, all_states = state_masks(cfg.datatype)
+        masks = self.patterns.for_sites(
+            ('state_masks', cfg.datatype),
+            lambda patterns: np.bitwise_or.reduce(table[patterns.data], axis=0),
+            subset.column_set.to_array())
 
-            expanded_states = expanded_states.union(ex)
+        # 2. OR them together to get all of the states observed in the subset
+        expanded_states = np.bitwise_or.reduce(masks)
 
         # 3. Compare set of observed states to set of all states. If all
         #    states are in the observed states, return TRUE else return FALSE.
-        if len(all_states.difference(expanded_states)) > 0:
+        if all_states & ~expanded_states:
             # some states are missing
             return True
         else:
@@ -565,7 +931,7 @@ class SubsetAlignment(Alignment):
 
         # Let's do a basic check to make sure that the specified sites
         # aren't > alignment length
-        site_max = max(subset.columns) + 1
+        site_max = subset.column_set.max() + 1
         log.debug("Max site in data_blocks: %d; max site in alignment: %d"
                   % (site_max, source.sequence_length))
         if site_max > source.sequence_length:
@@ -575,7 +941,7 @@ class SubsetAlignment(Alignment):
             raise AlignmentError
 
         self.species = source.species
-        # Pull out the columns we need using the magic of np indexing
-        self.data = source.data[:, subset.columns]
-        self.sequence_length = len(subset.columns)
+        # This is a view of the source, where it can be
+        self.data = source.subset_data(subset.column_set)
+        self.sequence_length = len(subset.column_set)
         assert self.sequence_length == self.data.shape[1]
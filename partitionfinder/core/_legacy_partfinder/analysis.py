@@ -20,17 +20,21 @@ log = logtools.get_logger()
 
 import os
 import shutil
-from database import Database
+import tempfile
+from database import make_database
 
+import alignment
 from alignment import Alignment, SubsetAlignment
 import threadpool
+import executors
+import costmodel
+import resultcache
 import scheme
 import subset_ops
 import results
-import threading
 import collections
 from config import the_config
-from util import PartitionFinderError, ExternalProgramError
+from util import PartitionFinderError, ExternalProgramError, ParseError
 import util
 import raxml
 from shutil import copyfile
@@ -56,7 +60,10 @@ class Analysis(object):
 
         # Make some folders for the analysis
         the_config.make_output_folders()
-        the_config.database = Database(the_config)
+        self.staging_path = None
+        if the_config.staging_dir and not the_config.save_phylofiles:
+            self.stage_phylofiles(the_config.staging_dir)
+        the_config.database = make_database(the_config)
 
         # Check for old analyses to see if we can use the old data
         the_config.check_for_old_config()
@@ -65,8 +72,20 @@ class Analysis(object):
         self.make_alignment(cfg.alignment_path)
         self.make_tree(cfg.user_tree_topology_path)
 
-        # We need this to block the threads for critical stuff
-        self.lock = threading.Condition(threading.Lock())
+        # Results from other analyses of the same data
+        the_config.result_cache = resultcache.open_cache(
+            the_config, self.tree_path)
+
+        # Learn how long things take from what we've run before
+        the_config.cost_model = costmodel.CostModel(the_config)
+        the_config.cost_model.load(the_config.database)
+
+        # Only this thread ever touches the subsets and the database. The
+        # workers just run the program and hand back the parsed results
+        self.executor = executors.make_executor(
+            the_config.executor, self.threads,
+            executors.WorkerContext(the_config, self.tree_path))
+        self.pending = {}
 
         # Store the result in here
         self.results = results.AnalysisResults(the_config.model_selection)
@@ -88,26 +107,63 @@ class Analysis(object):
                 shutil.rmtree(the_config.phylofiles_path)
 
 
+    def stage_phylofiles(self, staging_dir):
+        """Put the files we make for each subset somewhere else
+
+        They get thrown away once each subset is done, so if the staging
+        folder is in memory (like /dev/shm) they never reach the disk.
+        """
+        if not os.path.isdir(staging_dir):
+            log.error("The staging folder '%s' does not exist", staging_dir)
+            raise AnalysisError
+        self.staging_path = tempfile.mkdtemp(
+            prefix='phylofiles_', dir=staging_dir)
+        the_config.phylofiles_path = self.staging_path
+        log.info("Subset alignments will be written to '%s'",
+                 self.staging_path)
+
     def analyse(self):
         try:
             self.do_analysis()
         finally:
+            self.executor.close()
             # TODO: Not really the right place for it?
             the_config.database.close()
+            if the_config.result_cache is not None:
+                the_config.result_cache.close()
+                the_config.result_cache = None
+            if self.staging_path is not None:
+                shutil.rmtree(self.staging_path, ignore_errors=True)
         return self.results
 
 
 
     def make_alignment(self, source_alignment_path):
-        # Make the alignment
+        # We keep a binary copy of the alignment from the last run, so if the
+        # source hasn't changed we can just map that instead of parsing it
+        folder = the_config.start_tree_path
+        source_digest = alignment.file_digest(source_alignment_path)
+        index = alignment.read_cache_index(folder)
+        self.alignment_path = os.path.join(folder, 'source.phy')
+
         self.alignment = Alignment()
-        self.alignment.read(source_alignment_path)
+        if index is not None and index['source_digest'] == source_digest:
+            if self.alignment.load_cache(folder, index):
+                log.info("Using the cached copy of alignment file '%s'",
+                         source_alignment_path)
+                return
 
-        # TODO REMOVE -- this should be part of the checking procedure
-        # We start by copying the alignment
-        self.alignment_path = os.path.join(the_config.start_tree_path, 'source.phy')
-        if os.path.exists(self.alignment_path):
-            # Make sure it is the same
+        self.alignment.read_shared(source_alignment_path, source_digest)
+
+        if index is not None:
+            # The file has changed, but maybe not what is in it
+            if index['digest'] != self.alignment.digest():
+                log.error("""Alignment file has changed since previous run. You
+                     need to use the force-restart option.""")
+                raise AnalysisError
+        elif os.path.exists(self.alignment_path):
+            # An analysis from before we kept the cache, so compare it the
+            # slow way
             old_align = Alignment()
             old_align.read(self.alignment_path)
             if not old_align.same_as(self.alignment):
@@ -122,10 +178,11 @@ class Analysis(object):
                      need to use the force-restart option.""")
                 raise AnalysisError
 
-
         else:
             self.alignment.write(self.alignment_path)
 
+        self.alignment.save_cache(folder, source_digest)
+
     def need_new_tree(self, tree_path):
         if os.path.exists(tree_path):
             if ';' in open(tree_path).read():
@@ -149,7 +206,14 @@ class Analysis(object):
             self.alignment, subset_with_everything)
         self.filtered_alignment_path = os.path.join(
             the_config.start_tree_path,  'filtered_source.phy')
-        self.filtered_alignment.write(self.filtered_alignment_path)
+
+        # Only write it if it has changed, as it is the same on most restarts
+        digest_path = self.filtered_alignment_path + '.digest'
+        digest = self.filtered_alignment.digest()
+        if not (os.path.exists(self.filtered_alignment_path) and
+                alignment.read_digest(digest_path) == digest):
+            self.filtered_alignment.write(self.filtered_alignment_path)
+            alignment.write_digest(digest_path, digest)
 
         # Check the full subset against the alignment
         subset_ops.check_against_alignment(subset_with_everything, self.alignment, the_config)
@@ -167,7 +231,10 @@ class Analysis(object):
 
             # If we have a user tree, then use that, otherwise, create a topology
             util.clean_out_folder(the_config.start_tree_path,
-                                  keep=["filtered_source.phy", "source.phy"])
+                                  keep=["filtered_source.phy",
+                                        "filtered_source.phy.digest",
+                                        "source.phy", alignment.CACHE_DATA,
+                                        alignment.CACHE_INDEX])
 
             if user_path is not None and user_path != "":
                 # Copy it into the start tree folder
@@ -211,92 +278,95 @@ class Analysis(object):
         log.debug("Starting tree with branch lengths is here: %s" %
                  self.tree_path)
 
-    def run_task(self, model_name, sub):
-        # This bit should run in parallel (forking the processor)
-        try:
-            the_config.processor.analyse(
-                model_name,
-                sub.alignment_path,
-                self.tree_path,
-                the_config.branchlengths,
-                the_config.cmdline_extras
-            )
-            fabricate = False
-        except ExternalProgramError:
-            if not the_config.suppress_errors:
-                # In the Kmeans algorithm we suppress errors and "fabricate"
-                # subsets (we assume the error is because the subset is too
-                # small for analysis)
-                raise
-
-            # If it is kmeans we assume that the error is because the subset
-            # is too small or unanalysable, so we fabricate it
-            log.debug("New subset could not be analysed. It will be merged "
-                        "at the end of the analysis")
-            fabricate = True
-
-        # Not entirely sure that WE NEED to block here, but it is safer to do
-        # It shouldn't hold things up toooo long...
-        self.lock.acquire()
-        try:
-            if fabricate:
-                sub.fabricate_model_result(the_config, model_name)
-            else:
-                sub.parse_model_result(the_config, model_name)
-
-            # Try finalising, then the result will get written out earlier...
-            sub.finalise(the_config)
-        finally:
-            self.lock.release()
-
-    def add_tasks_for_sub(self, tasks, sub):
+    def record_outcome(self, outcome):
+        sub = self.pending[outcome.subset_id]
+        model_name = outcome.model
+
+        if outcome.status == executors.DONE:
+            the_config.cost_model.task_done(
+                sub, model_name, outcome.seconds, outcome.cpus)
+            if outcome.cpus > 1:
+                # The stored runtimes are only used to fit the cost model, so
+                # they are all kept as if they had run on one thread
+                outcome.record['seconds'] = costmodel.single_thread_seconds(
+                    outcome.record['seconds'], outcome.cpus)
+            sub.add_model_record(the_config, model_name, outcome.record)
+            if the_config.result_cache is not None:
+                the_config.result_cache.put(
+                    sub.alignment_digest, model_name, outcome.record)
+            # Remove the current model from remaining ones
+            sub.models_not_done.remove(model_name)
+        elif outcome.status == executors.FABRICATED:
+            sub.fabricate_model_result(the_config, model_name)
+        elif outcome.status == executors.PARSE_FAILED:
+            # We've just run this. And we're screwed.
+            log.error(
+                "Failed to run models %s; not sure why",
+                ", ".join(list(sub.models_not_done)))
+            raise ParseError
+        elif outcome.status == executors.FAILED:
+            if isinstance(outcome.error, BaseException):
+                raise outcome.error
+            raise ExternalProgramError(*outcome.error)
+
+        # Try finalising, then the result will get written out earlier...
+        if sub.finalise(the_config):
+            self.pending.pop(sub.subset_id, None)
+
+    def cpus_for_task(self, sub, model):
+        """Give more than one cpu to the jobs that would otherwise hold us up
+
+        A job that is predicted to take longer than each cpu's share of the
+        remaining work gets a proportional number of threads, as long as the
+        subset is big enough for RAxML to make use of them.
+        """
+        if not the_config.adaptive_threads or self.threads == 1:
+            return 1
+        share = the_config.cost_model.share_of_remaining(sub, model)
+        cpus = min(int(share * self.threads),
+                   raxml.max_useful_threads(
+                       len(sub.column_set), the_config.datatype),
+                   self.threads)
+        if cpus > 1:
+            log.debug("Using %d threads for %s on %s", cpus, model, sub)
+        return max(cpus, 1)
+
+    def tasks_for_sub(self, sub):
+        self.pending[sub.subset_id] = sub
         for m in sub.models_to_process:
-            tasks.append((self.run_task, (m, sub)))
-
-    def run_concurrent(self, tasks):
-        for func, args in tasks:
-            func(*args)
-
-    def run_threaded(self, tasks):
-        if not tasks:
-            return
-        pool = threadpool.Pool(tasks, self.threads)
-        pool.join()
+            yield executors.ModelTask(
+                sub, m, the_config.suppress_errors, self.cpus_for_task(sub, m))
+
+    def generate_tasks(self, subsets):
+        """Prepare each subset only when the executor wants its tasks"""
+        for sub in subsets:
+            if sub.is_done:
+                continue
+            if not sub.is_prepared:
+                sub.prepare(the_config, self.alignment)
+            for task in self.tasks_for_sub(sub):
+                yield task
 
     def analyse_list_of_subsets(self, all_subsets, ):
         # get a whole list of subsets analysed in parallel
 
-        # analyse bigger subsets first, for efficiency
-        all_subsets.sort(key = lambda x: 1.0/float(len(x.columns)))
-
-        # chunk the list into blocks of ~1000 tasks 
-        # in empirical testing, this speeds things up lot
-        # though we are not entirely sure why...
-        n = 1000        
-        n = int(n / len(the_config.models))
-        if(n<1): n=1 # seems unlikely...
-
-        log.debug("chunk size (in number of subsets) = %d", n)
-
-        subset_chunks = [all_subsets[i:i + n] for i in range(0, len(all_subsets), n)]
-        
-        for subsets in subset_chunks:
-            # prepare the list of tasks
-            tasks = []
-            for sub in subsets:
-                if sub.is_done:
-                    pass
-                elif sub.is_prepared:
-                    self.add_tasks_for_sub(tasks, sub)
-                else:
-                    sub.prepare(the_config, self.alignment)
-                    self.add_tasks_for_sub(tasks, sub)
-            if tasks:
-                # Now do the analysis
-                if self.threads == 1:
-                    self.run_concurrent(tasks)
-                else:
-                    self.run_threaded(tasks)
+        # analyse the slowest subsets first, for efficiency. This is the
+        # longest-processing-time-first rule, which stops one big job being
+        # left running on its own at the end
+        cost_model = the_config.cost_model
+        cost_model.begin(all_subsets, self.threads)
+        all_subsets.sort(key = lambda x: -cost_model.predict_subset(x))
+
+        # The executor keeps a bounded number of tasks in flight and pulls the
+        # next one as each finishes, so we never wait for a whole batch to
+        # finish before starting the next
+        try:
+            self.executor.run(
+                self.generate_tasks(all_subsets), self.record_outcome)
+        finally:
+            self.pending.clear()
+            # The end of a step is a good time to write the results out
+            the_config.database.flush()
 
         # Now see if we're done
         for sub in all_subsets:
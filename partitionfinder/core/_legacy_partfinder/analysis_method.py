@@ -20,7 +20,6 @@ import math
 import scheme
 import submodels
 from analysis import Analysis, AnalysisError
-from alignment import SubsetAlignment
 import neighbour
 import kmeans
 from subset import Subset
@@ -166,6 +165,10 @@ class GreedyAnalysis(Analysis):
 
         subsets = [s for s in start_scheme.subsets]
 
+        # The change in info score from merging each pair of subsets, which
+        # starts off as inf for every pair
+        c_matrix = neighbour.CMatrix(subsets)
+
         step = 1
         while len(set(start_scheme.subsets)) > 1:
             with logtools.indented(log, "***Greedy algorithm step %d***" % step):
@@ -180,12 +183,6 @@ class GreedyAnalysis(Analysis):
                 d_matrix = np.zeros((((dim*dim)-dim))//2)
                 d_matrix[:] = np.inf
 
-                if step == 1:
-                    # Now initialise a change in info score matrix to inf
-                    c_matrix = np.empty(d_matrix.shape)
-                    c_matrix[:] = np.inf
-                    c_matrix = spatial.distance.squareform(c_matrix)
-
                 # 1. pick top N subset pairs from distance matrix
                 cutoff = max_schemes # this defines the greedy algorithm: we look at all schemes
 
@@ -193,7 +190,7 @@ class GreedyAnalysis(Analysis):
                     subsets, the_config, cutoff, d_matrix)
 
                 # 2. analyse subsets in top N that have not yet been analysed
-                pairs_todo = neighbour.get_pairs_todo(closest_pairs, c_matrix, subsets)
+                pairs_todo = c_matrix.pairs_todo(closest_pairs)
                 if len(pairs_todo)>0:
                     log.info("Analysing %d new subset pairs" % len(pairs_todo))
                     new_subs = []
@@ -219,15 +216,15 @@ class GreedyAnalysis(Analysis):
                         diff = r.score - start_score
                         diffs.append(diff)
 
-                    c_matrix = neighbour.update_c_matrix(c_matrix, sub_tuples, subsets, diffs)
+                    c_matrix.update(sub_tuples, diffs)
 
 
                 # 4. Find the best pair of subsets, and build a scheme based on that
-                # note that this matrix includes diagonals, which will all be zero
-                # since this is equivalent to comparing a scheme to itself.
+                # note that this is 0 if no merge improves the score (it is
+                # equivalent to comparing a scheme to itself),
                 # so we need to be careful to only proceed if we have a negative change
                 # which indicates an improvement in the score
-                best_change = np.amin(c_matrix)
+                best_change = c_matrix.best_change()
 
                 log.debug("Biggest improvement in info score: %s", str(best_change))
 
@@ -235,7 +232,7 @@ class GreedyAnalysis(Analysis):
                     log.info("Found no schemes that improve the score, stopping")
                     break
 
-                best_pair = neighbour.get_best_pair(c_matrix, best_change, subsets)
+                best_pair = c_matrix.best_pair(best_change)
 
                 best_merged = subset_ops.merge_subsets(best_pair)
                 best_scheme = neighbour.make_clustered_scheme(
@@ -261,11 +258,10 @@ class GreedyAnalysis(Analysis):
                 log.debug("Best pair: %s", str([s.name for s in best_pair]))
                 log.debug("Merged into: %s", str([best_merged.name]))
 
-                # 5. reset_c_matrix and the subset list
-                c_matrix = neighbour.reset_c_matrix(c_matrix, list(best_pair), [best_merged], subsets)
-
-                # we updated the subset list in a special way, which matches how we update the c matrix:
-                subsets = neighbour.reset_subsets(subsets, list(best_pair), [best_merged])
+                # 5. swap the pair for the merged subset in the c matrix, which
+                # keeps the subset list in the same order as before
+                c_matrix.merge(list(best_pair), [best_merged])
+                subsets = c_matrix.subsets
 
                 if not the_config.quick:
                     the_config.reporter.write_scheme_summary(
@@ -302,7 +298,7 @@ class RelaxedClusteringAnalysis(Analysis):
                     subsets = [s for s in start_scheme.subsets]
 
                     # sort the subsets, to keep results consistent over re-runs
-                    subsets.sort(key = lambda x: 1.0/float(len(x.columns)))
+                    subsets.sort(key = lambda x: 1.0/float(len(x.column_set)))
 
                     # run through all subsets
                     for i, sub in enumerate(subsets):
@@ -310,7 +306,7 @@ class RelaxedClusteringAnalysis(Analysis):
                         state_problems = self.alignment.check_state_probs(sub, the_config)
 
                         if  (
-                                len(sub.columns) < the_config.min_subset_size or
+                                len(sub.column_set) < the_config.min_subset_size or
                                 state_problems == True
                             ):
 
@@ -375,6 +371,18 @@ class RelaxedClusteringAnalysis(Analysis):
 
         subsets = [s for s in start_scheme.subsets]
         partnum = len(subsets)
+
+        # The change in info score from merging each pair of subsets. We only
+        # analyse the closest pairs, so most of these stay inf
+        c_matrix = neighbour.CMatrix(subsets, sparse=True)
+
+        # The distances between subsets, and the closest pairs. Merging
+        # only changes the distances to the merged subsets (unless it changes
+        # one of the largest, which we normalise by), so we keep these up to
+        # date rather than measuring everything again each step
+        d_matrix = neighbour.DistanceMatrix(subsets, the_config.cluster_weights)
+        ranking = None
+
         step = 1
         while True:
             with logtools.indented(log, "*** Relaxed clustering algorithm step %d of up to %d ***"
@@ -383,14 +391,6 @@ class RelaxedClusteringAnalysis(Analysis):
                 # get distances between subsets
                 max_schemes = comb(len(start_scheme.subsets), 2)
                 log.info("Measuring the similarity of %d subset pairs" % max_schemes)
-                d_matrix = neighbour.get_distance_matrix(subsets,
-                    the_config.cluster_weights)
-
-                if step == 1:
-                    # Now initialise a change in info score matrix to inf
-                    c_matrix = np.empty(d_matrix.shape)
-                    c_matrix[:] = np.inf
-                    c_matrix = spatial.distance.squareform(c_matrix)
 
                 # 1. pick top N subset pairs from distance matrix
                 cutoff = int(math.ceil(max_schemes * (the_config.cluster_percent * 0.01)))
@@ -398,11 +398,12 @@ class RelaxedClusteringAnalysis(Analysis):
                 if the_config.cluster_max != None and cutoff > the_config.cluster_max:
                     cutoff = the_config.cluster_max
                 log.info("Choosing the %d most similar subset pairs" % cutoff)
-                closest_pairs = neighbour.get_N_closest_subsets(
-                    subsets, the_config, cutoff, d_matrix)
+                if ranking is None:
+                    ranking = neighbour.PairRanking(subsets, d_matrix.condensed, cutoff)
+                closest_pairs = ranking.closest(cutoff)
 
                 # 2. analyse K subsets in top N that have not yet been analysed
-                pairs_todo = neighbour.get_pairs_todo(closest_pairs, c_matrix, subsets)
+                pairs_todo = c_matrix.pairs_todo(closest_pairs)
                 if len(pairs_todo)>0:
                     log.info("Analysing %d new subset pairs" % len(pairs_todo))
                     new_subs = []
@@ -428,25 +429,25 @@ class RelaxedClusteringAnalysis(Analysis):
                         diff = r.score - start_score
                         diffs.append(diff)
 
-                    c_matrix = neighbour.update_c_matrix(c_matrix, sub_tuples, subsets, diffs)
+                    c_matrix.update(sub_tuples, diffs)
 
                 # 4. Find the best pair of subsets, and build a scheme based on that
-                # note that this matrix includes diagonals, which will all be zero
-                # since this is equivalent to comparing a scheme to itself.
+                # note that this is 0 if no merge improves the score (it is
+                # equivalent to comparing a scheme to itself),
                 # so we need to be careful to only proceed if we have a negative change
                 # which indicates an improvement in the score
-                best_change = np.amin(c_matrix)
+                best_change = c_matrix.best_change()
                 best_scheme = start_scheme
 
                 if best_change>=0:
                     log.info("Found no schemes that improve the score, stopping")
                     break
 
-                median_improvement = np.median(c_matrix[c_matrix<0])
+                median_improvement = c_matrix.median_improvement()
 
                 while best_change <= median_improvement:
 
-                    best_pair = neighbour.get_best_pair(c_matrix, best_change, subsets)
+                    best_pair = c_matrix.best_pair(best_change)
                     best_merged = subset_ops.merge_subsets(best_pair)
                     best_scheme = neighbour.make_clustered_scheme(
                         start_scheme, scheme_name, best_pair, best_merged, the_config)
@@ -455,13 +456,20 @@ class RelaxedClusteringAnalysis(Analysis):
                     log.info("Combining subsets: '%s' and '%s'" %(best_pair[0].name, best_pair[1].name))
                     log.debug("This improves the %s score by: %s", the_config.model_selection, str(abs(best_change)))
 
-                    # reset_c_matrix and the subset list
-                    c_matrix = neighbour.reset_c_matrix(c_matrix, list(best_pair), [best_merged], subsets)
+                    # swap the pair for the merged subset in the c matrix, which
+                    # keeps the subset list in the same order as before
+                    c_matrix.merge(list(best_pair), [best_merged])
+                    subsets = c_matrix.subsets
 
-                    # we update the subset list in a way that means its structure tracks the c-matrix
-                    subsets = neighbour.reset_subsets(subsets, list(best_pair), [best_merged])
+                    if d_matrix.merge(list(best_pair), best_merged):
+                        # all of the distances changed
+                        ranking.invalidate()
+                        ranking.merge(list(best_pair), best_merged)
+                    else:
+                        ranking.merge(list(best_pair), best_merged,
+                                      d_matrix.distances_to(best_merged))
 
-                    best_change = np.amin(c_matrix)
+                    best_change = c_matrix.best_change()
 
                     if the_config.search == 'rcluster':
                         break
@@ -519,43 +527,54 @@ class RelaxedClusteringAnalysis(Analysis):
 class KmeansAnalysis(Analysis):
 
 
+    def can_split(self, sub):
+        # here we can test if the alignment has all states:
+        state_probs = self.alignment.check_state_probs(sub, the_config)
+
+        return not (
+                len(sub.column_set) == 1 or
+                len(sub.column_set) < the_config.min_subset_size or
+                state_probs == True or
+                sub.dont_split == True
+            )
+
     def split_subsets(self, start_subsets, tree_path):
+        # Clustering the sites of each subset is independent, so we do that
+        # for all of them at once (on all the cores), and then make the new
+        # subsets in order, so we get the same subsets as doing it one by one
+        to_split = [sub for sub in start_subsets if self.can_split(sub)]
+        clusters = dict(zip(to_split, kmeans.cluster_subsets(
+            the_config, self.alignment, to_split, self.threads)))
+
         split_subs = {}
         for i, sub in enumerate(start_subsets):
 
-            # here we can test if the alignment has all states:
-            state_probs = self.alignment.check_state_probs(sub, the_config)
-
-            if  (
-                    len(sub.columns) == 1 or
-                    len(sub.columns) < the_config.min_subset_size or
-                    state_probs == True or
-                    sub.dont_split == True
-                ):
+            if sub not in clusters:
                 split_subs[sub] = [sub]
-                log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.columns)))
+                log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.column_set)))
             else:
                 split = kmeans.kmeans_split_subset(
-                    the_config, self.alignment, sub, tree_path, n_jobs=self.threads)
+                    the_config, self.alignment, sub, tree_path,
+                    n_jobs=self.threads, clusters=clusters[sub])
 
                 if split == 1:  # we couldn't analyse the big subset
                     sub.dont_split = True # never try to split this subset again
                     split_subs[sub] = [sub]  # so we keep it whole
-                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.columns)))
+                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.column_set)))
 
                 elif len(split) == 1:
                     # in some cases (i.e. all site params are equal) kmeans
                     # cannot split subsets, so we get back the same as we put in
                     sub.dont_split = True # never try to split this subset again
                     split_subs[sub] = [sub]  # so we keep it whole
-                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.columns)))
+                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.column_set)))
 
-                elif min([len(split[0].columns), len(split[1].columns)]) < the_config.min_subset_size:
+                elif min([len(split[0].column_set), len(split[1].column_set)]) < the_config.min_subset_size:
                     # we don't split it if either of the two daughter subset was
                     # smaller than the minimum allowable size
                     sub.dont_split = True # never try to split this subset again
                     split_subs[sub] = [sub]  # so we keep it whole
-                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.columns)))
+                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.column_set)))
 
                 elif (
                         self.alignment.check_state_probs(split[0], the_config) or
@@ -565,12 +584,12 @@ class KmeansAnalysis(Analysis):
                     # the state frequencies
                     sub.dont_split = True # never try to split this subset again
                     split_subs[sub] = [sub]  # so we keep it whole
-                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.columns)))
+                    log.info("Subset %d: %d sites not splittable" %(i+1, len(sub.column_set)))
 
                 else:  # we could analyse the big subset
                     split_subs[sub] = split  # so we split it into >1
                     log.info("Subset %d: %d sites split into %d and %d"
-                            %(i+1, len(sub.columns), len(split[0].columns), len(split[1].columns)))
+                            %(i+1, len(sub.column_set), len(split[0].column_set), len(split[1].column_set)))
 
         return split_subs
 
@@ -580,9 +599,9 @@ class KmeansAnalysis(Analysis):
         for s in start_subsets:
 
             # here we put a sensible lower limit on the size of subsets
-            if len(s.columns) < the_config.min_subset_size:
+            if len(s.column_set) < the_config.min_subset_size:
                 s.fabricated = True
-                log.debug("Subset %s with only %d sites found" %(s.subset_id, len(s.columns)))
+                log.debug("Subset %s with only %d sites found" %(s.subset_id, len(s.column_set)))
 
             # here we can test if the alignment has all states:
             state_probs = self.alignment.check_state_probs(s, the_config)
@@ -611,11 +630,11 @@ class KmeansAnalysis(Analysis):
                         if s.centroid == None:
                             s.centroid = [0.0]
                             log.debug("Fixed a subset with a centroid of None")
-                            log.debug("The subset has %d columns" % len(s.columns))
+                            log.debug("The subset has %d columns" % len(s.column_set))
 
                     s = fabricated_subsets.pop(0)
 
-                    log.debug("Working on fabricated subset %s with %d sites" %(s.subset_id, len(s.columns)))
+                    log.debug("Working on fabricated subset %s with %d sites" %(s.subset_id, len(s.column_set)))
                     log.info("Finalising subset %d", i)
                     i = i+1
 
@@ -650,7 +669,7 @@ class KmeansAnalysis(Analysis):
                     self.analyse_list_of_subsets([merged_sub])
 
                     # here we put a sensible lower limit on the size of subsets
-                    if len(merged_sub.columns)<the_config.min_subset_size:
+                    if len(merged_sub.column_set)<the_config.min_subset_size:
                         merged_sub.fabricated = True
 
                     # if joined has to be fabricated, add to fabricated list
@@ -670,7 +689,7 @@ class KmeansAnalysis(Analysis):
     def build_new_subset_list(self, name_prefix, split_subs, start_subsets):
         new_scheme_subs = []
         for i, sub in enumerate(start_subsets):
-            if len(sub.columns) == 1:
+            if len(sub.column_set) == 1:
                 new_scheme_subs.append(sub)
                 log.debug("Split %d: parent subset has only one site, %s unchanged" %
                          (i+1, the_config.model_selection.upper()))
@@ -798,7 +817,7 @@ class KmeansAnalysis(Analysis):
         start_scheme = scheme.create_scheme(
             the_config, "start_scheme", start_description)
 
-        site_max = sum([ len(s.columns) for s in start_scheme.subsets])
+        site_max = sum([ len(s.column_set) for s in start_scheme.subsets])
 
         if the_config.min_subset_size > site_max:
             log.error("The minimum subset size must be smaller than the \
@@ -882,7 +901,7 @@ class KmeansAnalysis(Analysis):
 
         # get entropies for whole alignment for this subset
         onesub = subset_ops.merge_subsets(subsets)
-        entropies = entropy.sitewise_entropies(SubsetAlignment(self.alignment, onesub))
+        entropies = entropy.subset_entropies(self.alignment, onesub)
 
         # find nearest site for each invariant site
         # replacements is a dict of: key: invariant col; value: replacement col,
@@ -0,0 +1,200 @@
+# Copyright (C) 2012-2013 Robert Lanfear and Brett Calcott
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details. You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# PartitionFinder also includes the PhyML program, the RAxML program, and the
+# PyParsing library, all of which are protected by their own licenses and
+# conditions, using PartitionFinder implies that you agree with those licences
+# and conditions as well.
+
+"""A compact set of alignment columns
+
+A ColumnSet holds the (zero based) columns of a subset as the bits of a
+single python integer. That is one bit per site, rather than the ~70 bytes
+per site of a python set, and union, intersection and the overlap test are
+done a machine word at a time by python's long integer code.
+
+The bitset bytes also give us a cheap, stable identity for a subset (see
+digest).
+"""
+
+import hashlib
+import numpy
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+
+
+def _bits_from_columns(columns):
+    cols = numpy.fromiter(columns, dtype=numpy.int64)
+    if not len(cols):
+        return 0, 0
+    if cols.min() < 0:
+        raise ValueError("Columns can't be negative")
+    flags = numpy.zeros(int(cols.max()) + 1, dtype=bool)
+    flags[cols] = True
+    packed = numpy.packbits(flags, bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little'), int(flags.sum())
+
+
+def _strided_bits(count, step):
+    """count bits, each step apart, starting at bit 0"""
+    # The sum of 2 ** (step * i), for i in range(count)
+    return ((1 << (step * count)) - 1) // ((1 << step) - 1)
+
+
+class ColumnSet(object):
+    """An immutable set of columns, stored as a bitset"""
+    __slots__ = ('bits', '_count')
+
+    def __init__(self, columns=()):
+        if isinstance(columns, ColumnSet):
+            self.bits, self._count = columns.bits, columns._count
+        else:
+            self.bits, self._count = _bits_from_columns(columns)
+
+    @classmethod
+    def from_bits(cls, bits):
+        obj = object.__new__(cls)
+        obj.bits = bits
+        obj._count = None
+        return obj
+
+    @classmethod
+    def from_range(cls, start, stop, step=1):
+        """The columns in range(start, stop, step)"""
+        if stop <= start:
+            return cls.from_bits(0)
+        count = (stop - start + step - 1) // step
+        return cls.from_bits(_strided_bits(count, step) << start)
+
+    @classmethod
+    def union_all(cls, column_sets):
+        bits = 0
+        for cs in column_sets:
+            bits |= cs.bits
+        return cls.from_bits(bits)
+
+    def to_bytes(self):
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+
+    def to_array(self):
+        """The columns as a sorted numpy array"""
+        flags = numpy.unpackbits(
+            numpy.frombuffer(self.to_bytes(), dtype=numpy.uint8),
+            bitorder='little')
+        return numpy.flatnonzero(flags)
+
+    def to_list(self):
+        """The columns as a sorted list of python ints"""
+        return self.to_array().tolist()
+
+    def digest(self):
+        """A 32 character hex id for these columns
+
+        This is blake2b over the bitset bytes, which is much faster than
+        pickling a list of the columns. It isn't there for security, just to
+        give the same columns the same name every time.
+        """
+        return hashlib.blake2b(self.to_bytes(), digest_size=16).hexdigest()
+
+    def as_slice(self):
+        """A slice that picks out just these columns, or None
+
+        There is one when the columns are evenly spaced, like a data block
+        or a codon position in one.
+        """
+        if not self.bits:
+            return None
+        start = self.min()
+        if len(self) == 1:
+            return slice(start, start + 1)
+        rest = self.bits >> (start + 1)
+        step = (rest & -rest).bit_length()
+        if self.bits != _strided_bits(len(self), step) << start:
+            return None
+        return slice(start, self.max() + 1, step)
+
+    def min(self):
+        if not self.bits:
+            raise ValueError("min() of an empty ColumnSet")
+        return (self.bits & -self.bits).bit_length() - 1
+
+    def max(self):
+        if not self.bits:
+            raise ValueError("max() of an empty ColumnSet")
+        return self.bits.bit_length() - 1
+
+    def isdisjoint(self, other):
+        return not (self.bits & _as_column_set(other).bits)
+
+    def __len__(self):
+        if self._count is None:
+            self._count = _popcount(self.bits)
+        return self._count
+
+    def __bool__(self):
+        return self.bits != 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __contains__(self, column):
+        return column >= 0 and bool((self.bits >> column) & 1)
+
+    def __or__(self, other):
+        return ColumnSet.from_bits(self.bits | _as_column_set(other).bits)
+
+    def __and__(self, other):
+        return ColumnSet.from_bits(self.bits & _as_column_set(other).bits)
+
+    def __sub__(self, other):
+        return ColumnSet.from_bits(self.bits & ~_as_column_set(other).bits)
+
+    __ror__ = __or__
+    __rand__ = __and__
+
+    def __rsub__(self, other):
+        return _as_column_set(other) - self
+
+    def __eq__(self, other):
+        if isinstance(other, ColumnSet):
+            return self.bits == other.bits
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and self.bits == ColumnSet(other).bits
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __reduce__(self):
+        return (ColumnSet.from_bits, (self.bits, ))
+
+    def __repr__(self):
+        return "ColumnSet(%d columns)" % len(self)
+
+
+def _as_column_set(columns):
+    if isinstance(columns, ColumnSet):
+        return columns
+    return ColumnSet(columns)
@@ -47,7 +47,11 @@ class Configuration(object):
                  save_phylofiles=False, cmdline_extras="", cluster_weights=None,
                  cluster_percent=10.0, cluster_max=-987654321, kmeans='entropy', 
                  quick=False, min_subset_size = 100, all_states = False, 
-                 no_ml_tree = False):
+                 no_ml_tree = False, executor = 'thread',
+                 adaptive_threads = False, listen = None, authkey = None,
+                 staging_dir = None, subset_memory = None,
+                 database_backend = 'hdf5', result_cache_path = None,
+                 result_cache_size = None):
 
         log.info("------------- Configuring Parameters -------------")
         # Only required if user adds them
@@ -56,6 +60,7 @@ class Configuration(object):
         self.user_subsets_by_name = {}
         self.models = []
         self.database = None
+        self.cost_model = None
         self.suppress_errors = False
 
         self.save_phylofiles = save_phylofiles
@@ -68,6 +73,16 @@ class Configuration(object):
         self.min_subset_size = min_subset_size
         self.all_states = all_states
         self.no_ml_tree = no_ml_tree
+        self.executor = executor
+        self.adaptive_threads = adaptive_threads
+        self.listen = listen
+        self.authkey = authkey
+        self.staging_dir = staging_dir
+        self.subset_memory = subset_memory
+        self.database_backend = database_backend
+        self.result_cache_path = result_cache_path
+        self.result_cache_size = result_cache_size
+        self.result_cache = None
 
 
 
@@ -91,6 +106,20 @@ class Configuration(object):
             log.error("Phylogeny program must be 'phyml' or 'raxml'")
             raise ConfigurationError
 
+        if adaptive_threads and phylogeny_program != "raxml":
+            log.error("Adaptive threads need the Pthreads version of RAxML. "
+                      "Please add '--raxml' to your commandline")
+            raise ConfigurationError
+
+        if subset_memory is not None and subset_memory <= 0:
+            log.error("--subset-memory must be more than zero")
+            raise ConfigurationError
+        subset.set_cache_budget(subset_memory)
+
+        if result_cache_size is not None and result_cache_size <= 0:
+            log.error("--result-cache-size must be more than zero")
+            raise ConfigurationError
+
         if datatype == "morphology":
             if phylogeny_program != "raxml":
                 log.error("RAxML must be used for morphological data. Please add '--raxml' to your commandline")
@@ -418,7 +447,9 @@ class Configuration(object):
         else:
             topology = open(self.user_tree_topology_path).read()
 
-        datablocks = [(s.names, s.description, s.column_set) for s in self.user_subsets]
+        # Plain sets, so this compares equal to what older versions saved
+        datablocks = [(s.names, s.description, set(s.column_set))
+                      for s in self.user_subsets]
 
         restart_info = {
             'alignment' : self.alignment,
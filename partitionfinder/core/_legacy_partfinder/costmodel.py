@@ -0,0 +1,241 @@
+# Copyright (C) 2012-2013 Robert Lanfear and Brett Calcott
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details. You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# PartitionFinder also includes the PhyML program, the RAxML program, and the
+# PyParsing library, all of which are protected by their own licenses and
+# conditions, using PartitionFinder implies that you agree with those licences
+# and conditions as well.
+
+"""Predict how long a model will take to run on a subset
+
+We model the runtime as
+
+    seconds = scale[model] * sites ** power
+
+where seconds is how long it would take on one thread. The taxa, datatype and
+program are fixed for an analysis (and for the database that goes with it), so
+they just fold into the per-model scale. The fit uses the runtimes stored in
+the database, plus the ones we see as the analysis runs. The database only
+knows the subset ids, so we learn the site counts of its rows as those subsets
+turn up in the analysis. Until we have seen anything, we fall back on the old
+get_model_difficulty guess, which gives the same ordering as before.
+"""
+
+import logtools
+log = logtools.get_logger()
+
+import math
+import collections
+
+# Runtimes in the database are whole seconds, so a zero means "under a second"
+_MIN_DB_SECONDS = 0.5
+_MIN_SECONDS = 0.001
+
+# Don't let a few noisy points give us something silly
+_MIN_POWER, _MAX_POWER = 0.5, 2.0
+
+# Roughly how much of each extra thread a multi-threaded run makes use of.
+# We only give subsets more threads when they are big enough to use them (see
+# raxml.max_useful_threads), but the threads never scale perfectly.
+THREAD_EFFICIENCY = 0.75
+
+
+def single_thread_seconds(seconds, cpus):
+    """How long a run that took this long on `cpus` threads would take on
+    one"""
+    return float(seconds) * (1.0 + (cpus - 1) * THREAD_EFFICIENCY)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class CostModel(object):
+    def __init__(self, cfg):
+        self.cfg = cfg
+        # model -> [(log sites, log seconds)]
+        self.samples = collections.defaultdict(list)
+        # subset_id -> [(model, seconds)], for database rows where we don't
+        # know the sites yet, and model -> [total seconds, count] of them
+        self.stored = {}
+        self.unsized = collections.defaultdict(lambda: [0.0, 0])
+        self.legacy_ids = False
+        self.power = 1.0
+        self.scale = {}
+        self.per_difficulty = None
+        self.count = 0
+        self.count_at_fit = None
+        self.observed = 0
+
+        # Keeping track of the work outstanding, for the progress report
+        self.planned = {}
+        self.remaining = 0.0
+        self.workers = 1
+        self.predicted_done = 0.0
+        self.actual_done = 0.0
+
+    def load(self, database):
+        """Pick up the runtimes stored in the database"""
+        subset_ids, model_ids, seconds = database.get_timings()
+        for sid, mod, secs in zip(subset_ids, model_ids, seconds):
+            mod = _text(mod)
+            secs = max(float(secs), _MIN_DB_SECONDS)
+            self.stored.setdefault(_text(sid), []).append((mod, secs))
+            self.unsized[mod][0] += secs
+            self.unsized[mod][1] += 1
+        self.legacy_ids = database.legacy_ids
+        log.debug("Loaded %d runtimes for %d subsets from the database",
+                  len(seconds), len(self.stored))
+        self.count_at_fit = None
+
+    def size_stored(self, subsets):
+        """Use the site counts of these subsets for their stored runtimes"""
+        if not self.stored:
+            return
+        sized = 0
+        for sub in subsets:
+            rows = self.stored.pop(sub.subset_id, None)
+            if rows is None and self.legacy_ids:
+                rows = self.stored.pop(sub.legacy_subset_id, None)
+            if rows is None:
+                continue
+            sites = len(sub.column_set)
+            for mod, secs in rows:
+                self.add_sample(mod, sites, secs)
+                unsized = self.unsized[mod]
+                unsized[0] -= secs
+                unsized[1] -= 1
+                if not unsized[1]:
+                    del self.unsized[mod]
+            sized += len(rows)
+        if sized:
+            log.debug("Found the site counts of %d stored runtimes", sized)
+
+    def add_sample(self, model, sites, seconds):
+        seconds = max(float(seconds), _MIN_SECONDS)
+        self.samples[model].append((math.log(max(sites, 1)), math.log(seconds)))
+        self.count += 1
+
+    def observe(self, model, sites, seconds):
+        """Add a runtime that we have just seen"""
+        self.add_sample(model, sites, seconds)
+        self.observed += 1
+
+    def fit(self):
+        # The power comes from the spread of site counts within each model,
+        # so that the differences between models don't confuse it
+        sxy = sxx = 0.0
+        for points in self.samples.values():
+            if len(points) < 2:
+                continue
+            mx = sum(x for x, y in points) / len(points)
+            my = sum(y for x, y in points) / len(points)
+            sxy += sum((x - mx) * (y - my) for x, y in points)
+            sxx += sum((x - mx) ** 2 for x, y in points)
+        if sxx > 1e-9:
+            self.power = min(max(sxy / sxx, _MIN_POWER), _MAX_POWER)
+
+        self.scale = {}
+        all_x = []
+        for mod, points in self.samples.items():
+            self.scale[mod] = math.exp(
+                sum(y - self.power * x for x, y in points) / len(points))
+            all_x.extend(x for x, y in points)
+
+        # Rows we can't size are assumed to be from typical subsets
+        if all_x:
+            typical = math.exp(self.power * sum(all_x) / len(all_x))
+        else:
+            typical = 1000.0 ** self.power
+        for mod, (total, count) in self.unsized.items():
+            if mod not in self.scale:
+                self.scale[mod] = total / count / typical
+
+        # And for models we have never run, scale the difficulty guess so it
+        # sits alongside the models we do know about
+        self.per_difficulty = None
+        known = [(m, s) for m, s in self.scale.items() if m in self.cfg.models]
+        if known:
+            self.per_difficulty = (
+                sum(s for m, s in known) /
+                sum(self.difficulty(m) for m, s in known))
+        self.count_at_fit = self.count
+
+    def difficulty(self, model):
+        return self.cfg.processor.models.get_model_difficulty(model) + 1.0
+
+    def predict(self, model, sites):
+        """Predicted seconds (or arbitrary units, if we're not calibrated)"""
+        # Refitting is not free, so only do it when we have learnt a bit more
+        if self.count_at_fit is None or \
+                self.count - self.count_at_fit > self.count_at_fit // 10:
+            self.fit()
+        scale = self.scale.get(model)
+        if scale is None:
+            if self.per_difficulty is None:
+                return self.difficulty(model) * sites
+            scale = self.per_difficulty * self.difficulty(model)
+        return scale * float(sites) ** self.power
+
+    def predict_subset(self, sub, models=None):
+        if models is None:
+            models = sub.models_not_done
+        sites = len(sub.column_set)
+        return sum(self.predict(m, sites) for m in models)
+
+    def begin(self, subsets, workers):
+        """Start tracking the work left in a list of subsets
+
+        We hold on to the predictions we make now, as the fit will move as
+        the results come in, and we need to compare like with like.
+        """
+        self.size_stored(subsets)
+        self.workers = max(workers, 1)
+        self.planned = {}
+        for sub in subsets:
+            if sub.is_done:
+                continue
+            sites = len(sub.column_set)
+            for m in sub.models_not_done:
+                self.planned[(sub.subset_id, m)] = self.predict(m, sites)
+        self.remaining = sum(self.planned.values())
+        self.predicted_done = 0.0
+        self.actual_done = 0.0
+
+    def task_done(self, sub, model, seconds, cpus=1):
+        # Everything we predict is for one thread
+        seconds = single_thread_seconds(seconds, cpus)
+        predicted = self.planned.pop((sub.subset_id, model), None)
+        if predicted is not None:
+            self.remaining = max(self.remaining - predicted, 0.0)
+            # Keep track of how far out we are, and correct for it
+            self.predicted_done += predicted
+            self.actual_done += max(float(seconds), _MIN_SECONDS)
+        self.observe(model, len(sub.column_set), seconds)
+
+    def share_of_remaining(self, sub, model):
+        """What fraction of the work left is this one task?"""
+        predicted = self.planned.get((sub.subset_id, model))
+        if predicted is None or self.remaining <= 0:
+            return 0.0
+        return predicted / self.remaining
+
+    def eta(self):
+        """Seconds until the current list of subsets is done, or None"""
+        if not self.observed:
+            return None
+        correction = 1.0
+        if self.predicted_done > 0:
+            correction = self.actual_done / self.predicted_done
+        return self.remaining * correction / self.workers
@@ -19,12 +19,16 @@ import logtools
 log = logtools.get_logger()
 
 import os
+import ast
+import time
 import numpy
 import tables
+import sqlite3
 from itertools import combinations
 
 import raxml_models
 import phyml_models
+from util import PartitionFinderError
 
 int_type = numpy.int32
 float_type = numpy.float32
@@ -39,6 +43,21 @@ def _model_string_maxlen():
     return 30
 
 
+# Results are written to the table in batches. We flush once we have this
+# many rows waiting, once the oldest has waited this many seconds, and at the
+# end of each step of the analysis. Until then they are kept in the journal.
+BATCH_ROWS = 256
+BATCH_SECONDS = 5.0
+
+# We hold the whole results table in memory when we preload it, if it is no
+# bigger than this
+PRELOAD_MAX_BYTES = 256 * 1024 * 1024
+
+# What the subset ids in the results table are made from. Tables written
+# before we recorded this used subset_ops.legacy_subset_name.
+SUBSET_ID_SCHEME = 'blake2b-columnset'
+
+
 class DataLayout(object):
     def __init__(self, letters=None):
         self.letters = letters
@@ -73,7 +92,7 @@ class DataLayout(object):
         return numpy.zeros(1, self.data_type)
 
     def make_datatype(self):
-        # 32 is the md5 length
+        # 32 is the length of the hex digest (md5 in older versions)
         subset_id_length = 32
         model_id_length = _model_string_maxlen()
 
@@ -115,12 +134,97 @@ class DataRecord(object):
             self.lnl, self.site_rate, self.seconds)
 
 
+class DatabaseError(PartitionFinderError):
+    pass
+
+
 class Database(object):
+    """Stores the result of every model we run on every subset
 
-    def __init__(self, cfg):
+    This is the interface the analysis uses. The backends below decide how
+    the results are kept, but they all store and hand back numpy records
+    with the layout from DataLayout.make_datatype.
+    """
+    name = None
+    filename = None
+
+    def __init__(self, cfg, path=None, dtype=None):
         self.cfg = cfg
-        self.path = os.path.join(self.cfg.subsets_path, 'data.db')
+        if path is None:
+            path = os.path.join(cfg.subsets_path, self.filename)
+        if dtype is None and cfg is not None:
+            dtype = cfg.data_layout.data_type
+        self.path = path
+        self.dtype = dtype
+        self.legacy_ids = False
+
+    def check_id_scheme(self, scheme):
+        # Older databases might hold results under the old subset ids. We
+        # move those over to the new ids as we come across them. We can't
+        # tell when they have all gone, so an old database stays marked as
+        # old.
+        if scheme != SUBSET_ID_SCHEME and self.is_empty():
+            scheme = SUBSET_ID_SCHEME
+            self.set_id_scheme(scheme)
+        self.legacy_ids = scheme != SUBSET_ID_SCHEME
+        if self.legacy_ids:
+            log.info("The results database uses the old subset ids, so I'll "
+                     "update them as they are used")
+
+    def set_id_scheme(self, scheme):
+        raise NotImplementedError
+
+    def get_results_for_subset(self, subset):
+        """All the stored records for this subset"""
+        raise NotImplementedError
+
+    def save_result(self, subset, n):
+        """Store record n of the subset's result_array"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Make sure everything we've been given is stored"""
+        pass
+
+    def get_timings(self):
+        """The subset, model and runtime of every stored result"""
+        records = self.read_all()
+        return records['subset_id'], records['model_id'], records['seconds']
+
+    def is_empty(self):
+        raise NotImplementedError
+
+    def read_all(self):
+        """Every stored record, as one array"""
+        raise NotImplementedError
+
+    def add_records(self, records):
+        """Store a whole array of records at once"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HDF5Database(Database):
+    """The results in a PyTables table
+
+    This is what we have always used. Only one process can write to it.
+    """
+    name = 'hdf5'
+    filename = 'data.db'
+
+    def __init__(self, cfg, path=None, dtype=None):
+        Database.__init__(self, cfg, path, dtype)
         self.results = None
+        # See preload
+        self.index = None
+        self.preloaded = None
+        self.order = None
+        self.indexed_rows = 0
+        # Results waiting to be written to the table, see save_result
+        self.pending = []
+        self.pending_since = None
         if os.path.exists(self.path):
             try:
                 self.h5 = tables.open_file(self.path, 'a')
@@ -143,26 +247,386 @@ class Database(object):
             f = tables.Filters(complib='blosc', complevel=5)
             self.h5 = tables.open_file(self.path, 'w', filters=f)
             self.results = self.h5.create_table(
-                '/', 'results', cfg.data_layout.data_type)
+                '/', 'results', self.dtype)
             self.results.cols.subset_id.create_csindex()
 
         assert isinstance(self.results, tables.Table)
         assert self.results.indexed
+        self.dtype = self.results.dtype
+
+        self.check_id_scheme(getattr(self.results.attrs, 'subset_ids', None))
+
+        self.journal_path = self.path + '.journal'
+        self.recover_journal()
+        self.journal = open(self.journal_path, 'ab')
+
+    def set_id_scheme(self, scheme):
+        self.results.attrs.subset_ids = scheme
+
+    def preload(self):
+        """Index the whole table by subset_id, in one go
+
+        Looking up each subset with read_where is slow when we are resuming a
+        big analysis, so we read the table once, sort it by subset_id, and
+        then serve each subset as a slice. If the table is too big to hold
+        in memory we only keep the sorted row numbers, and read each
+        subset's rows directly. Rows written after this are looked up in
+        the table, so we don't hold on to them.
+        """
+        ids = self.results.col('subset_id')
+        order = numpy.argsort(ids, kind='stable')
+        ids = ids[order]
+        breaks = numpy.flatnonzero(ids[1:] != ids[:-1]) + 1
+        starts = numpy.concatenate([[0], breaks]).astype(int)
+        stops = numpy.concatenate([breaks, [len(ids)]]).astype(int)
+        if not len(ids):
+            starts = stops = starts[:0]
+        self.index = dict(zip(ids[starts].tolist(),
+                              zip(starts.tolist(), stops.tolist())))
+
+        if self.results.nrows * self.results.dtype.itemsize <= PRELOAD_MAX_BYTES:
+            self.preloaded = self.results.read()[order]
+            self.order = None
+        else:
+            self.preloaded = None
+            self.order = order
+        self.indexed_rows = len(ids)
+        log.debug("Preloaded the index of %d results for %d subsets",
+                  len(ids), len(self.index))
+
+    def read_indexed(self, sid):
+        found = []
+        where = self.index.get(sid)
+        if where is not None:
+            start, stop = where
+            if self.preloaded is not None:
+                found.append(self.preloaded[start:stop])
+            else:
+                found.append(
+                    self.results.read_coordinates(self.order[start:stop]))
+        if self.results.nrows > self.indexed_rows:
+            conditions = {'current_id': sid}
+            written = self.results.read_where(
+                'subset_id == current_id', conditions,
+                start=self.indexed_rows, stop=self.results.nrows)
+            if len(written):
+                found.append(written)
+        if not found:
+            return self.results.read(0, 0)
+        if len(found) == 1:
+            return found[0]
+        return numpy.concatenate(found)
 
     def get_results_for_subset(self, subset):
-        conditions = {'current_id':  subset.subset_id}
-        matching = self.results.read_where(
-            'subset_id == current_id', conditions)
+        if self.index is None:
+            self.preload()
+        sid = subset.subset_id.encode('utf-8')
+        matching = self.read_indexed(sid)
+        if not len(matching) and self.legacy_ids:
+            # It might be stored (or have been moved to) under the old id
+            conditions = {'current_id':  subset.subset_id}
+            matching = self.results.read_where(
+                'subset_id == current_id', conditions)
+            if not len(matching):
+                matching = self.migrate_subset(subset, matching)
+        if self.pending:
+            waiting = [r for r in self.pending if r['subset_id'][0] == sid]
+            if waiting:
+                matching = numpy.concatenate([matching] + waiting)
         return matching
 
+    def migrate_subset(self, subset, matching):
+        """Move any results stored under the old id to the current one"""
+        conditions = {'old_id': subset.legacy_subset_id}
+        rows = self.results.get_where_list('subset_id == old_id', conditions)
+        if not len(rows):
+            return matching
+        records = self.results.read_coordinates(rows)
+        records['subset_id'] = subset.subset_id
+        self.results.modify_coordinates(rows, records)
+        self.results.flush()
+        log.debug("Moved %d results for %s over to its new id",
+                  len(rows), subset)
+        return records
+
+    def read_all(self):
+        self.flush()
+        return self.results.read()
+
+    def get_timings(self):
+        self.flush()
+        return (self.results.col('subset_id'),
+                self.results.col('model_id'),
+                self.results.col('seconds'))
+
     def is_empty(self):
-        return self.results.nrows == 0
+        return self.results.nrows == 0 and not self.pending
 
     def save_result(self, subset, n):
         # We have to take a slice here, as pytables can't handle single
         # elements
-        self.results.append(subset.result_array[n:n+1])
-        self.cfg.database.results.flush()
+        record = subset.result_array[n:n+1].copy()
+
+        # The journal is just the raw records, one after another, so writing
+        # to it is cheap. It is what we recover from if we never get as far
+        # as putting these in the table.
+        self.journal.write(record.tobytes())
+        self.journal.flush()
+
+        self.pending.append(record)
+        if self.pending_since is None:
+            self.pending_since = time.time()
+        if len(self.pending) >= BATCH_ROWS or \
+                time.time() - self.pending_since >= BATCH_SECONDS:
+            self.flush()
+
+    def add_records(self, records):
+        self.flush()
+        self.results.append(records)
+        self.results.flush()
+        self.index = None
+
+    def flush(self):
+        """Write any waiting results to the table"""
+        if self.pending:
+            records = numpy.concatenate(self.pending)
+            self.results.append(records)
+            self.results.flush()
+            self.pending = []
+        self.pending_since = None
+        # Everything in the journal is in the table now
+        self.journal.seek(0)
+        self.journal.truncate()
+
+    def recover_journal(self):
+        """Put any results we never got round to writing into the table"""
+        if not os.path.exists(self.journal_path):
+            return
+        dtype = self.results.dtype
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        # A crash part way through a write leaves a bit of a record
+        whole = len(data) - len(data) % dtype.itemsize
+        records = numpy.frombuffer(data[:whole], dtype=dtype)
+
+        # We might have crashed after writing them but before we cleared the
+        # journal
+        stored = {}
+        keep = []
+        for i, record in enumerate(records):
+            sid = record['subset_id']
+            if sid not in stored:
+                conditions = {'current_id': sid}
+                stored[sid] = set(self.results.read_where(
+                    'subset_id == current_id', conditions)['model_id'])
+            if record['model_id'] not in stored[sid]:
+                stored[sid].add(record['model_id'])
+                keep.append(i)
+
+        if keep:
+            log.info("Recovered %d results that weren't saved to the "
+                     "database last time", len(keep))
+            self.results.append(records[keep])
+            self.results.flush()
+        os.remove(self.journal_path)
 
     def close(self):
+        if not self.journal.closed:
+            self.flush()
+            self.journal.close()
+            os.remove(self.journal_path)
         self.h5.close()
+
+
+class SQLiteDatabase(Database):
+    """The results in an SQLite database, in WAL mode
+
+    Any number of processes can read and write this at once, so several
+    analyses (or several machines, on a file system with working locks) can
+    share their results. Each record is stored whole, as the bytes of the
+    numpy record, next to its subset and model ids.
+
+    Every result is committed as it arrives. With WAL and synchronous=NORMAL
+    that is just an append to the log, so there is nothing to batch.
+    """
+    name = 'sqlite'
+    filename = 'data.sqlite'
+
+    # How long to wait (seconds) for another writer to let go
+    BUSY_TIMEOUT = 60.0
+
+    def __init__(self, cfg, path=None, dtype=None):
+        Database.__init__(self, cfg, path, dtype)
+        exists = os.path.exists(self.path)
+        self.conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS info "
+                "(key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "subset_id TEXT NOT NULL, model_id TEXT NOT NULL, "
+                "record BLOB NOT NULL, PRIMARY KEY (subset_id, model_id)) "
+                "WITHOUT ROWID")
+            # Whoever gets here first says what the records look like
+            if self.dtype is not None:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO info VALUES ('dtype', ?)",
+                    (repr(self.dtype.descr), ))
+
+        stored = self.get_info('dtype')
+        if stored is None:
+            log.error("The results database at %s is empty, and I don't "
+                      "know what should go in it", self.path)
+            raise DatabaseError
+        stored = numpy.dtype(ast.literal_eval(stored))
+        if self.dtype is not None and stored != self.dtype:
+            log.error("The results database at %s holds a different kind of "
+                      "result to this analysis. Please re-run the analysis "
+                      "using the '--force-restart' option", self.path)
+            raise DatabaseError
+        self.dtype = stored
+        if not exists:
+            log.debug("Created results database at %s", self.path)
+
+        self.check_id_scheme(self.get_info('subset_ids'))
+
+    def get_info(self, key):
+        row = self.conn.execute(
+            "SELECT value FROM info WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_id_scheme(self, scheme):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO info VALUES ('subset_ids', ?)",
+                (scheme, ))
+
+    def to_records(self, blobs):
+        return numpy.frombuffer(
+            b''.join(blobs), dtype=self.dtype).copy()
+
+    def get_results_for_subset(self, subset):
+        matching = self.select(subset.subset_id)
+        if not len(matching) and self.legacy_ids:
+            matching = self.migrate_subset(subset, matching)
+        return matching
+
+    def select(self, subset_id):
+        rows = self.conn.execute(
+            "SELECT record FROM results WHERE subset_id = ?", (subset_id, ))
+        return self.to_records([r[0] for r in rows])
+
+    def migrate_subset(self, subset, matching):
+        """Move any results stored under the old id to the current one"""
+        records = self.select(subset.legacy_subset_id)
+        if not len(records):
+            return matching
+        records['subset_id'] = subset.subset_id
+        with self.conn:
+            self.conn.execute("DELETE FROM results WHERE subset_id = ?",
+                              (subset.legacy_subset_id, ))
+            self.insert(records)
+        log.debug("Moved %d results for %s over to its new id",
+                  len(records), subset)
+        return records
+
+    def insert(self, records):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+            [(r['subset_id'].decode('utf-8'), r['model_id'].decode('utf-8'),
+              r.tobytes()) for r in records])
+
+    def save_result(self, subset, n):
+        with self.conn:
+            self.insert(subset.result_array[n:n+1])
+
+    def add_records(self, records):
+        with self.conn:
+            self.insert(records)
+
+    def read_all(self):
+        rows = self.conn.execute("SELECT record FROM results")
+        return self.to_records([r[0] for r in rows])
+
+    def is_empty(self):
+        return self.conn.execute(
+            "SELECT 1 FROM results LIMIT 1").fetchone() is None
+
+    def close(self):
+        self.conn.close()
+
+
+backends = {
+    'hdf5': HDF5Database,
+    'sqlite': SQLiteDatabase,
+}
+
+
+def make_database(cfg):
+    """Open the results database for this analysis
+
+    If there isn't one for the backend we were asked for, but there is one
+    from another backend, we start by converting that one.
+    """
+    name = getattr(cfg, 'database_backend', None) or 'hdf5'
+    if name not in backends:
+        log.error("Unknown database '%s', please use one of: %s",
+                  name, ", ".join(sorted(backends)))
+        raise DatabaseError
+    cls = backends[name]
+    path = os.path.join(cfg.subsets_path, cls.filename)
+    if not os.path.exists(path):
+        for other in backends.values():
+            old_path = os.path.join(cfg.subsets_path, other.filename)
+            if other is not cls and os.path.exists(old_path):
+                convert(old_path, path, other, cls)
+                break
+    return cls(cfg)
+
+
+def backend_for_path(path):
+    for cls in backends.values():
+        if path.endswith(os.path.splitext(cls.filename)[1]):
+            return cls
+    log.error("Can't tell what kind of database '%s' is. It should end "
+              "with one of: %s", path, ", ".join(
+                  os.path.splitext(c.filename)[1] for c in backends.values()))
+    raise DatabaseError
+
+
+def convert(source_path, dest_path, source_cls=None, dest_cls=None):
+    """Copy all of the results from one database to another
+
+    The backends are worked out from the file names if they aren't given.
+    Results stored under the old subset ids stay that way, and get moved
+    over as they are used, as usual.
+    """
+    if source_cls is None:
+        source_cls = backend_for_path(source_path)
+    if dest_cls is None:
+        dest_cls = backend_for_path(dest_path)
+    if not os.path.exists(source_path):
+        log.error("There is no database at '%s'", source_path)
+        raise DatabaseError
+
+    log.info("Converting the results in %s to %s", source_path, dest_path)
+    source = source_cls(None, source_path)
+    try:
+        records = source.read_all()
+        dest = dest_cls(None, dest_path, source.dtype)
+        try:
+            if source.legacy_ids:
+                dest.set_id_scheme(None)
+            dest.add_records(records)
+            dest.flush()
+        finally:
+            dest.close()
+    finally:
+        source.close()
+    log.info("Converted %d results", len(records))
+    return len(records)
@@ -30,54 +30,99 @@ def entropy_calc(p):
     return np.dot(-p,np.log2(p)) # the function returns the entropy result
 
 
-def get_morph_entropies(alignment):
-    morph_align = alignment.data.T
-    column_counts = []
-    for col in morph_align:
-        new_col = col[col != ord('-')]
-        new_col = new_col[new_col != ord('?')]
-        column_counts.append(np.unique(new_col, return_counts=True)[1])
-    column_entropy = []
-    for col in column_counts:
-        sum = np.sum(col)
-        props = np.array([num/float(sum) for num in col])
-        column_entropy.append(entropy_calc(props))
-    column_entropy = np.array(column_entropy)
-    column_entropy = column_entropy.reshape(len(column_entropy), 1)
+# Roughly how many bases we count at once, to keep the memory down
+_CHUNK = 1 << 22
+
+
+def state_lookup(states):
+    """A table from each byte to its index in `states`
+
+    Bytes that aren't one of the states map to len(states), and aren't
+    counted.
+    """
+    table = np.full(256, len(states), dtype=np.intp)
+    for i, state in enumerate(states):
+        table[ord(state)] = i
+    return table
+
+
+def column_entropies(data, table, nstates):
+    """The entropy of every column of data at once
+
+    Each base is turned into a state index with `table`, and then a single
+    bincount gets the state counts for all of the columns in a chunk.
+    """
+    species, sites = data.shape
+    column_entropy = np.empty(sites)
+    width = nstates + 1
+    step = max(1, _CHUNK // max(species, 1))
+    for start in range(0, sites, step):
+        block = table[data[:, start:start + step]]
+        ncols = block.shape[1]
+        block += np.arange(ncols) * width
+        counts = np.bincount(block.ravel(), minlength=ncols * width)
+        counts = counts.reshape(ncols, width)[:, :nstates]
+
+        # for a column of all gaps, we'll have a zero total, so we just hack
+        # that here
+        totals = counts.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1
+        prob = counts / totals.astype(float)
+        logs = np.zeros_like(prob)
+        np.log2(prob, out=logs, where=prob > 0)
+        column_entropy[start:start + ncols] = -(prob * logs).sum(axis=1)
+
+    return column_entropy.reshape(sites, 1)
+
+
+def observed_entropies(data):
+    """Entropies that count any state that turns up, except for gaps and
+    missing data"""
+    seen = np.flatnonzero(np.bincount(data.ravel(), minlength=256))
+    states = [chr(b) for b in seen if chr(b) not in '-?']
+    return column_entropies(data, state_lookup(states), len(states))
+
+_DNA_STATES = "ACGT"
+_DNA_TABLE = state_lookup(_DNA_STATES)
+_AA_STATES = "ARNDCQEGHILKMFPSTWYV"
+_AA_TABLE = state_lookup(_AA_STATES)
 
-    return column_entropy
+
+def get_morph_entropies(alignment):
+    return observed_entropies(alignment.data)
 
 def sitewise_entropies(alignment):
     if the_config.datatype == 'DNA':
         log.debug("Calculating DNA entropies")
-        dna_states = "ACGT"
-        dna_list = [np.sum(alignment.data == ord(nuc), axis = 0) for nuc in list(dna_states)]
-        states = np.array(dna_list, dtype=float)
+        column_entropy = column_entropies(
+            alignment.data, _DNA_TABLE, len(_DNA_STATES))
     elif the_config.datatype == 'protein':
         log.debug("Calculating protein entropies")
-        aa_states = "ARNDCQEGHILKMFPSTWYV"
-        amino_list = [np.sum(alignment.data == ord(aa), axis = 0) for aa in list(aa_states)]
-        states = np.array(amino_list, dtype = float)
+        column_entropy = column_entropies(
+            alignment.data, _AA_TABLE, len(_AA_STATES))
     elif the_config.datatype == 'morphology':
         column_entropy = get_morph_entropies(alignment)
     else:
         log.error("Unknown datatype '%s'" % the_config.datatype)
         raise PartitionFinderError
 
-    if the_config.datatype != 'morphology':
-        states = states.T
-        totals = np.sum(states, axis=1)
-        totals.shape = len(states),1
-
-        # for a column of all gaps, we'll have a zero total, so we just hack that here
-        totals = np.where(totals==0, 1, totals)
+    return column_entropy
 
-        prob = states/totals
+def pattern_entropies(alignment):
+    """sitewise_entropies for each site pattern in the alignment, worked out
+    the first time we ask"""
+    return alignment.patterns.stat(
+        ('entropy', the_config.datatype), sitewise_entropies)
 
-        column_entropy = [[entropy_calc(t)] for t in prob]
-        column_entropy = np.array(column_entropy)
+def subset_entropies(alignment, a_subset):
+    """sitewise_entropies for the columns of a subset
 
-    return column_entropy
+    These are worked out once for each site pattern in the alignment, and
+    then just looked up for each subset.
+    """
+    patterns = alignment.patterns
+    columns = a_subset.column_set.to_array()
+    return pattern_entropies(alignment)[patterns.site_pattern[columns]]
 
 def find_nearest(array,value):
     idx = (np.abs(array-value)).argmin()
@@ -103,25 +148,9 @@ def get_replacement_sites(column_entropy, columns):
 
     return(replacements)
 
-def sitewise_entropies_scaled(alignment): 
+def sitewise_entropies_scaled(alignment):
     """This function will calculate entropies for DNA based on the assumption
     that the states in the column are the only possible states, i.e. it
     doesn't assume four states for each column
     """
-    dna_align = alignment.data.T
-    column_counts = []
-    for col in dna_align:
-        new_col = col[col != ord('-')]
-        new_col = new_col[new_col != ord('?')]
-        column_counts.append(np.unique(new_col, return_counts=True)[1])
-    column_entropy = []
-    for col in column_counts:
-        sum = np.sum(col)
-        props = np.array([num/float(sum) for num in col])
-        column_entropy.append([entropy_calc(props)]) 
-    column_entropy = np.array(column_entropy)
-    column_entropy = column_entropy.reshape(len(column_entropy), 1)
-    return column_entropy
-
-
-
+    return observed_entropies(alignment.data)
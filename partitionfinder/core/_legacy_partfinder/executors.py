@@ -0,0 +1,501 @@
+# Copyright (C) 2012-2013 Robert Lanfear and Brett Calcott
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details. You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# PartitionFinder also includes the PhyML program, the RAxML program, and the
+# PyParsing library, all of which are protected by their own licenses and
+# conditions, using PartitionFinder implies that you agree with those licences
+# and conditions as well.
+
+"""Backends for running the (subset, model) analyses
+
+Every backend runs `run_model_task` on each task. This runs the phylogeny
+program, parses the output and builds the result record, so that only a
+compact TaskOutcome (one numpy row, or an error marker) comes back to the
+coordinator. The coordinator is the only thing that touches Subset objects or
+the database, so no locking is needed there.
+"""
+
+import logtools
+log = logtools.get_logger()
+
+import os
+import time
+import queue
+import threading
+import collections
+import multiprocessing
+
+import util
+import subset
+from config import the_config
+from util import PartitionFinderError, ExternalProgramError, ParseError
+
+
+# The states a task can finish in
+DONE, FABRICATED, MISSING, FAILED, PARSE_FAILED = range(5)
+
+
+class ExecutorError(PartitionFinderError):
+    pass
+
+
+class ModelTask(object):
+    """Everything a worker needs to analyse one model on one subset"""
+    __slots__ = ('subset_id', 'model', 'alignment_path', 'n_sites',
+                 'suppress_errors', 'cpus')
+
+    def __init__(self, sub, model, suppress_errors=False, cpus=1):
+        self.subset_id = sub.subset_id
+        self.model = model
+        self.alignment_path = sub.alignment_path
+        self.n_sites = len(sub.column_set)
+        self.suppress_errors = suppress_errors
+        # How many of our cpus this task gets to use (see Executor.run)
+        self.cpus = cpus
+
+    def __getstate__(self):
+        return tuple(getattr(self, s) for s in self.__slots__)
+
+    def __setstate__(self, state):
+        for s, v in zip(self.__slots__, state):
+            setattr(self, s, v)
+
+    def __repr__(self):
+        return "ModelTask(%s, %s)" % (self.subset_id, self.model)
+
+
+class TaskOutcome(object):
+    __slots__ = ('subset_id', 'model', 'cpus', 'status', 'record', 'error',
+                 'seconds')
+
+    def __init__(self, task, status, record=None, error=None):
+        self.subset_id = task.subset_id
+        self.model = task.model
+        self.cpus = task.cpus
+        self.status = status
+        self.record = record
+        self.error = error
+        self.seconds = 0.0
+
+    def __getstate__(self):
+        return tuple(getattr(self, s) for s in self.__slots__)
+
+    def __setstate__(self, state):
+        for s, v in zip(self.__slots__, state):
+            setattr(self, s, v)
+
+
+class WorkerContext(object):
+    """The bits of the configuration that a worker needs
+
+    Threads share the_config with the coordinator, but processes started with
+    'spawn' (and remote workers) get a fresh interpreter, so we rebuild just
+    enough of the configuration for the processor modules to work.
+    """
+
+    def __init__(self, cfg, tree_path):
+        self.datatype = cfg.datatype
+        self.phylogeny_program = cfg.phylogeny_program
+        self.data_layout = cfg.data_layout
+        self.available_models = cfg.available_models
+        self.available_models_by_name = cfg.available_models_by_name
+        self.models = list(cfg.models)
+        self.branchlengths = cfg.branchlengths
+        self.cmdline_extras = cfg.cmdline_extras
+        self.save_phylofiles = cfg.save_phylofiles
+        self.program_path = util.program_path
+        self.working_folder = os.getcwd()
+        self.tree_path = tree_path
+
+    def install(self):
+        cfg = the_config
+        if getattr(cfg, 'processor', None) is None or \
+                cfg.phylogeny_program != self.phylogeny_program:
+            cfg.processor = __import__(self.phylogeny_program.lower())
+        cfg.datatype = self.datatype
+        cfg.phylogeny_program = self.phylogeny_program
+        cfg.data_layout = self.data_layout
+        cfg.available_models = self.available_models
+        cfg.available_models_by_name = self.available_models_by_name
+        cfg.models = self.models
+        cfg.branchlengths = self.branchlengths
+        cfg.cmdline_extras = self.cmdline_extras
+        cfg.save_phylofiles = self.save_phylofiles
+        util.program_path = self.program_path
+        if os.getcwd() != self.working_folder:
+            os.chdir(self.working_folder)
+
+        global _context
+        _context = self
+
+
+_context = None
+
+
+def init_worker(context):
+    context.install()
+
+
+def run_model_task(task):
+    """Analyse a single model on a single subset and parse the output
+
+    This is the unit of work for all of the backends. It must not touch the
+    Subset objects or the database.
+    """
+    ctx = _context
+    processor = the_config.processor
+    try:
+        processor.analyse(
+            task.model,
+            task.alignment_path,
+            ctx.tree_path,
+            ctx.branchlengths,
+            ctx.cmdline_extras,
+            task.cpus
+        )
+    except ExternalProgramError as e:
+        if not task.suppress_errors:
+            return TaskOutcome(task, FAILED, error=(e.stderr, e.stdout))
+
+        # In the Kmeans algorithm we suppress errors and "fabricate" subsets
+        # (we assume the error is because the subset is too small for
+        # analysis)
+        log.debug("New subset could not be analysed. It will be merged "
+                  "at the end of the analysis")
+        return TaskOutcome(task, FABRICATED)
+
+    pth, tree_path = processor.make_output_path(task.alignment_path, task.model)
+    if not os.path.exists(pth):
+        # If it ain't there, we can't do it
+        return TaskOutcome(task, MISSING)
+
+    with open(pth, 'r') as f:
+        output = f.read()
+    try:
+        result = processor.parse(output, the_config)
+    except ParseError:
+        return TaskOutcome(task, PARSE_FAILED)
+
+    record = subset.make_result_record(
+        the_config, task.subset_id, task.model, result, task.n_sites)
+
+    if not ctx.save_phylofiles:
+        # We remove all files that have the specified RUN ID
+        processor.remove_files(task.alignment_path, task.model)
+
+    return TaskOutcome(task, DONE, record=record)
+
+
+def _run_safely(task):
+    start = time.time()
+    try:
+        outcome = run_model_task(task)
+    except Exception as e:
+        # Anything unexpected goes back to the coordinator to be re-raised
+        outcome = TaskOutcome(task, FAILED)
+        outcome.error = e
+    outcome.seconds = time.time() - start
+    return outcome
+
+
+class Executor(object):
+    """Runs tasks, handing each outcome to `on_result` in the calling thread
+
+    `tasks` can be any iterable, and is consumed lazily: we only pull a new
+    task when there is room for it in the window of tasks in flight. So a
+    generator that prepares subsets as it goes only does so just ahead of
+    the workers, and it always runs in the calling thread.
+    """
+    name = None
+
+    def __init__(self, threads, context, window=None):
+        self.threads = threads
+        self.context = context
+        if window is None:
+            # Enough to keep every worker busy while we deal with results
+            window = 2 * threads
+        self.window = max(window, threads)
+        self.results = queue.Queue()
+        context.install()
+
+    def start(self):
+        pass
+
+    def submit(self, task):
+        raise NotImplementedError
+
+    def cancel(self):
+        """Throw away anything that hasn't started yet"""
+        pass
+
+    def stop(self):
+        """Wait for the running tasks to finish, and shut down the workers"""
+        pass
+
+    def has_room(self, cpus, cpus_in_flight, multi_in_flight):
+        """Can we submit this task now?
+
+        Normally we keep a few more tasks queued than we have workers. But a
+        task that uses more than one cpu has to wait until there are enough
+        cpus free, and while it runs nothing gets queued beyond our cpus.
+        Otherwise we'd end up running more threads than we were given.
+        """
+        if cpus > 1 or multi_in_flight:
+            limit = self.threads
+        else:
+            limit = self.window
+        return cpus_in_flight + cpus <= limit or cpus_in_flight == 0
+
+    def run(self, tasks, on_result):
+        tasks = iter(tasks)
+        running = {}
+        cpus_in_flight = 0
+        multi_in_flight = 0
+        waiting = None
+        exhausted = False
+        try:
+            while True:
+                while True:
+                    if waiting is None:
+                        # Don't ask for a task until we could take it
+                        if exhausted or not self.has_room(
+                                1, cpus_in_flight, multi_in_flight):
+                            break
+                        try:
+                            waiting = next(tasks)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                    if not self.has_room(
+                            waiting.cpus, cpus_in_flight, multi_in_flight):
+                        break
+                    if not running:
+                        self.start()
+                    self.submit(waiting)
+                    running[(waiting.subset_id, waiting.model)] = waiting.cpus
+                    cpus_in_flight += waiting.cpus
+                    if waiting.cpus > 1:
+                        multi_in_flight += 1
+                    waiting = None
+
+                if not running:
+                    break
+
+                outcome = self.results.get()
+                if outcome is None:
+                    # Just a nudge: our capacity has changed
+                    continue
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                cpus = running.pop((outcome.subset_id, outcome.model))
+                cpus_in_flight -= cpus
+                if cpus > 1:
+                    multi_in_flight -= 1
+                on_result(outcome)
+        except BaseException:
+            self.cancel()
+            self.stop()
+            # Anything still in there belongs to the tasks we abandoned
+            self.results = queue.Queue()
+            raise
+
+    def close(self):
+        self.stop()
+
+
+class SerialExecutor(Executor):
+    name = 'serial'
+
+    def run(self, tasks, on_result):
+        for task in tasks:
+            start = time.time()
+            outcome = run_model_task(task)
+            outcome.seconds = time.time() - start
+            on_result(outcome)
+
+
+class ThreadExecutor(Executor):
+    """A fixed set of threads that pull tasks from a shared queue"""
+    name = 'thread'
+
+    def __init__(self, threads, context, window=None):
+        Executor.__init__(self, threads, context, window)
+        self.tasks = queue.Queue()
+        self.workers = []
+
+    def start(self):
+        while len(self.workers) < self.threads:
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def next_task(self, me):
+        return self.tasks.get()
+
+    def work(self):
+        me = threading.current_thread()
+        while True:
+            task = self.next_task(me)
+            if task is None:
+                break
+            self.results.put(_run_safely(task))
+
+    def submit(self, task):
+        self.tasks.put(task)
+
+    def cancel(self):
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+
+    def stop(self):
+        for i in range(len(self.workers)):
+            self.tasks.put(None)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+
+
+class WorkStealingExecutor(ThreadExecutor):
+    """Threads with their own queues, that steal when they run dry
+
+    Tasks are dealt out round-robin in the order they arrive (hardest first),
+    and each thread works through its own queue in that order. An idle thread
+    takes the last task off the longest queue, so one thread does not end up
+    holding all the slow jobs.
+    """
+    name = 'steal'
+
+    def __init__(self, threads, context, window=None):
+        ThreadExecutor.__init__(self, threads, context, window)
+        self.deques = []
+        self.available = threading.Semaphore(0)
+        self.stopping = False
+        self.dealt = 0
+
+    def start(self):
+        if self.workers:
+            return
+        self.stopping = False
+        self.deques = [collections.deque() for i in range(self.threads)]
+        for i in range(self.threads):
+            t = threading.Thread(target=self.work, args=(i, ))
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def work(self, me):
+        while True:
+            task = self.next_task(me)
+            if task is None:
+                break
+            self.results.put(_run_safely(task))
+
+    def submit(self, task):
+        self.deques[self.dealt % len(self.deques)].append(task)
+        self.dealt += 1
+        self.available.release()
+
+    def next_task(self, me):
+        self.available.acquire()
+        if self.stopping:
+            return None
+        try:
+            return self.deques[me].popleft()
+        except IndexError:
+            pass
+        # Steal. Each semaphore release matches exactly one task, so there is
+        # always one to be found, though another thread may beat us to it.
+        while True:
+            victim = max(self.deques, key=len)
+            try:
+                return victim.pop()
+            except IndexError:
+                if self.stopping:
+                    return None
+
+    def cancel(self):
+        self.stopping = True
+        for d in self.deques:
+            d.clear()
+
+    def stop(self):
+        self.stopping = True
+        for i in range(len(self.workers)):
+            self.available.release()
+        for t in self.workers:
+            t.join()
+        self.workers = []
+        self.available = threading.Semaphore(0)
+
+
+class ProcessExecutor(Executor):
+    """A pool of worker processes
+
+    Output parsing (pyparsing is slow) happens in the workers, so it no longer
+    competes with the coordinator for the GIL.
+    """
+    name = 'process'
+
+    def __init__(self, threads, context, window=None):
+        Executor.__init__(self, threads, context, window)
+        self.pool = None
+
+    def start(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.threads, initializer=init_worker,
+                initargs=(self.context,))
+
+    def submit(self, task):
+        # The callbacks run in the pool's result thread, so they just queue
+        # the outcome for the calling thread to pick up
+        self.pool.apply_async(
+            _run_safely, (task, ),
+            callback=self.results.put, error_callback=self.results.put)
+
+    def cancel(self):
+        if self.pool is not None:
+            self.pool.terminate()
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+executors = {
+    'thread': ThreadExecutor,
+    'process': ProcessExecutor,
+    'steal': WorkStealingExecutor,
+}
+
+
+def make_executor(name, threads, context, window=None):
+    if name == 'remote':
+        # This brings in the networking, so we only load it when asked
+        import remote
+        return remote.RemoteExecutor(threads, context, window)
+    if threads == 1:
+        return SerialExecutor(threads, context)
+    try:
+        cls = executors[name]
+    except KeyError:
+        log.error("Unknown executor '%s'. Valid options are: %s",
+                  name, ", ".join(sorted(executors) + ['remote']))
+        raise ExecutorError
+    log.debug("Using the '%s' executor with %d workers", name, threads)
+    return cls(threads, context, window)
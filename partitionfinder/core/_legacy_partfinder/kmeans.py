@@ -19,12 +19,10 @@ import logtools
 log = logtools.get_logger()
 
 import time
+import multiprocessing
 
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import scale
 from collections import defaultdict
-from alignment import SubsetAlignment
 import util
 from config import the_config
 import entropy
@@ -34,8 +32,122 @@ import morph_tiger as mt
 
 import subset_ops
 
-# You can run kmeans in parallel, specify n_jobs as -1 and it will run
-# on all cores available.
+def scale(rate_array):
+    """Centre each column on zero and scale it to unit variance, the same as
+    sklearn.preprocessing.scale"""
+    array = np.array(rate_array, dtype=np.float64)
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    array -= array.mean(axis=0)
+    std = array.std(axis=0)
+    # Leave constant columns alone rather than dividing by zero
+    std[std < 10 * np.finfo(np.float64).eps] = 1.0
+    array /= std
+    return array
+
+
+def _cluster_cost(W, S, SS, j, i):
+    # Sum of squares about the mean of sorted values j..i-1, from prefix sums
+    # of the weights, values and squared values
+    s = S[i] - S[j]
+    return SS[i] - SS[j] - s * s / (W[i] - W[j])
+
+
+def _next_level(previous, W, S, SS, level, last):
+    """The best cost of putting the first i values into level + 1 clusters,
+    and where the last cluster starts, given the best costs for level
+    clusters"""
+    m = len(W) - 1
+    current = np.full(m + 1, np.inf)
+    start = np.zeros(m + 1, dtype=np.intp)
+
+    def best(i, jlo, jhi):
+        j = np.arange(jlo, min(jhi, i - 1) + 1)
+        total = previous[j] + _cluster_cost(W, S, SS, j, i)
+        b = np.argmin(total)
+        current[i] = total[b]
+        start[i] = j[b]
+        return start[i]
+
+    if last:
+        # We only need the clustering of all of the values
+        best(m, level, m - 1)
+        return current, start
+
+    # The best start of the last cluster never moves left as i increases,
+    # so we can divide and conquer (Wang and Song, Ckmeans.1d.dp)
+    todo = [(level + 1, m, level, m - 1)]
+    while todo:
+        lo, hi, jlo, jhi = todo.pop()
+        if lo > hi:
+            continue
+        mid = (lo + hi) // 2
+        j = best(mid, jlo, jhi)
+        todo.append((lo, mid - 1, jlo, j))
+        todo.append((mid + 1, hi, j, jhi))
+    return current, start
+
+
+def optimal_1d_clusters(values, number_of_ks):
+    """The clustering of 1-D values with the smallest within-cluster sum of
+    squares.
+
+    That is what k-means looks for, but in one dimension each cluster is a
+    run of the sorted values, so we can find it exactly rather than from
+    random restarts. For two clusters this is one pass over the thresholds.
+    Equal values always end up together, so there are fewer than
+    number_of_ks clusters if there are fewer distinct values.
+
+    Returns the cluster of each value, numbered from the smallest values
+    up, and the mean of each cluster.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    distinct, inverse, counts = np.unique(
+        values, return_inverse=True, return_counts=True)
+    m = len(distinct)
+    k = max(1, min(number_of_ks, m))
+
+    W = np.zeros(m + 1)
+    S = np.zeros(m + 1)
+    SS = np.zeros(m + 1)
+    np.cumsum(counts, out=W[1:])
+    np.cumsum(np.bincount(inverse, weights=values, minlength=m), out=S[1:])
+    np.cumsum(np.bincount(inverse, weights=values * values, minlength=m),
+              out=SS[1:])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cost = _cluster_cost(W, S, SS, 0, np.arange(m + 1))
+    starts = []
+    for level in range(1, k):
+        cost, start = _next_level(cost, W, S, SS, level, level == k - 1)
+        starts.append(start)
+
+    # Work back from the end to find where each cluster starts
+    bounds = [m]
+    for start in reversed(starts):
+        bounds.append(start[bounds[-1]])
+    bounds.append(0)
+    bounds = np.array(bounds[::-1])
+
+    cluster_of_distinct = np.searchsorted(bounds[1:-1], np.arange(m),
+                                          side='right')
+    lo, hi = bounds[:-1], bounds[1:]
+    centroids = (S[hi] - S[lo]) / (W[hi] - W[lo])
+    return cluster_of_distinct[inverse], centroids.reshape(-1, 1)
+
+
+def sklearn_kmeans(array, number_of_ks):
+    """k-means on more than one column of statistics, from scikit-learn"""
+    from sklearn.cluster import KMeans
+
+    # Use "k-means++" to find centroids
+    # Note: n_jobs parameter removed in scikit-learn 0.23+
+    kmeans_out = KMeans(init='k-means++', n_clusters=number_of_ks,
+            n_init=100, random_state=2147483647)
+    kmeans_out.fit(array)
+    return kmeans_out.labels_, kmeans_out.cluster_centers_
+
+
 def kmeans(rate_array, number_of_ks, n_jobs):
     '''Take as input a list of sites, performs k-means clustering on
     sites and returns k centroids and a dictionary with k's as keys
@@ -47,22 +159,17 @@ def kmeans(rate_array, number_of_ks, n_jobs):
     # Create and scale an array for input into kmeans function
     array = scale(rate_array)
 
-    # Call scikit_learn's k-means, use "k-means++" to find centroids
-    # kmeans_out = KMeans(init='k-means++', n_init = 100)
-    # Note: n_jobs parameter removed in scikit-learn 0.23+
-    kmeans_out = KMeans(init='k-means++', n_clusters=number_of_ks,
-            n_init=100, random_state=2147483647)
-
-    # Perform k-means clustering on the array of site likelihoods
-    kmeans_out.fit(array)
+    if array.shape[1] == 1:
+        # Per site entropies or rates: we can find the best split exactly
+        rate_categories, centroids = optimal_1d_clusters(
+            array[:, 0], number_of_ks)
+    else:
+        rate_categories, centroids = sklearn_kmeans(array, number_of_ks)
 
-    # Retrieve centroids
-    centroids = kmeans_out.cluster_centers_
     # Add all centroids to a list to return
     centroid_list = [list(centroid) for centroid in centroids]
 
     # Retrieve a list with the cluster number for each site
-    rate_categories = kmeans_out.labels_
     rate_categories = list(rate_categories)
 
     # Transpose the list of cluster numbers to a dictionary with
@@ -88,38 +195,108 @@ def rate_parser(rates_name):
     return rate_array
 
 
-def get_per_site_stats(alignment, cfg, a_subset):
+def get_per_site_stats(alignment, cfg, a_subset, n_jobs=1):
     if cfg.kmeans == 'entropy':
-        sub_align = SubsetAlignment(alignment, a_subset)
-        return entropy.sitewise_entropies(sub_align)
+        return entropy.subset_entropies(alignment, a_subset)
     elif cfg.kmeans == 'tiger' and cfg.datatype == 'morphology':
-        sub_align = SubsetAlignment(alignment, a_subset)
-        set_parts = mt.create_set_parts(sub_align)
-        rates = mt.calculate_rates(set_parts)
-        return rates
+        return mt.subset_rates(alignment, a_subset, n_jobs)
     else: #wtf
         log.error("Unkown option passed to 'kmeans'. Please check and try again")
         raise PartitionFinderError
 
 
+def share_per_site_stats(alignment, cfg):
+    """Work out the per pattern statistics that get_per_site_stats looks up,
+    so that worker processes start with them"""
+    if cfg.kmeans == 'entropy':
+        entropy.pattern_entropies(alignment)
+    elif cfg.kmeans == 'tiger' and cfg.datatype == 'morphology':
+        mt.pattern_labels(alignment)
+
+
+def site_clusters(cfg, alignment, a_subset, n_jobs=1, number_of_ks=2):
+    """The per site statistics of a subset, and the k-means clusters of its
+    sites (see kmeans)"""
+    per_site_stat_list = get_per_site_stats(alignment, cfg, a_subset, n_jobs)
+    centroids, split_categories = kmeans(per_site_stat_list, number_of_ks, n_jobs)
+    return per_site_stat_list, centroids, split_categories
+
+
+class SubsetColumns(object):
+    """Stands in for a subset in a worker process: the statistics only need
+    the columns"""
+    __slots__ = ('column_set', )
+
+    def __init__(self, column_set):
+        self.column_set = column_set
+
+
+_worker_alignment = None
+
+
+def _init_split_worker(alignment, kmeans_type, datatype):
+    # Processes started with 'spawn' get a fresh the_config
+    the_config.kmeans = kmeans_type
+    the_config.datatype = datatype
+    global _worker_alignment
+    _worker_alignment = alignment
+
+
+def _split_worker(job):
+    column_set, number_of_ks = job
+    return site_clusters(the_config, _worker_alignment,
+                         SubsetColumns(column_set), 1, number_of_ks)
+
+
+def cluster_subsets(cfg, alignment, subsets, n_jobs, number_of_ks=2):
+    """site_clusters for each of the subsets, in the same order
+
+    With more than one job, the subsets are shared out over a pool of
+    processes. We work out the per pattern statistics first, so the workers
+    get them along with the alignment and only have to do the work for their
+    own subsets. Each subset gets one thread, as the pool uses the cores.
+    """
+    if n_jobs <= 1 or len(subsets) < 2:
+        return [site_clusters(cfg, alignment, s, n_jobs, number_of_ks)
+                for s in subsets]
+
+    start = time.perf_counter()
+    share_per_site_stats(alignment, cfg)
+    pool = multiprocessing.Pool(
+        min(n_jobs, len(subsets)), initializer=_init_split_worker,
+        initargs=(alignment, cfg.kmeans, cfg.datatype))
+    try:
+        # map hands back the results in the order of the subsets, whatever
+        # order they finish in
+        results = pool.map(
+            _split_worker, [(s.column_set, number_of_ks) for s in subsets],
+            chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    log.debug("Clustering the sites of %d subsets on %d processes took %s "
+              "seconds", len(subsets), min(n_jobs, len(subsets)),
+              time.perf_counter() - start)
+    return results
+
+
 def kmeans_split_subset(cfg, alignment, a_subset, tree_path,
-                        n_jobs, number_of_ks=2):
+                        n_jobs, number_of_ks=2, clusters=None):
     """Takes a subset and number of k's and returns
     subsets for however many k's are specified
+
+    clusters is what site_clusters gives for the subset, if we already
+    have it (see cluster_subsets)
     """
-    # Get either entropies or TIGER rates
-    per_site_stat_list = get_per_site_stats(alignment, cfg, a_subset)
+    if clusters is None:
+        clusters = site_clusters(cfg, alignment, a_subset, n_jobs, number_of_ks)
+    per_site_stat_list, centroids, split_categories = clusters
 
     # Now store all of the per_site_stats with the subset
     a_subset.add_per_site_statistics(per_site_stat_list)
     log.debug("The per site statistics for the first 10 sites of subset %s are %s"
         % (a_subset.name, per_site_stat_list[0:10]))
 
-    # Perform kmeans clustering on the per site stats
-    kmeans_results = kmeans(per_site_stat_list, number_of_ks, n_jobs)
-    centroids = kmeans_results[0]
-    split_categories = kmeans_results[1]
-
     list_of_sites = []
     for k in range(len(split_categories)):
         list_of_sites.append(split_categories[k])
@@ -32,6 +32,7 @@ from optparse import OptionParser
 
 # We import everything here as it forces all of debug regions to be loaded
 import config
+import subset
 import analysis_method
 import util
 import reporter
@@ -128,6 +129,36 @@ def parse_args(datatype, cmdargs=None):
         help="Number of concurrent processes to use."
              " Use -1 to match the number of cpus on the machine."
              " The default is to use -1.")
+    op.add_option(
+        "--executor",
+        type="choice", dest="executor", default="thread",
+        choices=["thread", "process", "steal", "remote"], metavar="TYPE",
+        help="How to run the analyses when using more than one process. "
+             "'thread' (the default) uses a shared queue of threads, 'process' "
+             "uses a pool of worker processes, and 'steal' uses threads that "
+             "steal work from each other when they run out. 'remote' hands "
+             "the analyses to workers (PartitionFinderWorker.py) that connect "
+             "over the network, see --listen.")
+    op.add_option(
+        "--listen",
+        type="str", dest="listen", default=None, metavar="HOST:PORT",
+        help="With --executor remote, the address to wait for workers on. "
+             "The default is 127.0.0.1:6510, which only allows workers on "
+             "this machine. Use 0.0.0.0:PORT to allow any machine.")
+    op.add_option(
+        "--authkey",
+        type="str", dest="authkey", default=None, metavar="KEY",
+        help="With --executor remote, the key the workers must give to "
+             "connect. This can also be set with the PARTITIONFINDER_AUTHKEY "
+             "environment variable. If you don't give one, one is made up and "
+             "printed.")
+    op.add_option(
+        "--adaptive-threads",
+        action="store_true", dest="adaptive_threads", default=False,
+        help="(RAxML only) Run the biggest subsets with the Pthreads version "
+             "of RAxML, giving them several of the processes set with -p, "
+             "so that they don't hold everything up at the end of each step. "
+             "Small subsets still get one process each.")
     op.add_option(
         "--show-python-exceptions",
         action="store_true", dest="show_python_exceptions",
@@ -136,6 +167,44 @@ def parse_args(datatype, cmdargs=None):
         "--save-phylofiles",
         action="store_true", dest="save_phylofiles",
         help="save all of the phyml or raxml output. This can take a lot of space(!)")
+    op.add_option(
+        "--staging-dir",
+        type="str", dest="staging_dir", default=None, metavar="DIR",
+        help="Write the subset alignments and the phyml or raxml output to a "
+             "temporary folder in DIR, rather than the analysis folder. Use a "
+             "memory-backed folder such as /dev/shm to keep them off the disk "
+             "entirely. This is ignored with --save-phylofiles.")
+    op.add_option(
+        "--database",
+        type="choice", dest="database_backend", default="hdf5",
+        choices=["hdf5", "sqlite"], metavar="DATABASE",
+        help="Where to keep the results for each subset: 'hdf5' (the "
+             "default) or 'sqlite'. Use 'sqlite' if more than one analysis, "
+             "or process, needs to write to the same results at once. An "
+             "existing database of the other kind is converted the first "
+             "time it is used.")
+    op.add_option(
+        "--result-cache",
+        type="str", dest="result_cache_path", default=None, metavar="PATH",
+        help="Share the results of each model on each subset between "
+             "analyses, using the cache in PATH (a file, or a folder to put "
+             "one in). Analyses of the same alignment with the same starting "
+             "tree and program settings then only run each model once, "
+             "whatever their search or model selection. This can also be set "
+             "with the PARTITIONFINDER_RESULT_CACHE environment variable.")
+    op.add_option(
+        "--result-cache-size",
+        type="int", dest="result_cache_size", default=None, metavar="MB",
+        help="The most space the --result-cache can use, default 1024 MB. "
+             "The results used least recently are dropped to stay under it.")
+    op.add_option(
+        "--subset-memory",
+        type="int", dest="subset_memory", default=None, metavar="MB",
+        help="Roughly how much memory (in MB) to use for keeping finished "
+             "subsets and their results around, default %d. Beyond this, "
+             "the results are loaded back from the database when they are "
+             "needed. Lower this if you run out of memory on big "
+             "analyses." % subset.DEFAULT_CACHE_MB)
     op.add_option(
         "--dump-results",
         action="store_true", dest="dump_results",
@@ -284,6 +353,11 @@ def check_options(op, options):
     else:
         options.phylogeny_program = 'phyml'
 
+    if options.adaptive_threads and options.cmdline_extras.count("-T") > 0:
+        op.error(
+            "--adaptive-threads sets the RAxML '-T' option itself, so don't "
+            "put it in --cmdline-extras as well")
+
     #A warning for people using the Pthreads version of RAxML
     if options.cmdline_extras.count("-T") > 0:
         log.warning("""
@@ -378,7 +452,16 @@ def main(name, datatype, passed_args=None):
                                    options.quick,
                                    options.min_subset_size,
                                    options.all_states,
-                                   options.no_ml_tree)
+                                   options.no_ml_tree,
+                                   options.executor,
+                                   options.adaptive_threads,
+                                   options.listen,
+                                   options.authkey,
+                                   options.staging_dir,
+                                   options.subset_memory,
+                                   options.database_backend,
+                                   options.result_cache_path,
+                                   options.result_cache_size)
         cfg = config.the_config
 
         # Set up the progress callback
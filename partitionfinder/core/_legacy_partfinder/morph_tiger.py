@@ -18,11 +18,19 @@
 import logtools
 log = logtools.get_logger()
 
-from alignment import Alignment
+from alignment import Alignment, SubsetAlignment
 import numpy as np
 from config import the_config
 from util import PartitionFinderError
 
+try:
+    from partitionfinder.accel import tiger_agreement as _accel_tiger_agreement
+except Exception:  # noqa: BLE001
+    _accel_tiger_agreement = None
+
+# Roughly how many pairs of sites we sum up at once in site_rates
+_CHUNK = 1 << 22
+
 # Create a set partition for each column in the alignment
 def create_set_parts(alignment):
     log.debug("Creating set partitions")
@@ -70,6 +78,54 @@ def calculate_rates(set_parts):
         rates.append([number/(total-1)])
     return rates
 
+# The set partition of each column as a row of labels, one for each taxon.
+# Taxa with the same label are in the same part, and -1 is missing data.
+def set_part_labels(alignment):
+    labels = alignment.data.T.astype(np.int32)
+    missing = (alignment.data.T == ord('?')) | (alignment.data.T == ord('-'))
+    labels[missing] = -1
+    return labels
+
+# The rate of each site from the axpi agreement of every pair of site
+# patterns. For each site we add up the agreement with every other site in
+# order, just as calculate_rates does, so we get exactly the same numbers.
+def site_rates(agreement, site_pattern):
+    total = len(site_pattern)
+    rates = np.empty((total, 1))
+    step = max(1, _CHUNK // total)
+    for start in range(0, total, step):
+        rows = np.arange(start, min(start + step, total))
+        block = agreement[np.ix_(site_pattern[rows], site_pattern)]
+        # Don't compare a site with itself
+        block[np.arange(len(rows)), rows] = 0.0
+        rates[rows, 0] = np.cumsum(block, axis=1)[:, -1] / (total - 1)
+    return rates
+
+# set_part_labels for each site pattern in the alignment, worked out the
+# first time we ask
+def pattern_labels(alignment):
+    return alignment.patterns.stat('tiger_labels', set_part_labels)
+
+# TIGER rates for the columns of a subset. Set partitions are bitsets (or
+# labels), worked out once for each site pattern in the alignment, and the
+# agreement is only calculated between the distinct patterns in the subset,
+# on as many threads as we're given.
+def subset_rates(alignment, a_subset, n_jobs=1):
+    columns = a_subset.column_set.to_array()
+    if _accel_tiger_agreement is None or len(columns) < 2:
+        return calculate_rates(create_set_parts(SubsetAlignment(alignment, a_subset)))
+
+    log.debug("Estimating TIGER rates")
+    patterns = alignment.patterns
+    ids, _ = patterns.in_sites(columns)
+    labels = pattern_labels(alignment)[ids]
+    agreement = _accel_tiger_agreement(labels, threads=n_jobs)
+    if np.isnan(agreement).any():
+        log.error("TIGER rates can't be calculated for a site that only "
+                  "has missing data")
+        raise PartitionFinderError
+    return site_rates(agreement, np.searchsorted(ids, patterns.site_pattern[columns]))
+
 
 if __name__ == "__main__":
     set_parts = [[[1,3],[2],[4]], [[1],[2],[3],[4]], [[1,2,3],[4]], [[1,2],[3,4]], [[1,2,3,4]]]
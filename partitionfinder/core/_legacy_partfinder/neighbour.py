@@ -20,36 +20,171 @@ import scheme
 import numpy as np
 import scipy.spatial.distance
 import itertools
+import collections
 from util import PartitionFinderError
 
 import logtools
 log = logtools.get_logger()
 
 
+# Where each row starts in the condensed (upper triangle) vector of pairs,
+# for the last few numbers of subsets we've seen
+_row_starts = collections.OrderedDict()
+_ROW_STARTS_CACHE = 8
+
+
+def row_starts(n):
+    found = _row_starts.get(n)
+    if found is None:
+        i = np.arange(n, dtype=np.int64)
+        found = i * (2 * n - i - 1) // 2
+        _row_starts[n] = found
+        if len(_row_starts) > _ROW_STARTS_CACHE:
+            _row_starts.popitem(last=False)
+    else:
+        _row_starts.move_to_end(n)
+    return found
+
+
+def pair_indices(k, n):
+    """The (i, j) of positions k in the condensed vector of pairs of n
+    things. This is np.triu_indices(n, 1)[k], without building all of it.
+    """
+    starts = row_starts(n)
+    i = np.searchsorted(starts, k, side='right') - 1
+    j = k - starts[i] + i + 1
+    return i, j
+
+
+def smallest(values, N):
+    """The positions of the N smallest values, smallest first
+
+    Equal values come in order of position, so this is
+    np.argsort(values, kind='stable')[:N], but we only sort the N we want.
+    """
+    N = min(int(N), len(values))
+    if N <= 0:
+        return np.empty(0, dtype=np.int64)
+    if N == len(values):
+        return np.argsort(values, kind='stable')
+
+    kth = values[np.argpartition(values, N - 1)[:N]].max()
+    if np.isnan(kth):
+        return np.argsort(values, kind='stable')[:N]
+    # Everything below the Nth value, and as many of the ones equal to it as
+    # we need, in order of position
+    below = np.flatnonzero(values < kth)
+    ties = np.flatnonzero(values == kth)[:N - len(below)]
+    chosen = np.concatenate((below, ties))
+    return chosen[np.argsort(values[chosen], kind='stable')]
+
+
 def get_ranked_list(distance_matrix, subsets, N):
     """
     Return the N closest pairs of subsets in 'subsets' 
     """
-
-    # TODO. If/when anaconda moves to numpy v1.8, we can use
-    # a ~7x faster solution here, which uses np.argpartition()
-    # see here: http://stackoverflow.com/questions/20540889/
-    # extract-the-n-closest-pairs-from-a-numpy-distance-array
-    N = int(N)
-    closest = distance_matrix.argsort()[:N]
-    n = len(subsets)
-    ti = np.triu_indices(n, 1)
-    r  = zip(ti[0][closest] + 1, ti[1][closest] + 1)
+    closest = smallest(np.asarray(distance_matrix).ravel(), N)
+    r = zip(*pair_indices(closest, len(subsets)))
 
     # and we look up all the subsets that correspond to each distance
     # and add it to our ordered list of subset lists
     ordered_subsets = []
-    for i, pair in enumerate(r):
-        subset_group = [subsets[i-1] for i in pair]
+    for pair in r:
+        subset_group = [subsets[i] for i in pair]
         ordered_subsets.append(subset_group)
 
     return ordered_subsets
 
+
+class PairRanking(object):
+    """The closest pairs of subsets, kept up to date as subsets are merged
+
+    Pairs are ranked by distance, and then by where the two subsets are in
+    the subset list (as get_ranked_list does). We keep every pair that
+    ranks above a cut-off, a few more than we need. When subsets are
+    merged, their pairs go, and the pairs of the new subset that rank above
+    the cut-off come in. This is only right if the distances between the
+    other subsets haven't changed. We rank all of the pairs again (with
+    distance_fn) if we run short.
+    """
+
+    def __init__(self, subsets, distance_fn, N, spare=2):
+        self.distance_fn = distance_fn
+        self.N = int(N)
+        self.keep = max(1, spare * self.N)
+        self.rank(subsets)
+
+    @property
+    def subsets(self):
+        """The subsets, in the order of the subset list"""
+        return list(self.order)
+
+    def rank(self, subsets):
+        """Rank all of the pairs of subsets"""
+        self.order = dict((s, i) for i, s in enumerate(subsets))
+        self.added = len(subsets)
+        distances = np.asarray(self.distance_fn(subsets), dtype=np.float64).ravel()
+        closest = smallest(distances, self.keep)
+        i, j = pair_indices(closest, len(subsets))
+        self.distances = distances[closest]
+        self.first, self.second = i, j
+        self.stale = False
+        # If we kept every pair, nothing can be missing when we merge
+        self.complete = len(closest) == len(distances)
+
+    def closest(self, N=None):
+        """The N closest pairs, as get_ranked_list gives them"""
+        N = self.N if N is None else int(N)
+        if self.stale or (len(self.distances) < N and not self.complete):
+            self.keep = max(self.keep, N)
+            self.rank(self.subsets)
+        at = dict((self.order[s], s) for s in self.order)
+        return [[at[a], at[b]] for a, b in
+                zip(self.first[:N].tolist(), self.second[:N].tolist())]
+
+    def invalidate(self):
+        """The distances between the subsets have changed, so we need to
+        rank them all again, when we're next asked"""
+        self.stale = True
+
+    def merge(self, remove_list, merged, distances=None):
+        """Swap the subsets in remove_list for the merged one. distances are
+        from each of the other subsets (in order) to the merged one, which
+        we don't need if we have to rank everything again anyway."""
+        removed = np.array([self.order.pop(r) for r in remove_list])
+        if self.stale:
+            self.order[merged] = self.added
+            self.added += 1
+            return
+        keep = ~(np.isin(self.first, removed) | np.isin(self.second, removed))
+        others = np.fromiter(self.order.values(), dtype=np.int64,
+                             count=len(self.order))
+        distances = np.asarray(distances, dtype=np.float64).ravel()
+        if len(distances) != len(others):
+            log.error("Need the distance from each subset to the merged one")
+            raise PartitionFinderError
+        new = self.added
+        self.order[merged] = new
+        self.added += 1
+
+        # The new pairs all go after the old ones with the same distance
+        # from the same subset, since the new subset is at the end
+        if self.complete:
+            wanted = np.ones(len(distances), dtype=bool)
+        elif len(self.distances):
+            cutoff = (self.distances[-1], self.first[-1], self.second[-1])
+            wanted = (distances < cutoff[0]) | (
+                (distances == cutoff[0]) & (others < cutoff[1]))
+        else:
+            wanted = np.zeros(len(distances), dtype=bool)
+
+        d = np.concatenate((self.distances[keep], distances[wanted]))
+        a = np.concatenate((self.first[keep], others[wanted]))
+        b = np.concatenate((self.second[keep],
+                            np.full(wanted.sum(), new, dtype=np.int64)))
+        ranked = np.lexsort((b, a, d))
+        self.distances, self.first, self.second = d[ranked], a[ranked], b[ranked]
+
 def get_manhattan_matrix(rates, freqs, model, alpha, weights):
 
     # get distances between all pairs for all nonzero weights
@@ -119,6 +254,129 @@ def get_distance_matrix(subsets, weights):
 
     return final_dists
 
+class DistanceMatrix(object):
+    """The distances between the subsets of a scheme, kept up to date as
+    subsets are merged
+
+    get_distance_matrix works these out from scratch, getting the
+    parameters of every subset and measuring every pair again, when only
+    the merged subsets have changed. Here we keep the raw distances for each
+    parameter, between slots that subsets keep until they are merged away
+    (as in CMatrix), and the largest of each, which we normalise by. A merge
+    only measures the pairs with the new subset. The other distances only
+    change if one of the largest ones does, and we don't normalise them
+    again until someone asks for them.
+    """
+
+    params = ("rate", "freqs", "model", "alpha")
+
+    def __init__(self, subsets, weights):
+        self.weights = weights
+        self.used = [p for p in self.params if weights[p] > 0]
+        if not self.used:
+            log.error("Problem calculating subset similarity. Please check that you included"
+                    " at least one non-zero weight in your clustering weights")
+            raise PartitionFinderError
+
+        n = len(subsets)
+        self.capacity = n
+        # The subsets in the order of the subset list (see CMatrix)
+        self.slots = dict((s, i) for i, s in enumerate(subsets))
+        self.free = []
+        self.values = {}
+        self.raw = {}
+        self.largest = {}
+        values = self.param_values(subsets)
+        for p in self.used:
+            self.values[p] = values[p]
+            self.raw[p] = scipy.spatial.distance.pdist(values[p], 'cityblock')
+            self.largest[p] = np.amax(self.raw[p]) if len(self.raw[p]) else 0.0
+
+    @property
+    def subsets(self):
+        return list(self.slots)
+
+    def param_values(self, subsets):
+        values = dict((p, []) for p in self.used)
+        for s in subsets:
+            param_dict = s.get_param_values()
+            for p in self.used:
+                v = param_dict[p]
+                values[p].append(v if p in ("freqs", "model") else [v])
+        return dict((p, np.array(v, dtype=np.float64)) for p, v in values.items())
+
+    def pairs_of(self, slot, others):
+        """Where the pairs of slot with each of others are in the raw
+        distances"""
+        starts = row_starts(self.capacity)
+        lo = np.minimum(slot, others)
+        hi = np.maximum(slot, others)
+        return starts[lo] + hi - lo - 1
+
+    def normalised(self, raw):
+        # The same sums as get_manhattan_matrix, so we get the same numbers
+        final_dists = None
+        for p in self.used:
+            dists = raw[p]
+            if self.largest[p] > 0:
+                norm = float(self.weights[p])/float(self.largest[p])
+                dists = np.multiply(dists, norm)
+            final_dists = dists if final_dists is None else np.add(final_dists, dists)
+        return final_dists
+
+    def condensed(self, subsets):
+        """get_distance_matrix(subsets), where subsets are all of ours, in
+        any order"""
+        order = np.array([self.slots[s] for s in subsets], dtype=np.int64)
+        index = np.empty(len(order) * (len(order) - 1) // 2, dtype=np.int64)
+        at = 0
+        for i in range(len(order) - 1):
+            row = self.pairs_of(order[i], order[i + 1:])
+            index[at:at + len(row)] = row
+            at += len(row)
+        return self.normalised(dict((p, self.raw[p][index]) for p in self.used))
+
+    def distances_to(self, sub):
+        """The distance from each of the other subsets (in order) to sub"""
+        slot = self.slots[sub]
+        others = np.array([i for i in self.slots.values() if i != slot],
+                          dtype=np.int64)
+        index = self.pairs_of(slot, others)
+        return self.normalised(dict((p, self.raw[p][index]) for p in self.used))
+
+    def merge(self, remove_list, merged):
+        """Swap the subsets in remove_list for the merged one. Returns True
+        if that changed the distances between the other subsets."""
+        largest = dict(self.largest)
+        stale = set()
+        for r in remove_list:
+            slot = self.slots.pop(r)
+            self.free.append(slot)
+            index = self.pairs_of(slot, np.delete(np.arange(self.capacity), slot))
+            for p in self.used:
+                if len(index) and np.amax(self.raw[p][index]) == self.largest[p]:
+                    stale.add(p)
+                # Pairs with empty slots mustn't count towards the largest
+                self.raw[p][index] = 0.0
+
+        slot = self.free.pop()
+        others = np.fromiter(self.slots.values(), dtype=np.int64,
+                             count=len(self.slots))
+        self.slots[merged] = slot
+        values = self.param_values([merged])
+        index = self.pairs_of(slot, others)
+        for p in self.used:
+            self.values[p][slot] = values[p][0]
+            d = scipy.spatial.distance.cdist(
+                values[p], self.values[p][others], 'cityblock')[0]
+            self.raw[p][index] = d
+            if p in stale:
+                self.largest[p] = np.amax(self.raw[p])
+            elif len(d):
+                self.largest[p] = max(self.largest[p], np.amax(d))
+
+        return largest != self.largest
+
 def get_N_closest_subsets(subsets, cfg, N, distance_matrix = np.matrix([])):
     """Find the N most similar groups of subsets in a scheme
     """
@@ -202,111 +460,179 @@ def get_nearest_neighbour_scheme(start_scheme, scheme_name, cfg):
 
 
 
-def update_c_matrix(c_matrix, sub_tuples, subsets, diffs):
-    """
-    Update a symmetric matrix of measurements between subsets.
-    Each subset_tuple contains a new subset that is just merged
-    from a collection of old subsets.
-    """
-    if len(c_matrix.shape) == 1:
-        c_matrix = scipy.spatial.distance.squareform(c_matrix)
-
-    for t, diff in zip(sub_tuples, diffs):
-        old_subs = t[1]
-        i = subsets.index(old_subs[0])
-        j = subsets.index(old_subs[1])
-        c_matrix[i,j] = c_matrix[j,i] = diff
-
-    return c_matrix
-
-def get_best_pair(c_matrix, best_change, subsets):
-
-    log.debug("C matrix: %s", str(c_matrix))
-
-    if len(c_matrix.shape) == 1:
-        log.debug("C matrix shape was == 1")
-        c_matrix = scipy.spatial.distance.squareform(c_matrix)
-        log.debug("C matrix: %s", str(c_matrix))
-
-    l = np.where(c_matrix==best_change)
-
-    log.debug("C matrix dimensions: %s", str(c_matrix.shape))
-    log.debug("Number of subsets: %d", len(subsets))
-    log.debug("Location of best_change in c_matrix: %s", str(l))
-
-    # this function is only called if the best_change is <0
-    # so we can be sure that we are on an off-diagonal
-    # still, we check and throw an error if there's an issue
-    s1 = l[0][0]
-    s2 = l[1][0] 
-
-    if s1==s2:
-        log.error("You can't merge a subset with itself, please check.")
-        raise PartitionFinderError
-
-    log.debug("Subsets to merge: %s and %s" %(s1, s2))
-    sub1 = subsets[s1]
-    sub2 = subsets[s2]
-    return (sub1, sub2)
-
-def reset_c_matrix(c_matrix, remove_list, add_list, subsets):
-
-    if len(c_matrix.shape) == 1:
-        c_matrix = scipy.spatial.distance.squareform(c_matrix)
-
-    indices = []
-    removals = []
-    for r in remove_list:
-        indices.append(subsets.index(r))
-        removals = removals + r.names
-
-    c_matrix = np.delete(c_matrix, indices, 1)
-    c_matrix = np.delete(c_matrix, indices, 0)
-
-    additions = []
-    for a in add_list:
-        additions = additions + a.names
-        row = np.array((c_matrix.shape[0]) * [np.inf])
-        col = c_matrix.shape[0] * [np.inf]
-        col.append(0)
-        col = np.array(col)[:, None]
-        c_matrix = np.vstack((c_matrix, row))
-        c_matrix = np.hstack((c_matrix, col))
-
-    # we can only do this if we've removed the same stuff as we added, check
-    if not additions.sort() == removals.sort():
-        log.error("Removal and addition of subsets don't add up")
-        log.error("Removing: %s", str(removals))
-        log.error("Adding: %s", str(additions))
-        raise PartitionFinderError
-
-    return c_matrix
-
-def reset_subsets(subsets, remove_list, add_list):
-
-    log.debug("Updating subset list")
-    log.debug("Original subset list: %s", str([s.name for s in subsets]))
-    log.debug("Subsets to remove: %s", str([s.name for s in remove_list]))
-    log.debug("Combined subsets to add: %s", str([s.name for s in add_list]))
-
-    for r in remove_list:
-        subsets.pop(subsets.index(r))
-    for a in add_list:
-        subsets.append(a)
-    return subsets
+class CMatrix(object):
+    """The change in score from merging each pair of subsets in a scheme
 
+    This used to be a square array with a row for each subset, in the order
+    of the subset list, so every merge deleted two rows and columns and
+    added one (copying the whole thing), and finding a subset meant
+    searching the list. Here each subset gets a slot that it keeps until it
+    is merged away, and the slots of merged subsets are used again, so
+    nothing moves. Pairs we haven't analysed are inf.
 
-def get_pairs_todo(closest_pairs, c_matrix, subsets):
-    pairs_todo = []
-    if len(c_matrix.shape) == 1:
-        c_matrix = scipy.spatial.distance.squareform(c_matrix)
-
-    for p in closest_pairs:
-        i = subsets.index(p[0])
-        j = subsets.index(p[1])
-        if c_matrix[i,j] == np.inf:
-            pairs_todo.append(p)
+    Dense storage is a (slots x slots) array, which suits the greedy search,
+    where we analyse every pair. Sparse storage only keeps the pairs we've
+    analysed, which is a small fraction of them in the relaxed clustering
+    search. Both choose the same merges the old matrix did.
+    """
 
-    return pairs_todo
+    def __init__(self, subsets, sparse=False):
+        # The subsets in the order of the old subset list: merging removes
+        # subsets from where they were, and adds the new one at the end.
+        # dicts keep that order for us.
+        self.slots = {}
+        self.free = []
+        # Where each slot's subset comes in the subset list, for breaking
+        # ties the way the old matrix did
+        self.order = np.zeros(len(subsets), dtype=np.int64)
+        self.added = 0
+        self.sparse = sparse
+        if sparse:
+            self.changes = {}
+            self.partners = [set() for s in subsets]
+        else:
+            self.changes = np.full((len(subsets), len(subsets)), np.inf)
+        for s in subsets:
+            self.add(s)
+
+    @property
+    def subsets(self):
+        """The subsets, in the order of the old subset list"""
+        return list(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, sub):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = len(self.slots)
+            if slot == len(self.order):
+                self.grow()
+        self.slots[sub] = slot
+        self.order[slot] = self.added
+        self.added += 1
+
+    def grow(self):
+        size = max(1, 2 * len(self.order))
+        self.order = np.resize(self.order, size)
+        if self.sparse:
+            self.partners.extend(set() for i in range(size - len(self.partners)))
+        else:
+            changes = np.full((size, size), np.inf)
+            n = len(self.changes)
+            changes[:n, :n] = self.changes
+            self.changes = changes
+
+    def remove(self, sub):
+        try:
+            slot = self.slots.pop(sub)
+        except KeyError:
+            log.error("Couldn't find the subset you were looking for")
+            raise PartitionFinderError
+        if self.sparse:
+            for other in self.partners[slot]:
+                self.partners[other].discard(slot)
+                del self.changes[(min(slot, other), max(slot, other))]
+            self.partners[slot].clear()
+        else:
+            self.changes[slot, :] = np.inf
+            self.changes[:, slot] = np.inf
+        self.free.append(slot)
+
+    def get(self, sub1, sub2):
+        i, j = self.slots[sub1], self.slots[sub2]
+        if self.sparse:
+            return self.changes.get((min(i, j), max(i, j)), np.inf)
+        return self.changes[i, j]
+
+    def set(self, sub1, sub2, change):
+        i, j = self.slots[sub1], self.slots[sub2]
+        if self.sparse:
+            self.changes[(min(i, j), max(i, j))] = change
+            self.partners[i].add(j)
+            self.partners[j].add(i)
+        else:
+            self.changes[i, j] = self.changes[j, i] = change
+
+    def update(self, sub_tuples, diffs):
+        """Record the change for each (merged subset, pair) in sub_tuples"""
+        for t, diff in zip(sub_tuples, diffs):
+            old_subs = t[1]
+            self.set(old_subs[0], old_subs[1], diff)
+
+    def pairs_todo(self, closest_pairs):
+        """The pairs in closest_pairs that we haven't analysed yet"""
+        return [p for p in closest_pairs if self.get(p[0], p[1]) == np.inf]
+
+    def values(self):
+        """The changes for the pairs we've analysed (once each)"""
+        if self.sparse:
+            return np.fromiter(self.changes.values(), dtype=np.float64,
+                               count=len(self.changes))
+        changes = self.changes[np.triu_indices(len(self.changes), 1)]
+        return changes[changes != np.inf]
+
+    def best_change(self):
+        """The smallest change, or 0.0 (merging a subset with itself) if
+        there isn't one below that"""
+        changes = self.values()
+        if len(changes) == 0:
+            return 0.0
+        return min(0.0, np.amin(changes))
+
+    def median_improvement(self):
+        """The median of the changes that improve the score"""
+        changes = self.values()
+        return np.median(changes[changes < 0])
+
+    def best_pair(self, best_change):
+        """The pair of subsets with this change. If there are a few, this is
+        the first in the old matrix: the one whose first subset comes first
+        in the subset list, and then whose second one does."""
+        if self.sparse:
+            found = [k for k, v in self.changes.items() if v == best_change]
+            i = np.array([k[0] for k in found], dtype=np.int64)
+            j = np.array([k[1] for k in found], dtype=np.int64)
+        else:
+            i, j = np.nonzero(self.changes == best_change)
+        if len(i) == 0 or np.any(i == j):
+            log.error("You can't merge a subset with itself, please check.")
+            raise PartitionFinderError
 
+        first = np.minimum(self.order[i], self.order[j])
+        second = np.maximum(self.order[i], self.order[j])
+        best = np.lexsort((second, first))[0]
+        s1, s2 = i[best], j[best]
+        if self.order[s1] > self.order[s2]:
+            s1, s2 = s2, s1
+
+        log.debug("Subsets to merge: %s and %s" %(s1, s2))
+        subset_at = dict((slot, sub) for sub, slot in self.slots.items())
+        return (subset_at[s1], subset_at[s2])
+
+    def merge(self, remove_list, add_list):
+        """Swap the subsets in remove_list for the ones in add_list, which
+        are merged from them"""
+        removals = []
+        for r in remove_list:
+            removals = removals + r.names
+        additions = []
+        for a in add_list:
+            additions = additions + a.names
+
+        # we can only do this if we've removed the same stuff as we added, check
+        if sorted(additions) != sorted(removals):
+            log.error("Removal and addition of subsets don't add up")
+            log.error("Removing: %s", str(removals))
+            log.error("Adding: %s", str(additions))
+            raise PartitionFinderError
 
+        log.debug("Updating subset list")
+        log.debug("Subsets to remove: %s", str([s.name for s in remove_list]))
+        log.debug("Combined subsets to add: %s", str([s.name for s in add_list]))
+        for r in remove_list:
+            self.remove(r)
+        for a in add_list:
+            self.add(a)
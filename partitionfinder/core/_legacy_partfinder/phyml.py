@@ -20,6 +20,7 @@ log = logtools.get_logger()
 
 import os
 import sys
+import threading
 import util
 
 from pyparsing import (
@@ -119,8 +120,12 @@ def check_defaults(cmdline_extras):
     return cmdline_extras
 
 
-def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
-    """Do the analysis -- this will overwrite stuff!"""
+def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras,
+            cpus=1):
+    """Do the analysis -- this will overwrite stuff!
+
+    PhyML has no threaded version, so `cpus` is ignored.
+    """
 
     # Move it to a new name to stop phyml stomping on different model analyses
     # dupfile(alignment_path, analysis_path)
@@ -219,14 +224,17 @@ class Parser(object):
         return res
 
 
+_parsers = threading.local()
+
+
 def parse(text, cfg):
     # Building the pyparsing grammar is moderately expensive; cache per-config
-    # for the lifetime of the process.
-    global _PARSER_CACHE
+    # for the lifetime of the thread. pyparsing grammars are not safe to share
+    # between threads, and the executors parse in the worker threads.
     try:
-        cache = _PARSER_CACHE
-    except NameError:
-        cache = _PARSER_CACHE = {}
+        cache = _parsers.cache
+    except AttributeError:
+        cache = _parsers.cache = {}
 
     key = id(cfg)
     the_parser = cache.get(key)
@@ -18,6 +18,8 @@
 import logtools
 log = logtools.get_logger()
 
+import datetime
+
 class Progress(object):
     def __init__(self, cfg):
         self.cfg = cfg
@@ -79,8 +81,19 @@ class TextProgress(Progress):
             else:    
                 percent_done = (
                     float(num_subs_done) * 100.0) / float(self.subset_count)
-                log.info("Finished subset %d/%d, %.2f percent done" %
-                         (num_subs_done, self.subset_count, percent_done))
+                log.info("Finished subset %d/%d, %.2f percent done%s" %
+                         (num_subs_done, self.subset_count, percent_done,
+                          self.eta_text()))
+
+    def eta_text(self):
+        cost_model = getattr(self.cfg, 'cost_model', None)
+        if cost_model is None:
+            return ""
+        eta = cost_model.eta()
+        if eta is None:
+            return ""
+        return " (about %s left in this step)" % (
+            datetime.timedelta(seconds=int(eta)))
 
     def end(self):
         pass
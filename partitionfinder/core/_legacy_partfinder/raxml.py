@@ -77,13 +77,26 @@ def run_raxml_pthreads(command, cpus):
     util.run_program(_raxml_pthreads_binary, command)
 
 
+# The RAxML manual's rule of thumb: with fewer sites than this per thread, the
+# threads spend more time talking to each other than working
+_sites_per_thread = {
+    "DNA": 500,
+    "protein": 150,
+    "morphology": 500,
+}
+
+
+def max_useful_threads(n_sites, datatype):
+    return max(n_sites // _sites_per_thread.get(datatype, 500), 1)
+
+
 def write_partition_file(scheme, alignment_path):
     ''' Write a raxml partitions file to make an ML tree '''
     aln_dir, fname = os.path.split(alignment_path)
     partition_filepath = os.path.join(aln_dir, 'partitions.txt')
     partition_filehandle = open(partition_filepath, 'w')
     sorted_subsets = [sub for sub in scheme]
-    sorted_subsets.sort(key=lambda sub: min(sub.columns), reverse=False)
+    sorted_subsets.sort(key=lambda sub: sub.column_set.min(), reverse=False)
     write_raxml_partitions(scheme, partition_filehandle, sorted_subsets, use_lg = True)
     return(partition_filepath)
 
@@ -273,7 +286,8 @@ def check_defaults(cmdline_extras):
     return cmdline_extras
 
 
-def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
+def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras,
+            cpus=1):
     """Do the analysis -- this will overwrite stuff!"""
 
     # Move it to a new name to stop raxml stomping on different model analyses
@@ -305,7 +319,10 @@ def analyse(model, alignment_path, tree_path, branchlengths, cmdline_extras):
     aln_dir, fname = os.path.split(alignment_path)
     command = " %s -s '%s' -t '%s' %s -n %s -w '%s' %s" % (
         bl, alignment_path, tree_path, model_params, analysis_ID, os.path.abspath(aln_dir), cmdline_extras)
-    run_raxml(command)
+    if cpus > 1:
+        run_raxml_pthreads(command, cpus)
+    else:
+        run_raxml(command)
 
 
 def raxml_analysis_ID(alignment_path, model):
@@ -0,0 +1,359 @@
+# Copyright (C) 2012-2013 Robert Lanfear and Brett Calcott
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details. You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# PartitionFinder also includes the PhyML program, the RAxML program, and the
+# PyParsing library, all of which are protected by their own licenses and
+# conditions, using PartitionFinder implies that you agree with those licences
+# and conditions as well.
+
+"""Run the analyses on other machines
+
+The analysis listens on a TCP port (--executor remote --listen HOST:PORT),
+and workers (PartitionFinderWorker.py) connect to it. Each worker connection
+is one slot: it gets sent a task along with the subset alignment, runs it in
+its own scratch folder, and sends back the TaskOutcome, which holds the parsed
+result record.
+
+Everything goes over multiprocessing.connection, so the connection is
+authenticated with a shared key before anything is unpickled.
+
+The analysis still writes every result to the database as it arrives, keyed
+by subset_id, so a restart only runs what is left. If a worker goes away (or
+goes quiet for too long) its task goes back on the queue and is tried again
+elsewhere.
+"""
+
+import logtools
+log = logtools.get_logger()
+
+import os
+import time
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import util
+import executors
+from config import the_config
+from util import PartitionFinderError
+
+DEFAULT_ADDRESS = "127.0.0.1:6510"
+AUTHKEY_VARIABLE = "PARTITIONFINDER_AUTHKEY"
+
+# Workers say they are still alive this often (seconds) while they run a
+# task. If we hear nothing for HEARTBEAT_TIMEOUT we give up on them.
+HEARTBEAT = 10
+HEARTBEAT_TIMEOUT = 6 * HEARTBEAT
+
+# How many times we'll hand out a task that keeps losing its worker
+MAX_ATTEMPTS = 3
+
+
+class RemoteError(PartitionFinderError):
+    pass
+
+
+class WorkerLost(Exception):
+    pass
+
+
+def parse_address(text):
+    host, sep, port = text.rpartition(':')
+    if not sep or not port.isdigit():
+        log.error("Bad address '%s'. It should look like HOST:PORT, e.g. %s",
+                  text, DEFAULT_ADDRESS)
+        raise RemoteError
+    return host or "127.0.0.1", int(port)
+
+
+def get_authkey(authkey=None):
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if authkey is None:
+        return None
+    if not isinstance(authkey, bytes):
+        authkey = authkey.encode('utf-8')
+    return authkey
+
+
+class RemoteExecutor(executors.Executor):
+    """Hands the tasks out to whichever workers have connected
+
+    Our capacity is the number of connected workers, so it changes as they
+    come and go.
+    """
+    name = 'remote'
+
+    def __init__(self, threads, context, window=None):
+        executors.Executor.__init__(self, threads, context, window)
+        self.address = parse_address(the_config.listen or DEFAULT_ADDRESS)
+        self.authkey = get_authkey(the_config.authkey)
+        if self.authkey is None:
+            key = os.urandom(16).hex()
+            log.info("No key given for the workers, so I made one up. Start "
+                     "the workers with '--authkey %s'", key)
+            self.authkey = key.encode('utf-8')
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.attempts = {}
+        self.listener = None
+        self.closing = False
+
+    def has_room(self, cpus, cpus_in_flight, multi_in_flight):
+        with self.lock:
+            slots = max(len(self.connections), 1)
+        self.threads = slots
+        self.window = 2 * slots
+        return executors.Executor.has_room(
+            self, cpus, cpus_in_flight, multi_in_flight)
+
+    def start(self):
+        if self.listener is not None:
+            return
+        self.closing = False
+        self.tasks = queue.Queue()
+        with open(self.context.tree_path, 'rb') as f:
+            self.tree = f.read()
+        self.listener = Listener(self.address, authkey=self.authkey)
+        log.info("Waiting for workers to connect on %s:%d", *self.address)
+        t = threading.Thread(target=self.accept)
+        t.daemon = True
+        t.start()
+
+    def accept(self):
+        listener = self.listener
+        while not self.closing:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                log.warning("A worker tried to connect with the wrong key")
+                continue
+            except (OSError, EOFError):
+                if self.closing:
+                    return
+                continue
+            t = threading.Thread(target=self.serve, args=(conn, ))
+            t.daemon = True
+            t.start()
+
+    def serve(self, conn):
+        try:
+            kind, host = conn.recv()
+            conn.send(('context', self.context, self.tree))
+        except (OSError, EOFError, ValueError):
+            conn.close()
+            return
+
+        with self.lock:
+            self.connections.add(conn)
+        log.info("Worker connected from %s", host)
+        # Wake up the scheduler, as we might have room for more tasks now
+        self.results.put(None)
+
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    break
+                try:
+                    with open(task.alignment_path, 'rb') as f:
+                        alignment = f.read()
+                    conn.send(('task', task, alignment))
+                    outcome = self.wait_for(conn)
+                except (OSError, EOFError, WorkerLost):
+                    if not self.closing:
+                        log.warning("Lost the worker on %s while it was "
+                                    "running %s", host, task)
+                        self.retry(task)
+                    break
+                self.results.put(outcome)
+        finally:
+            with self.lock:
+                self.connections.discard(conn)
+            conn.close()
+
+    def wait_for(self, conn):
+        while True:
+            if not conn.poll(HEARTBEAT_TIMEOUT):
+                raise WorkerLost
+            kind, body = conn.recv()
+            if kind == 'done':
+                return body
+
+    def retry(self, task):
+        key = (task.subset_id, task.model)
+        attempts = self.attempts.get(key, 1) + 1
+        self.attempts[key] = attempts
+        if attempts <= MAX_ATTEMPTS:
+            self.tasks.put(task)
+            return
+        log.error("Gave up on %s after losing %d workers", task, MAX_ATTEMPTS)
+        self.results.put(executors.TaskOutcome(
+            task, executors.FAILED, error=RemoteError()))
+
+    def submit(self, task):
+        # Each worker slot runs a single thread
+        task.cpus = 1
+        self.tasks.put(task)
+
+    def cancel(self):
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+
+    def stop(self):
+        if self.listener is None:
+            return
+        self.closing = True
+        self.listener.close()
+        self.listener = None
+        with self.lock:
+            connections = list(self.connections)
+        for i in range(len(connections)):
+            self.tasks.put(None)
+        for conn in connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+def connect(address, authkey, wait):
+    """Keep trying to connect for `wait` seconds"""
+    give_up = time.time() + wait
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except (ConnectionRefusedError, FileNotFoundError):
+            if time.time() > give_up:
+                raise
+            time.sleep(1)
+
+
+def send_heartbeats(conn, send_lock, running):
+    while not running.wait(HEARTBEAT):
+        with send_lock:
+            try:
+                conn.send(('alive', None))
+            except OSError:
+                return
+
+
+def run_worker(address, authkey, wait=60):
+    """Connect to an analysis and run its tasks until it has finished"""
+    conn = connect(address, authkey, wait)
+    conn.send(('hello', socket.gethostname()))
+    kind, context, tree = conn.recv()
+
+    # Our own folder and copy of the programs, whatever the analysis uses
+    scratch = tempfile.mkdtemp(prefix='pf_worker_')
+    the_config.find_programs()
+    context.program_path = util.program_path
+    context.working_folder = scratch
+    context.save_phylofiles = False
+    context.tree_path = os.path.join(scratch, 'tree.phy')
+    with open(context.tree_path, 'wb') as f:
+        f.write(tree)
+    context.install()
+
+    send_lock = threading.Lock()
+    done = 0
+    try:
+        while True:
+            try:
+                kind, task, alignment = conn.recv()
+            except (EOFError, OSError):
+                # The analysis is finished (or gone)
+                break
+
+            task.alignment_path = os.path.join(
+                scratch, os.path.basename(task.alignment_path))
+            with open(task.alignment_path, 'wb') as f:
+                f.write(alignment)
+
+            running = threading.Event()
+            t = threading.Thread(
+                target=send_heartbeats, args=(conn, send_lock, running))
+            t.daemon = True
+            t.start()
+            try:
+                outcome = executors._run_safely(task)
+            finally:
+                running.set()
+                t.join()
+            # This takes the alignment with it
+            util.remove_runID_files(task.alignment_path)
+
+            if isinstance(outcome.error, BaseException):
+                # It might not survive the trip, so send a description
+                outcome.error = RemoteError(
+                    "%s on %s: %s" % (type(outcome.error).__name__,
+                                      socket.gethostname(), outcome.error))
+            with send_lock:
+                try:
+                    conn.send(('done', outcome))
+                except OSError:
+                    break
+            done += 1
+    finally:
+        conn.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+    log.info("Worker finished after running %d tasks", done)
+    return done
+
+
+def _worker_process(address, authkey, wait):
+    try:
+        run_worker(address, authkey, wait)
+    except KeyboardInterrupt:
+        pass
+
+
+def worker_main(argv):
+    from optparse import OptionParser
+    op = OptionParser("python %prog [options] [HOST:PORT]")
+    op.add_option(
+        "-p", "--processes",
+        type="int", dest="processes", default=1, metavar="N",
+        help="Number of tasks to run at once on this machine.")
+    op.add_option(
+        "--authkey",
+        type="str", dest="authkey", default=None, metavar="KEY",
+        help="The key the analysis was started with. This can also be set "
+             "with the %s environment variable." % AUTHKEY_VARIABLE)
+    op.add_option(
+        "--wait",
+        type="int", dest="wait", default=60, metavar="SECONDS",
+        help="How long to keep trying to connect to the analysis.")
+    options, args = op.parse_args(argv)
+
+    address = parse_address(args[0] if args else DEFAULT_ADDRESS)
+    authkey = get_authkey(options.authkey)
+    if authkey is None:
+        op.error("A key is needed (--authkey or %s)" % AUTHKEY_VARIABLE)
+
+    procs = []
+    for i in range(max(options.processes, 1)):
+        p = multiprocessing.Process(
+            target=_worker_process, args=(address, authkey, options.wait))
+        p.start()
+        procs.append(p)
+    for p in procs:
+        p.join()
+    return 0
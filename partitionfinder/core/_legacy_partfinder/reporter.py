@@ -61,7 +61,7 @@ class TextReporter(object):
             output.write("Subset alignment stored here: %s\n" % sub.alignment_path)
         if the_config.search not in _odd_searches:
             output.write("This subset contains the following data_blocks: %s\n" % sub.name)
-        output.write("Number of columns in subset: %d\n" % len(sub.columns))
+        output.write("Number of columns in subset: %d\n" % len(sub.column_set))
         output.write("Models are organised according to their AICc scores\n\n")
 
         output.write(subset_template % ("Model", "Parameters", "lnL", "AICc", "AIC", "BIC"))
@@ -104,7 +104,7 @@ class TextReporter(object):
             output.write(kmeans_warning)
         self.write_scheme_header(sch, result, output)
         sorted_subsets = [sub for sub in sch]
-        sorted_subsets.sort(key=lambda sub: min(sub.columns), reverse=False)
+        sorted_subsets.sort(key=lambda sub: sub.column_set.min(), reverse=False)
         self.write_subsets(sch, result, output, sorted_subsets)
         self.write_nexus_summary(output, sorted_subsets)
         self.write_IQtree_summary(output, sorted_subsets)
@@ -179,7 +179,7 @@ class TextReporter(object):
             
         if self.cfg.search in _odd_searches:
             for sub in sorted_subsets:
-                num_sites = len(sub.columns)
+                num_sites = len(sub.column_set)
                 
                 sites = [x + 1 for x in sub.columns]
                 pf_scheme_description.append("(%s)" % str(sites).strip('[]'))
@@ -198,7 +198,7 @@ class TextReporter(object):
                 output.write(scheme_subset_template % (
                     number, 
                     sub.best_model, 
-                    len(sub.columns), 
+                    len(sub.column_set), 
                     sub.subset_id, 
                     sub.name,
                     ))
@@ -0,0 +1,178 @@
+# Copyright (C) 2012-2013 Robert Lanfear and Brett Calcott
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details. You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# PartitionFinder also includes the PhyML program, the RAxML program, and the
+# PyParsing library, all of which are protected by their own licenses and
+# conditions, using PartitionFinder implies that you agree with those licences
+# and conditions as well.
+
+"""A cache of model results that is shared between analyses
+
+The database in analysis/subsets only helps when the same analysis is run
+again. But the result of running a model on a subset only depends on the
+subset alignment, the model, the starting tree and the program settings,
+not on the search or the model selection. So if you sweep aicc/bic or
+greedy/rcluster over the same alignment, most of the work has already been
+done.
+
+This keeps those results in one SQLite database (see --result-cache), keyed
+by a digest of all of those things. Any number of analyses can use it at
+once. It is kept under a size limit by dropping the results that were used
+least recently.
+"""
+
+import logtools
+log = logtools.get_logger()
+
+import os
+import time
+import hashlib
+import sqlite3
+import numpy
+
+from util import PartitionFinderError
+
+CACHE_VARIABLE = "PARTITIONFINDER_RESULT_CACHE"
+DEFAULT_SIZE_MB = 1024
+
+# When we go over the size limit, cut back to this fraction of it, so we
+# aren't evicting on every write
+_EVICT_TO = 0.9
+
+# How long to wait (seconds) for another analysis to let go
+_BUSY_TIMEOUT = 60.0
+
+
+class ResultCacheError(PartitionFinderError):
+    pass
+
+
+def context_digest(cfg, tree_path):
+    """Everything other than the alignment and model that the result depends on
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(tree_path, 'rb') as f:
+        h.update(f.read())
+    for item in (cfg.phylogeny_program, cfg.datatype, cfg.branchlengths,
+                 cfg.cmdline_extras or "",
+                 repr(cfg.data_layout.data_type.descr)):
+        h.update(b'\0')
+        h.update(str(item).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, path, context, dtype, size_mb=DEFAULT_SIZE_MB):
+        self.path = path
+        self.context = context
+        self.dtype = dtype
+        self.max_bytes = int(size_mb * 1024 * 1024)
+        self.hits = 0
+        self.stored = 0
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        try:
+            self.conn = sqlite3.connect(path, timeout=_BUSY_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "key TEXT PRIMARY KEY, record BLOB NOT NULL, "
+                    "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS results_last_used "
+                    "ON results (last_used)")
+        except sqlite3.Error as e:
+            log.error("Couldn't open the result cache at %s: %s", path, e)
+            raise ResultCacheError
+
+        self.size = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        log.info("Using the result cache at %s (%.1f of %d MB used)",
+                 path, self.size / 1048576.0, size_mb)
+
+    def key(self, alignment_digest, model):
+        h = hashlib.blake2b(digest_size=16)
+        for item in (self.context, alignment_digest, model):
+            h.update(item.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, alignment_digest, model):
+        """A copy of the stored record, or None"""
+        key = self.key(alignment_digest, model)
+        row = self.conn.execute(
+            "SELECT record FROM results WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?",
+                (time.time(), key))
+        self.hits += 1
+        return numpy.frombuffer(row[0], dtype=self.dtype)[0].copy()
+
+    def put(self, alignment_digest, model, record):
+        data = record.tobytes()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (self.key(alignment_digest, model), data, len(data),
+                 time.time()))
+        self.stored += 1
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop the least recently used results until we're under the limit"""
+        # Other analyses might have been adding things too
+        self.size = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        target = self.max_bytes * _EVICT_TO
+        if self.size <= target:
+            return
+        dropped = []
+        freed = 0
+        rows = self.conn.execute(
+            "SELECT key, size FROM results ORDER BY last_used")
+        for key, size in rows:
+            if self.size - freed <= target:
+                break
+            dropped.append((key, ))
+            freed += size
+        rows.close()
+        with self.conn:
+            self.conn.executemany("DELETE FROM results WHERE key = ?", dropped)
+        self.size -= freed
+        log.debug("Dropped %d results from the result cache", len(dropped))
+
+    def close(self):
+        if self.hits or self.stored:
+            log.info("Result cache: used %d stored results, and added %d",
+                     self.hits, self.stored)
+        self.conn.close()
+
+
+def open_cache(cfg, tree_path):
+    """The result cache for this analysis, or None if we aren't using one"""
+    path = cfg.result_cache_path or os.environ.get(CACHE_VARIABLE)
+    if not path:
+        return None
+    if os.path.isdir(path):
+        path = os.path.join(path, 'results.sqlite')
+    return ResultCache(path, context_digest(cfg, tree_path),
+                       cfg.data_layout.data_type,
+                       cfg.result_cache_size or DEFAULT_SIZE_MB)
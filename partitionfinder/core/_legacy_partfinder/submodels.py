@@ -19,6 +19,7 @@ import logtools
 log = logtools.get_logger()
 
 import math
+from functools import reduce
 
 def submodel_generator(result, pat, current, maxn):
     """ result is a list to append to
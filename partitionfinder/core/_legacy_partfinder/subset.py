@@ -20,8 +20,11 @@ log = logtools.get_logger()
 
 import os
 import numpy
+import weakref
+import collections
 
-from alignment import Alignment, SubsetAlignment
+from alignment import Alignment, SubsetAlignment, read_digest, write_digest
+from columns import ColumnSet
 from util import (ParseError, PartitionFinderError, remove_runID_files, get_aic, get_aicc,
                   get_bic)
 import subset_ops
@@ -34,6 +37,114 @@ class SubsetError(PartitionFinderError):
     pass
 
 
+def make_result_record(cfg, subset_id, model, result, n_sites):
+    """Turn the result class from raxml or phyml into a numpy record
+
+    This doesn't need the Subset itself, so it can be done by the workers.
+    """
+    K = float(cfg.processor.models.get_num_params(model))
+    n = float(n_sites)
+    lnL = float(result.lnl)
+
+    result.subset_id = subset_id
+    result.model_id = model
+    result.params = K
+    result.aic = get_aic(lnL, K)
+    result.aicc = get_aicc(lnL, K, n)
+    result.bic = get_bic(lnL, K, n)
+    return result._data
+
+
+# The default memory budget for the subsets that we keep around, in MB
+DEFAULT_CACHE_MB = 1024
+
+# Roughly what a subset costs us on top of its columns and results
+_SUBSET_OVERHEAD = 2000
+
+
+class SubsetCache(object):
+    """Finds the existing Subset for a subset_id
+
+    Every Subset that is still in use somewhere (in a scheme, or a list of
+    subsets being analysed) stays findable, through a weak reference, so the
+    flyweight contract holds. On top of that we keep strong references to the
+    most recently used subsets, up to a memory budget. Once a subset drops
+    off the end of that, a finished subset is cut down to its best result;
+    if nothing else holds on to it, it goes away entirely, and its results
+    are loaded back from the database if it is ever created again.
+
+    Subsets that can't be rebuilt from the database (fabricated subsets,
+    those being analysed, and those with per-site statistics or centroids)
+    are held until they can be. The names and descriptions of the subsets we
+    let go of are kept, and given back when they are rebuilt.
+    """
+
+    def __init__(self, budget_mb=DEFAULT_CACHE_MB):
+        self.live = weakref.WeakValueDictionary()
+        self.recent = collections.OrderedDict()
+        self.held = {}
+        # subset_id -> (names, description), see evict
+        self.labels = {}
+        self.used = 0
+        self.set_budget(budget_mb)
+
+    def set_budget(self, budget_mb):
+        if budget_mb is None:
+            budget_mb = DEFAULT_CACHE_MB
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.evict()
+
+    def get(self, subset_id, default=None):
+        return self.live.get(subset_id, default)
+
+    def __contains__(self, subset_id):
+        return subset_id in self.live
+
+    def __len__(self):
+        return len(self.live)
+
+    def add(self, sub):
+        self.live[sub.subset_id] = sub
+        labels = self.labels.pop(sub.subset_id, None)
+        if labels is not None:
+            sub.add_description(*labels)
+        self.touch(sub)
+
+    def touch(self, sub):
+        """Mark a subset as just used"""
+        sid = sub.subset_id
+        self.held.pop(sid, None)
+        if sid in self.recent:
+            self.recent.move_to_end(sid)
+            return
+        size = sub.memory_size()
+        self.recent[sid] = (sub, size)
+        self.used += size
+        if self.used > self.budget:
+            self.evict()
+
+    def evict(self):
+        for sid in list(self.recent):
+            if self.used <= self.budget:
+                break
+            sub, size = self.recent.pop(sid)
+            self.used -= size
+            if sub.can_evict:
+                sub.compact()
+                if sub.names or sub.description:
+                    self.labels[sid] = (sub.names, sub.description)
+            else:
+                # It goes back in when it is next used, or finishes
+                self.held[sid] = sub
+
+    def clear(self):
+        self.live.clear()
+        self.recent.clear()
+        self.held.clear()
+        self.labels.clear()
+        self.used = 0
+
+
 def count_subsets():
     return len(Subset._cache)
 
@@ -42,10 +153,15 @@ def clear_subsets():
     Subset._cache.clear()
 
 
+def set_cache_budget(budget_mb):
+    """How much memory (in MB) to spend on keeping finished subsets around"""
+    Subset._cache.set_budget(budget_mb)
+
+
 class Subset(object):
     """Contains a set of columns in the Alignment
     """
-    _cache = {}
+    _cache = SubsetCache()
 
     def __new__(cls, cfg, column_set, name=None, description=None):
         """Returns the identical subset if the columns are identical.
@@ -53,30 +169,33 @@ class Subset(object):
         This is basically a pythonized factory. See here:
         http://codesnipers.com/?q=python-flyweights
         """
-        columns = list(column_set)
-        columns.sort()
-        subset_id = subset_ops.subset_unique_name(columns)
+        column_set = ColumnSet(column_set)
+        subset_id = subset_ops.subset_unique_name(column_set)
         obj = Subset._cache.get(subset_id, None)
         if not obj:
             obj = object.__new__(cls)
-            Subset._cache[subset_id] = obj
-            obj.init(subset_id, cfg, column_set, columns)
+            obj.init(subset_id, cfg, column_set)
+            Subset._cache.add(obj)
+        else:
+            Subset._cache.touch(obj)
 
         return obj
 
-    def init(self, subset_id, cfg, column_set, columns):
+    def init(self, subset_id, cfg, column_set):
         self.subset_id = subset_id
         self.cfg = cfg
+        # The columns are only held as a bitset. Use `columns` if you need
+        # them as a sorted list.
         self.column_set = column_set
-        self.columns = columns
         self.status = FRESH
         self.names = []
         self.description = []
 
         # We put all results into this array, which is sized to the number of
         # models that we are analysing
-        self.result_array = numpy.zeros(
+        self._result_array = numpy.zeros(
             cfg.model_count, cfg.data_layout.data_type)
+        self.compacted = False
 
         # This points to the current empty array entry that we will fill up
         # next. When we're done it will equal the size of the array (and
@@ -96,10 +215,75 @@ class Subset(object):
         # Site likelihoods calculated using GTR+G from the
         # processor.gen_per_site_stats()
         self.site_lnls_GTRG = []
+        # Whatever kmeans split the subset on, see add_per_site_statistics
+        self.site_lnls = None
 
         self.alignment_path = None
+        self.alignment_digest = None
         log.debug("Created %s" % self)
 
+    @property
+    def result_array(self):
+        if self.compacted:
+            self.reload_results()
+        return self._result_array
+
+    def memory_size(self):
+        """A rough idea of how many bytes we're holding on to"""
+        return (_SUBSET_OVERHEAD + self.column_set.bits.bit_length() // 8 +
+                self._result_array.nbytes)
+
+    @property
+    def can_evict(self):
+        """Could we rebuild this subset from the database?"""
+        if self.fabricated or self.dont_split:
+            return False
+        # The database doesn't have these
+        if self.centroid is not None or self.site_lnls is not None or \
+                self.site_lnls_GTRG:
+            return False
+        if self.status == DONE:
+            return True
+        # Otherwise it is only safe if nothing has happened to it yet
+        return self.status == FRESH and self.result_current == 0
+
+    def compact(self):
+        """Cut a finished subset down to its best result
+
+        The other results are still in the database, and result_array loads
+        them back if anyone asks.
+        """
+        if self.status != DONE or self.compacted:
+            return
+        best = self._result_array[self.result_best:self.result_best + 1]
+        self._result_array = best.copy()
+        self.result_best = 0
+        self.compacted = True
+
+    def reload_results(self):
+        self.compacted = False
+        self._result_array = numpy.zeros(
+            self.cfg.model_count, self.cfg.data_layout.data_type)
+        matching = self.cfg.database.get_results_for_subset(self)
+        wanted = set(self.cfg.models)
+        current = 0
+        for i, mod in enumerate(matching['model_id']):
+            if mod.decode('utf-8') in wanted:
+                self._result_array[current] = matching[i]
+                current += 1
+        self.result_current = current
+        self.result_best = numpy.argmin(
+            self._result_array[self.cfg.model_selection][:current])
+
+    @property
+    def columns(self):
+        return self.column_set.to_list()
+
+    @property
+    def legacy_subset_id(self):
+        """The id that older versions gave this subset"""
+        return subset_ops.legacy_subset_name(self.columns)
+
     def add_description(self, names, description):
         """User created subsets can get some extra info"""
         self.names = names
@@ -146,38 +330,41 @@ class Subset(object):
         matching = cfg.database.get_results_for_subset(self)
         # We might get models that we don't want, so we need to filter them
         for i, mod in enumerate(matching['model_id']):
+            # The database hands back bytes
+            mod = mod.decode('utf-8')
             if mod in self.models_not_done:
                 self.result_array[self.result_current] = matching[i]
                 self.result_current += 1
                 self.models_not_done.remove(mod)
 
+    def load_shared_results(self, cfg):
+        """Pick up anything in the result cache for this alignment"""
+        for mod in list(self.models_not_done):
+            record = cfg.result_cache.get(self.alignment_digest, mod)
+            if record is None:
+                continue
+            record['subset_id'] = self.subset_id
+            self.add_model_record(cfg, mod, record)
+            self.models_not_done.remove(mod)
+
     def add_result(self, cfg, model, result):
         """
         We get the result class from raxml or phyml. We need to transform this
         into a numpy record, and then store it locally, and in the database
         """
-        K = float(cfg.processor.models.get_num_params(model))
-        n = float(len(self.column_set))
-        lnL = float(result.lnl)
-        aic = get_aic(lnL, K)
-        bic = get_bic(lnL, K, n)
-        aicc = get_aicc(lnL, K, n)
-
-        result.subset_id = self.subset_id
-        result.model_id = model
-        result.params = K
-        result.aic = aic
-        result.aicc = aicc
-        result.bic = bic
-
-        # Now assign the data record in the result into the current model
-        # result and save it to the database
-        self.result_array[self.result_current] = result._data
+        record = make_result_record(
+            cfg, self.subset_id, model, result, len(self.column_set))
+        self.add_model_record(cfg, model, record)
+
+    def add_model_record(self, cfg, model, record):
+        """Store a finished numpy record locally, and in the database"""
+        self.result_array[self.result_current] = record
         cfg.database.save_result(self, self.result_current)
         self.result_current += 1
 
         log.debug("Added model to subset. Model: %s, params: %d, sites:%d, lnL:%.2f, site_rate %f"
-                  % (model, K, n, lnL, result.site_rate))
+                  % (model, record['params'], len(self.column_set),
+                     record['lnl'], record['site_rate']))
 
     def model_selection(self, cfg):
         # We want the index of the smallest value
@@ -245,6 +432,8 @@ class Subset(object):
 
         self.models_to_process = []
         self.status = DONE
+        # It can be evicted now, if it was being held
+        Subset._cache.touch(self)
         cfg.progress.subset_done(self)
 
 
@@ -261,20 +450,25 @@ class Subset(object):
             return
 
         # Make an Alignment from the source, using this subset
-        self.make_alignment(cfg, alignment)
+        sub_alignment = SubsetAlignment(alignment, self)
+        self.alignment_digest = sub_alignment.digest()
+
+        # Other analyses might have done some of the work already
+        if cfg.result_cache is not None:
+            self.load_shared_results(cfg)
+            if self.finalise(cfg):
+                return
+
+        self.make_alignment(cfg, alignment, sub_alignment)
         self.models_to_process = list(self.models_not_done)
-        # Now order them by difficulty
+        # Now order them by how long we expect them to take
+        sites = len(self.column_set)
         self.models_to_process.sort(
-            key=cfg.processor.models.get_model_difficulty,
+            key=lambda m: cfg.cost_model.predict(m, sites),
             reverse=True)
 
         self.status = PREPARED
 
-    def parse_results(self, cfg):
-        """Read in the results and parse them"""
-        for m in list(self.models_not_done):
-            self.parse_model_result(cfg, m)
-
     def fabricate_model_result(self, cfg, model):
         self.fabricated = True
         self.dont_split = True
@@ -341,27 +535,44 @@ class Subset(object):
     --force-restart
     """
 
-    def make_alignment(self, cfg, alignment):
-        # Make an Alignment from the source, using this subset
-        sub_alignment = SubsetAlignment(alignment, self)
+    def make_alignment(self, cfg, alignment, sub_alignment=None):
+        # Make an Alignment from the source, using this subset (unless we
+        # have already)
+        if sub_alignment is None:
+            sub_alignment = SubsetAlignment(alignment, self)
+            self.alignment_digest = sub_alignment.digest()
 
         sub_path = os.path.join(cfg.phylofiles_path, self.subset_id + '.phy')
         # Add it into the sub, so we keep it around
         self.alignment_path = sub_path
 
+        # We keep a hash of what we wrote next to the file, so we can check an
+        # existing one without reading it back in
+        digest_path = sub_path + '.digest'
+        digest = self.alignment_digest
+
         # Maybe it is there already?
         if os.path.exists(sub_path):
             log.debug("Found existing alignment file %s" % sub_path)
-            old_align = Alignment()
-            old_align.read(sub_path)
+            old_digest = read_digest(digest_path)
+            if old_digest is None:
+                # Written before we kept hashes, so do it the slow way
+                old_align = Alignment()
+                old_align.read(sub_path)
+                same = old_align.same_as(sub_alignment)
+                if same:
+                    write_digest(digest_path, digest)
+            else:
+                same = (old_digest == digest)
 
             # It had better be the same!
-            if not old_align.same_as(sub_alignment):
+            if not same:
                 log.error(self.FORCE_RESTART_MESSAGE)
                 raise SubsetError
         else:
             # We need to write it
             sub_alignment.write(sub_path)
+            write_digest(digest_path, digest)
 
     @property
     def is_done(self):
@@ -20,7 +20,9 @@ log = logtools.get_logger()
 
 import hashlib
 import pickle
+import numpy
 import subset
+from columns import ColumnSet
 from util import get_aic, get_aicc, get_bic
 from scipy.stats import chi2 
 from util import PartitionFinderError
@@ -47,9 +49,18 @@ def columnset_to_string(colset):
 
 def subset_unique_name(columns):
     """Return a unique string based on the subsets columns (which are unique)"""
+    if not isinstance(columns, ColumnSet):
+        columns = ColumnSet(columns)
+    return columns.digest()
+
+def legacy_subset_name(columns):
+    """The name older versions gave a subset, from a sorted list of columns
+
+    We only need this to find results stored by those versions.
+    """
 
     # Use pickle to give us a string from the object
-    pickled_columns = pickle.dumps(columns, -1)
+    pickled_columns = pickle.dumps(list(columns), -1)
 
     # Now get an md5 hash from this. There is some vanishingly small chance that
     # we'll get the same thing. Google "MD5 Hash Collision"
@@ -58,7 +69,7 @@ def subset_unique_name(columns):
 def merge_fabricated_subsets(subset_list):
     '''Allows the merging of fabricated subsets and the preservation of their
     centroids and lnls'''
-    columns = set()
+    columns = ColumnSet.union_all(sub.column_set for sub in subset_list)
     lnl = 0
     centroid = []
 
@@ -68,7 +79,6 @@ def merge_fabricated_subsets(subset_list):
         centroid.append(0)
 
     for sub in subset_list:
-        columns |= sub.column_set
         lnl += sub.best_lnl
         number = 0
         for observation in centroid:
@@ -91,13 +101,12 @@ def merge_fabricated_subsets(subset_list):
 
 def merge_subsets(subset_list):
     """Take a set of subsets and merge them together"""
-    columns = set()
-
     # We just need the columns
+    columns = ColumnSet.union_all(sub.column_set for sub in subset_list)
+
     names = []
     descriptions = []
     for sub in subset_list:
-        columns |= sub.column_set
         descriptions.extend(sub.description)
         names.extend(sub.names)
 
@@ -110,14 +119,14 @@ def merge_subsets(subset_list):
     return newsub
 
 def subsets_overlap(subset_list):
-    columns = set()
+    columns = ColumnSet()
     overlapping = []
 
     for sub in subset_list:
         # If the intersection is non-empty...
-        ov = list(sub.column_set & columns)
+        ov = sub.column_set & columns
         if ov:
-            overlapping.append(ov)
+            overlapping.append(ov.to_list())
         columns |= sub.column_set
 
     return ov
@@ -125,7 +134,7 @@ def subsets_overlap(subset_list):
 def check_against_alignment(full_subset, alignment, the_config):
     """Check the subset definition against the alignment"""
 
-    alignment_set = set(range(0, alignment.sequence_length))
+    alignment_set = ColumnSet.from_range(0, alignment.sequence_length)
     leftout = alignment_set - full_subset.column_set
     if leftout:
         log.warning(
@@ -151,14 +160,12 @@ def split_subset(a_subset, cluster_list):
     """Takes a subset and splits it according to a cluster list,
      then returns the subsets resulting from the split"""
     # Take each site from the first list and add it to a new
-    subset_list = a_subset.columns
+    subset_list = a_subset.column_set.to_array()
     subset_columns = []
     list_of_subsets = []
     for cluster in cluster_list:
-        list_of_sites = []
-        for site in cluster:
-            list_of_sites.append(subset_list[site - 1])
-        subset_columns.append(set(list_of_sites))
+        sites = numpy.asarray(list(cluster), dtype=numpy.int64) - 1
+        subset_columns.append(ColumnSet(subset_list[sites]))
 
     tracker = 0
     for column_set in subset_columns:
@@ -178,7 +185,7 @@ def subset_list_score(list_of_subsets, the_config, alignment):
     ):
         best_params = [sub.best_params for sub in list_of_subsets]
         best_lnl = [sub.best_lnl for sub in list_of_subsets]
-        subset_sizes = [len(sub.columns) for sub in list_of_subsets]
+        subset_sizes = [len(sub.column_set) for sub in list_of_subsets]
         num_taxa = len(alignment.species)
         return _accel_subset_list_score(
             best_params,
@@ -205,7 +212,7 @@ def subset_list_stats(list_of_subsets, the_config, alignment):
     if _accel_backend is not None and _accel_subset_list_stats is not None and _accel_backend() == "rust":
         best_params = [sub.best_params for sub in list_of_subsets]
         best_lnl = [sub.best_lnl for sub in list_of_subsets]
-        subset_sizes = [len(sub.columns) for sub in list_of_subsets]
+        subset_sizes = [len(sub.column_set) for sub in list_of_subsets]
         num_taxa = len(alignment.species)
         lnL, sum_k, subs_len = _accel_subset_list_stats(
             best_params,
@@ -222,7 +229,7 @@ def subset_list_stats(list_of_subsets, the_config, alignment):
     for sub in list_of_subsets:
         sum_subset_k += sub.best_params
         lnL += sub.best_lnl
-        subs_len += len(sub.columns)
+        subs_len += len(sub.column_set)
 
     # Grab the number of species so we know how many params there are
     num_taxa = len(alignment.species)
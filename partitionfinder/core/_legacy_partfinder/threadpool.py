@@ -14,15 +14,10 @@
 # PyParsing library, all of which are protected by their own licenses and
 # conditions, using PartitionFinder implies that you agree with those licences
 # and conditions as well.
-#
-# This code modified and vastly simplified from here
-# http://code.activestate.com/recipes/203871/
 
 import logtools
 log = logtools.get_logger()
 
-import threading
-from time import sleep
 import multiprocessing
 
 _cpus = None
@@ -40,87 +35,3 @@ def get_cpu_count():
     log.info("Using %s cpus", _cpus)
 
     return _cpus
-
-
-class Pool(object):
-    def __init__(self, tasks, numthreads=-1):
-        """Initialize the thread pool with numthreads workers and all tasks"""
-        self.more_tasks = True
-        self.tasks = tasks
-        self.task_lock = threading.Condition(threading.Lock())
-        self.threads = []
-        self.failed = False
-
-        numtasks = len(tasks)
-        if numtasks == 0:
-            log.warning("You did not give any tasks to do...")
-            self.more_tasks = False
-            return
-
-        if numthreads <= 1:
-            numthreads = get_cpu_count()
-        if numtasks < numthreads:
-            numthreads = numtasks
-
-        self.numtasks = numtasks
-        self.curtask = 0
-
-        log.debug("Creating %s threads for %s tasks", numthreads, numtasks)
-        for i in range(numthreads):
-            t = Thread(self)
-            self.threads.append(t)
-            t.start()
-
-    def next_task(self):
-        self.task_lock.acquire()
-        try:
-            if self.curtask == self.numtasks:
-                self.more_tasks = False
-                return None, None
-            else:
-                task = self.tasks[self.curtask]
-                self.curtask += 1 
-                return task
-        finally:
-            self.task_lock.release()
-
-    def kill(self, e):
-        self.task_lock.acquire()
-        self.tasks = []
-        self.more_tasks = False
-        self.failed = True
-        self.exception = e
-        self.task_lock.release()
-
-    def join(self):
-        # TODO: I don't think we need this bit....
-        # Wait till all tasks have been taken
-        while self.more_tasks:
-            sleep(.001)
-        # ... now wait for them all to finish
-        for t in self.threads:
-            t.join()
-
-        if self.failed:
-            raise self.exception
-
-
-class Thread(threading.Thread):
-    def __init__(self, pool):
-        threading.Thread.__init__(self)
-        self.pool = pool
-
-    def run(self):
-        while 1:
-            cmd, args = self.pool.next_task()
-            # If there's nothing to do, return
-            if cmd is None:
-                break
-            try:
-                cmd(*args)
-            except Exception as e:
-                # The error should already have been reported.
-                # Stop operation and kill the entire pool. Then reraise the
-                # error
-                self.pool.kill(e)
-                break
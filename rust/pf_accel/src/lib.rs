@@ -79,10 +79,127 @@ fn subset_list_score(
     }
 }
 
+/// Set partitions of site patterns, with each part stored as a taxon bitset.
+struct SetPartitions {
+    words: usize,
+    ntaxa: usize,
+    /// The bits of every part, `words` u64s each.
+    bits: Vec<u64>,
+    /// The first taxon in each part.
+    first_taxon: Vec<usize>,
+    /// The parts of pattern p are `offsets[p]..offsets[p + 1]`.
+    offsets: Vec<usize>,
+    /// The part that each taxon is in, for each pattern (u32::MAX if missing).
+    taxon_part: Vec<u32>,
+}
+
+impl SetPartitions {
+    fn new(labels: &[i32], npatterns: usize, ntaxa: usize) -> SetPartitions {
+        let words = (ntaxa + 63) / 64;
+        let mut parts = SetPartitions {
+            words,
+            ntaxa,
+            bits: Vec::new(),
+            first_taxon: Vec::new(),
+            offsets: vec![0],
+            taxon_part: vec![u32::MAX; npatterns * ntaxa],
+        };
+        let mut seen: Vec<(i32, usize)> = Vec::new();
+        for p in 0..npatterns {
+            seen.clear();
+            for t in 0..ntaxa {
+                let label = labels[p * ntaxa + t];
+                if label < 0 {
+                    continue;
+                }
+                let part = match seen.iter().find(|(l, _)| *l == label) {
+                    Some((_, part)) => *part,
+                    None => {
+                        let part = parts.first_taxon.len();
+                        parts.first_taxon.push(t);
+                        parts.bits.extend(std::iter::repeat(0).take(words));
+                        seen.push((label, part));
+                        part
+                    }
+                };
+                parts.bits[part * words + t / 64] |= 1u64 << (t % 64);
+                parts.taxon_part[p * ntaxa + t] = part as u32;
+            }
+            parts.offsets.push(parts.first_taxon.len());
+        }
+        parts
+    }
+
+    fn part_bits(&self, part: usize) -> &[u64] {
+        &self.bits[part * self.words..(part + 1) * self.words]
+    }
+
+    /// The fraction of q's parts that are inside one of p's parts.
+    fn agreement(&self, p: usize, q: usize) -> f64 {
+        let (start, stop) = (self.offsets[q], self.offsets[q + 1]);
+        let mut count = 0usize;
+        for part in start..stop {
+            // Only the part of p that holds this part's first taxon can hold
+            // all of it
+            let holder = self.taxon_part[p * self.ntaxa + self.first_taxon[part]];
+            if holder == u32::MAX {
+                continue;
+            }
+            let inside = self
+                .part_bits(part)
+                .iter()
+                .zip(self.part_bits(holder as usize))
+                .all(|(a, b)| a & !b == 0);
+            if inside {
+                count += 1;
+            }
+        }
+        count as f64 / (stop - start) as f64
+    }
+}
+
+fn tiger_agreement_kernel(labels: &[i32], npatterns: usize, ntaxa: usize, threads: usize) -> Vec<f64> {
+    let parts = SetPartitions::new(labels, npatterns, ntaxa);
+    let mut out = vec![0.0f64; npatterns * npatterns];
+    if npatterns == 0 {
+        return out;
+    }
+    let rows_per_thread = (npatterns + threads.max(1) - 1) / threads.max(1);
+    std::thread::scope(|scope| {
+        for (block, chunk) in out.chunks_mut(rows_per_thread * npatterns).enumerate() {
+            let parts = &parts;
+            scope.spawn(move || {
+                for (i, row) in chunk.chunks_mut(npatterns).enumerate() {
+                    let p = block * rows_per_thread + i;
+                    for (q, value) in row.iter_mut().enumerate() {
+                        *value = parts.agreement(p, q);
+                    }
+                }
+            });
+        }
+    });
+    out
+}
+
+/// TIGER partition agreement between every pair of site patterns.
+///
+/// Returns the (npatterns x npatterns) matrix, flattened by row. Must match
+/// `partitionfinder.accel._api.tiger_agreement` exactly.
+#[pyfunction]
+fn tiger_agreement(labels: Vec<i32>, npatterns: usize, ntaxa: usize, threads: usize) -> PyResult<Vec<f64>> {
+    if labels.len() != npatterns * ntaxa {
+        return Err(pyo3::exceptions::PyValueError::new_err(
+            "labels must have npatterns * ntaxa entries",
+        ));
+    }
+    Ok(tiger_agreement_kernel(&labels, npatterns, ntaxa, threads))
+}
+
 #[pymodule]
 fn _pf_accel(_py: Python<'_>, m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(add_i64, m)?)?;
     m.add_function(wrap_pyfunction!(subset_list_stats, m)?)?;
     m.add_function(wrap_pyfunction!(subset_list_score, m)?)?;
+    m.add_function(wrap_pyfunction!(tiger_agreement, m)?)?;
     Ok(())
 }
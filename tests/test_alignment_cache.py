@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+def test_cache_round_trip_is_memory_mapped(tmp_path: Path):
+    alignment = _module("alignment")
+    aln = alignment.Alignment()
+    aln.parse("2 4\nspA ACGT\nspB acga\n")
+    index = aln.save_cache(str(tmp_path), "abc")
+    assert alignment.read_cache_index(str(tmp_path)) == index
+
+    again = alignment.Alignment()
+    assert again.load_cache(str(tmp_path), index)
+    assert isinstance(again.data, np.memmap)
+    assert again.species == ["spA", "spB"]
+    assert again.digest() == aln.digest()
+
+    # A cache that doesn't match its index is ignored
+    np.save(tmp_path / alignment.CACHE_DATA, np.zeros((2, 4), "u1"))
+    other = alignment.Alignment()
+    assert not other.load_cache(str(tmp_path), index)
+    assert other.data is None
+
+
+def _make_alignment(analysis, monkeypatch, source: Path, folder: Path):
+    monkeypatch.setattr(analysis, "the_config", SimpleNamespace(start_tree_path=str(folder)))
+    a = SimpleNamespace()
+    analysis.Analysis.make_alignment(a, str(source))
+    return a.alignment
+
+
+def test_restart_uses_the_cache_and_checks_the_contents(tmp_path: Path, monkeypatch):
+    analysis = _module("analysis")
+    folder = tmp_path / "start_tree"
+    folder.mkdir()
+    source = tmp_path / "a.phy"
+    source.write_text("2 4\nspA ACGT\nspB ACGA\n")
+
+    first = _make_alignment(analysis, monkeypatch, source, folder)
+    assert not isinstance(first.data, np.memmap)
+    assert (folder / "source.phy").exists()
+
+    again = _make_alignment(analysis, monkeypatch, source, folder)
+    assert isinstance(again.data, np.memmap)
+    assert again.digest() == first.digest()
+
+    # Reformatting the file is fine, changing what is in it is not
+    source.write_text("2   4\n\nspA   ACGT\nspB   ACGA\n")
+    assert _make_alignment(analysis, monkeypatch, source, folder).digest() == first.digest()
+    source.write_text("2 4\nspA ACGT\nspB ACGG\n")
+    with pytest.raises(analysis.AnalysisError):
+        _make_alignment(analysis, monkeypatch, source, folder)
+
+
+def test_copies_of_the_same_input_share_a_cache(tmp_path: Path, monkeypatch):
+    analysis = _module("analysis")
+    alignment = _module("alignment")
+    monkeypatch.setenv(alignment.SHARED_CACHE_VARIABLE, str(tmp_path / "shared"))
+    text = "2 4\nspA ACGT\nspB ACGA\n"
+
+    # Like two API jobs, each with its own copy of the input folder
+    jobs = []
+    for name in ("job1", "job2"):
+        (tmp_path / name / "start_tree").mkdir(parents=True)
+        (tmp_path / name / "a.phy").write_text(text)
+        jobs.append(tmp_path / name)
+
+    first = _make_alignment(analysis, monkeypatch, jobs[0] / "a.phy", jobs[0] / "start_tree")
+    assert not isinstance(first.data, np.memmap)
+
+    def no_parsing(self, pth):
+        raise AssertionError("parsed %s again" % pth)
+
+    monkeypatch.setattr(alignment.Alignment, "read", no_parsing)
+    second = _make_alignment(analysis, monkeypatch, jobs[1] / "a.phy", jobs[1] / "start_tree")
+    assert isinstance(second.data, np.memmap)
+    assert second.digest() == first.digest()
+    # It still gets its own copy, for its restarts
+    assert (jobs[1] / "start_tree" / "source.phy").exists()
+    assert alignment.read_cache_index(str(jobs[1] / "start_tree")) is not None
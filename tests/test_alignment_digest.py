@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _alignment(text: str):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    alignment = import_legacy_module("alignment")
+    aln = alignment.Alignment()
+    aln.parse(text)
+    return aln
+
+
+def test_digest_matches_a_written_and_reread_alignment(tmp_path: Path):
+    aln = _alignment("2 4\nspA ACGT\nspB ACGA\n")
+    pth = tmp_path / "a.phy"
+    aln.write(str(pth))
+
+    again = _alignment(pth.read_text())
+    assert again.digest() == aln.digest()
+
+
+def test_digest_changes_with_the_data():
+    a = _alignment("2 4\nspA ACGT\nspB ACGA\n")
+    b = _alignment("2 4\nspA ACGT\nspB ACGT\n")
+    c = _alignment("2 4\nspA ACGT\nspC ACGA\n")
+    assert len({a.digest(), b.digest(), c.digest()}) == 3
+
+
+def test_interleaved_and_lower_case_bases_parse_like_sequential():
+    seq = _alignment("2 6\nspA ACGTAC\nspB ttgaCC\n")
+    inter = _alignment("2 6\nspA acg\nspB TTG\n\nTAC\nA CC\n")
+    assert inter.species == ["spA", "spB"]
+    assert inter.data.tobytes() == b"ACGTACTTGACC"
+    assert inter.digest() == seq.digest()
+
+
+def test_parser_rejects_bad_alignments():
+    import io
+
+    import pytest
+    from partitionfinder.core import AlignmentError, make_alignment_parser
+
+    for text in ["", "2 x\n", "2 3\nspA ACGT\nspB ACGT\n", "2 4\nspA ACGT\nspB ACG\n"]:
+        with pytest.raises(AlignmentError):
+            _alignment(text)
+
+    parser = make_alignment_parser(io.StringIO("1 4\nspA AC!T\n"), datatype="DNA")
+    with pytest.raises(AlignmentError):
+        parser.parse()
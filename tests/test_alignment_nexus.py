@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module():
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module("alignment")
+
+
+def _alignment(text: str):
+    aln = _module().Alignment()
+    aln.parse(text)
+    return aln
+
+
+SEQUENTIAL = """#NEXUS
+BEGIN DATA;
+  DIMENSIONS NTAX=3 NCHAR=8;
+  FORMAT DATATYPE=DNA MISSING=? GAP=-;
+MATRIX
+  spA  ACGT ACGT
+  'sp B'  acgtacg-  [a comment]
+  spC  ACG? [a comment
+  that runs on] TTTT
+;
+END;
+"""
+
+INTERLEAVED = """#NEXUS
+begin characters;
+  dimensions ntax=3 nchar=8;
+  format interleave;
+matrix
+  spA  ACGT
+  'sp B'  acgt
+  spC  ACG?
+
+  spA  ACGT
+  'sp B'  acg-
+  spC  TTTT;
+end;
+"""
+
+
+def test_sequential_and_interleaved_nexus_give_the_same_alignment():
+    seq = _alignment(SEQUENTIAL)
+    inter = _alignment(INTERLEAVED)
+    assert seq.species == ["spA", "sp B", "spC"]
+    assert seq.data.tobytes() == b"ACGTACGTACGTACG-ACG?TTTT"
+    assert inter.digest() == seq.digest()
+
+
+def test_nexus_without_dimensions():
+    aln = _alignment("#NEXUS\nbegin data;\nmatrix\nspA ACGT\nAC\nspB ACGTTT\n;\nend;\n")
+    assert (aln.species_count, aln.sequence_length) == (2, 6)
+    assert aln.data.tobytes() == b"ACGTACACGTTT"
+
+
+def test_nexus_file_is_read_without_a_temporary_file(tmp_path: Path):
+    pth = tmp_path / "a.nex"
+    pth.write_text(INTERLEAVED)
+    aln = _module().Alignment()
+    aln.read(str(pth))
+    assert aln.digest() == _alignment(SEQUENTIAL).digest()
+    assert [p.name for p in tmp_path.iterdir()] == ["a.nex"]
+
+
+@pytest.mark.parametrize("text", [
+    "#NEXUS\nbegin data;\nend;\n",
+    "#NEXUS\nbegin data;\nmatrix\nspA ACGT\n",
+    "#NEXUS\nbegin data; dimensions ntax=1 nchar=4;\nmatrix\nspA ACGT\nspB ACGT\n;\n",
+    "#NEXUS\nbegin data; dimensions ntax=2 nchar=4;\nmatrix\nspA ACGT\nspB ACG\n;\n",
+    "#NEXUS\nbegin data; dimensions ntax=1 nchar=4;\nmatrix\nspA ACGTA\n;\n",
+])
+def test_bad_nexus_files_are_rejected(text):
+    with pytest.raises(_module().AlignmentError):
+        _alignment(text)
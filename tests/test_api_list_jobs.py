@@ -48,3 +48,12 @@ def test_list_jobs_orders_by_updated_at(tmp_path: Path):
     assert items[0].id == "new"
     assert items[0].datatype == "protein"
     assert items[0].input_folder == "C:/in/new"
+
+
+def test_shared_caches_are_not_jobs(tmp_path: Path):
+    from partitionfinder.api import service as svc
+
+    store = svc.JobStore(tmp_path / "jobs")
+    store.shared_cache_dir().mkdir()
+    (store.root / "abc").mkdir()
+    assert store.list_job_ids() == ["abc"]
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+class _Subset:
+    def __init__(self, names):
+        self.names = names
+        self.name = "_".join(names)
+
+
+def _merge(pair):
+    return _Subset(pair[0].names + pair[1].names)
+
+
+class _OldCMatrix:
+    """What the searches used to do: a square array in the order of the
+    subset list, with rows deleted and added on each merge"""
+
+    def __init__(self, subsets):
+        self.subsets = list(subsets)
+        self.m = np.full((len(subsets), len(subsets)), np.inf)
+        np.fill_diagonal(self.m, 0)
+
+    def update(self, sub_tuples, diffs):
+        for (_, (a, b)), diff in zip(sub_tuples, diffs):
+            i, j = self.subsets.index(a), self.subsets.index(b)
+            self.m[i, j] = self.m[j, i] = diff
+
+    def best_change(self):
+        return np.amin(self.m)
+
+    def median_improvement(self):
+        return np.median(self.m[self.m < 0])
+
+    def best_pair(self, best_change):
+        l = np.where(self.m == best_change)
+        return self.subsets[l[0][0]], self.subsets[l[1][0]]
+
+    def merge(self, remove_list, add_list):
+        indices = [self.subsets.index(r) for r in remove_list]
+        self.m = np.delete(np.delete(self.m, indices, 1), indices, 0)
+        for a in add_list:
+            n = self.m.shape[0]
+            self.m = np.vstack((self.m, np.full(n, np.inf)))
+            self.m = np.hstack((self.m, np.append(np.full(n, np.inf), 0)[:, None]))
+        for r in remove_list:
+            self.subsets.remove(r)
+        self.subsets.extend(add_list)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_same_merges_as_the_old_matrix(sparse):
+    neighbour = _module("neighbour")
+    rng = np.random.default_rng(5)
+    subsets = [_Subset(["b%d" % i]) for i in range(30)]
+    new = neighbour.CMatrix(subsets, sparse=sparse)
+    old = _OldCMatrix(subsets)
+
+    while len(new) > 1:
+        assert new.subsets == old.subsets
+        current = new.subsets
+        # Analyse some of the pairs, with lots of ties
+        pairs = [(current[i], current[j]) for i in range(len(current)) for j in range(i + 1, len(current))]
+        todo = [pairs[k] for k in rng.choice(len(pairs), size=min(len(pairs), 40), replace=False)]
+        todo = new.pairs_todo(todo)
+        diffs = list(rng.integers(-5, 3, size=len(todo)).astype(float))
+        sub_tuples = [(_merge(p), p) for p in todo]
+        new.update(sub_tuples, diffs)
+        old.update(sub_tuples, diffs)
+
+        best_change = new.best_change()
+        assert best_change == old.best_change()
+        if best_change >= 0:
+            break
+        assert new.median_improvement() == old.median_improvement()
+
+        # Merge a couple of pairs each step, as rclusterf does
+        for _ in range(2):
+            best_pair = new.best_pair(best_change)
+            assert best_pair == old.best_pair(best_change)
+            merged = _merge(best_pair)
+            new.merge(list(best_pair), [merged])
+            old.merge(list(best_pair), [merged])
+            best_change = new.best_change()
+            assert best_change == old.best_change()
+            if best_change >= 0:
+                break
+
+
+def test_slots_are_reused():
+    neighbour = _module("neighbour")
+    subsets = [_Subset(["b%d" % i]) for i in range(4)]
+    c = neighbour.CMatrix(subsets)
+    c.set(subsets[0], subsets[1], -2.0)
+    c.set(subsets[2], subsets[3], -1.0)
+    merged = _merge(subsets[:2])
+
+    c.merge(subsets[:2], [merged])
+    assert c.subsets == [subsets[2], subsets[3], merged]
+    assert c.changes.shape == (4, 4)
+    assert c.get(merged, subsets[2]) == np.inf
+    assert c.best_pair(c.best_change()) == (subsets[2], subsets[3])
+
+
+def test_merging_needs_the_same_blocks():
+    neighbour = _module("neighbour")
+    util = _module("util")
+    subsets = [_Subset(["b%d" % i]) for i in range(3)]
+    c = neighbour.CMatrix(subsets)
+    with pytest.raises(util.PartitionFinderError):
+        c.merge(subsets[:2], [_Subset(["b0", "b2"])])
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+def test_column_set_behaves_like_a_set():
+    ColumnSet = _module("columns").ColumnSet
+    a = ColumnSet([5, 0, 3, 200])
+    b = ColumnSet(range(3, 10))
+
+    assert len(a) == 4
+    assert list(a) == [0, 3, 5, 200]
+    assert 200 in a and 199 not in a and -1 not in a
+    assert set(a | b) == {0, 3, 5, 200} | set(range(3, 10))
+    assert set(a & b) == {3, 5}
+    assert set(a - b) == {0, 200}
+    assert not a.isdisjoint(b)
+    assert ColumnSet([1, 2]).isdisjoint(ColumnSet([3]))
+    assert a == {0, 3, 5, 200} and {0, 3, 5, 200} == a
+    assert (a.min(), a.max()) == (0, 200)
+    assert ColumnSet.from_range(3, 10) == b
+    assert not ColumnSet()
+
+
+def test_digest_depends_only_on_the_columns():
+    ColumnSet = _module("columns").ColumnSet
+    a = ColumnSet([1, 2, 3])
+    assert a.digest() == ColumnSet({3, 2, 1}).digest()
+    assert a.digest() == ColumnSet.union_all([ColumnSet([1]), ColumnSet([2, 3])]).digest()
+    assert a.digest() != ColumnSet([1, 2]).digest()
+    assert len(a.digest()) == 32
+
+
+def test_results_under_old_subset_ids_are_migrated(tmp_path: Path):
+    database = _module("database")
+    subset = _module("subset")
+    subset_ops = _module("subset_ops")
+
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout,
+                          model_count=1, models=["GTR"])
+    columns = list(range(0, 30, 3))
+    legacy_id = subset_ops.legacy_subset_name(columns)
+
+    # A database written by an older version
+    db = database.HDF5Database(cfg)
+    record = layout.get_empty_record()
+    record["subset_id"] = legacy_id
+    record["model_id"] = "GTR"
+    db.results.append(record)
+    del db.results.attrs.subset_ids
+    db.close()
+
+    subset.clear_subsets()
+    sub = subset.Subset(cfg, set(columns))
+    assert sub.subset_id != legacy_id
+    assert sub.legacy_subset_id == legacy_id
+
+    db = database.HDF5Database(cfg)
+    assert db.legacy_ids
+    matching = db.get_results_for_subset(sub)
+    assert [m.decode() for m in matching["model_id"]] == ["GTR"]
+    assert len(db.results.read_where("subset_id == %r" % sub.subset_id.encode())) == 1
+    db.close()
+
+    # A new database never needs to look for the old ids
+    cfg.subsets_path = str(tmp_path / "new")
+    Path(cfg.subsets_path).mkdir()
+    db = database.HDF5Database(cfg)
+    assert not db.legacy_ids
+    db.close()
+    subset.clear_subsets()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _cost_model():
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    costmodel = import_legacy_module("costmodel")
+    difficulty = {"JC": 0, "GTR+G": 2000, "LG+G+F": 5000}
+    models = SimpleNamespace(get_model_difficulty=difficulty.__getitem__)
+    cfg = SimpleNamespace(models=list(difficulty), processor=SimpleNamespace(models=models))
+    return costmodel.CostModel(cfg)
+
+
+def test_uncalibrated_model_keeps_the_difficulty_ordering():
+    cm = _cost_model()
+    assert cm.eta() is None
+    ranked = sorted(["JC", "LG+G+F", "GTR+G"], key=lambda m: cm.predict(m, 100), reverse=True)
+    assert ranked == ["LG+G+F", "GTR+G", "JC"]
+    assert cm.predict("JC", 200) > cm.predict("JC", 100)
+
+
+def test_fit_recovers_runtimes_from_observations():
+    cm = _cost_model()
+    for sites in (100, 200, 400, 800):
+        cm.observe("JC", sites, 0.01 * sites ** 1.5)
+        cm.observe("GTR+G", sites, 0.002 * sites ** 1.5)
+
+    assert cm.predict("JC", 1600) == pytest.approx(0.01 * 1600 ** 1.5)
+    assert cm.power == pytest.approx(1.5)
+    # JC is now known to be the slow one, whatever the difficulty guess says
+    assert cm.predict("JC", 100) > cm.predict("GTR+G", 100)
+    # Models we have never seen are still placed by their difficulty
+    assert cm.predict("LG+G+F", 100) > cm.predict("JC", 100)
+
+
+def test_eta_is_corrected_by_what_we_have_seen():
+    cm = _cost_model()
+    subs = [
+        SimpleNamespace(subset_id="a", column_set=range(100), models_not_done={"JC", "GTR+G"}, is_done=False),
+        SimpleNamespace(subset_id="b", column_set=range(100), models_not_done={"JC", "GTR+G"}, is_done=False),
+    ]
+    cm.begin(subs, 2)
+    planned = dict(cm.planned)
+    cm.task_done(subs[0], "JC", 10.0)
+
+    left = sum(planned.values()) - planned[("a", "JC")]
+    assert cm.eta() == pytest.approx(left * (10.0 / planned[("a", "JC")]) / 2)
+
+
+def test_stored_runtimes_are_fitted_once_we_know_their_sites(tmp_path: Path):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    layout = database.DataLayout()
+    db = database.HDF5Database(SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout))
+    sizes = {"%032x" % i: sites for i, sites in enumerate((1000, 2000, 4000, 8000))}
+    records = layout.get_empty_record().repeat(2 * len(sizes))
+    for n, (sid, sites) in enumerate(sizes.items()):
+        records[2 * n]["subset_id"] = records[2 * n + 1]["subset_id"] = sid
+        records[2 * n]["model_id"], records[2 * n]["seconds"] = "JC", round(0.01 * sites ** 1.5)
+        records[2 * n + 1]["model_id"], records[2 * n + 1]["seconds"] = "GTR+G", round(0.03 * sites ** 1.5)
+    db.add_records(records)
+
+    cm = _cost_model()
+    cm.load(db)
+    db.close()
+    # Before the analysis makes the subsets, we only know the typical runtime
+    cm.fit()
+    assert cm.samples == {}
+    assert cm.power == 1.0
+
+    subs = [SimpleNamespace(subset_id=sid, column_set=range(sites), models_not_done=set(), is_done=True)
+            for sid, sites in sizes.items()]
+    cm.begin(subs, 1)
+    assert cm.unsized == {} and cm.stored == {}
+    assert cm.predict("JC", 16000) == pytest.approx(0.01 * 16000 ** 1.5, rel=1e-2)
+    assert cm.power == pytest.approx(1.5, rel=1e-2)
+    assert cm.scale["GTR+G"] / cm.scale["JC"] == pytest.approx(3.0, rel=1e-2)
+
+
+def test_multi_thread_runtimes_do_not_shift_the_fit():
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    costmodel = import_legacy_module("costmodel")
+    cm = _cost_model()
+    for sites in (100, 200, 400, 800):
+        cm.observe("JC", sites, 0.01 * sites ** 1.5)
+    cm.fit()
+    power, scale = cm.power, cm.scale["JC"]
+
+    # The biggest subsets are the ones that get several threads, and they
+    # finish sooner than they would on one
+    big = SimpleNamespace(subset_id="big", column_set=range(3200))
+    speedup = 1 + 3 * costmodel.THREAD_EFFICIENCY
+    cm.task_done(big, "JC", 0.01 * 3200 ** 1.5 / speedup, cpus=4)
+    cm.fit()
+    assert cm.power == pytest.approx(power)
+    assert cm.scale["JC"] == pytest.approx(scale)
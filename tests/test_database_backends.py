@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import multiprocessing
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _database():
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module("database")
+
+
+def _subset(layout, sid, models):
+    arr = layout.get_empty_record().repeat(len(models))
+    arr["subset_id"] = sid
+    arr["model_id"] = models
+    arr["lnl"] = range(len(models))
+    return SimpleNamespace(subset_id=sid, result_array=arr)
+
+
+def _write_results(path, first):
+    database = _database()
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=path, data_layout=layout)
+    db = database.SQLiteDatabase(cfg)
+    for i in range(first, first + 20):
+        sub = _subset(layout, "%032x" % i, ["JC", "GTR"])
+        db.save_result(sub, 0)
+        db.save_result(sub, 1)
+    db.close()
+
+
+def test_sqlite_takes_writers_from_many_processes(tmp_path: Path):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_write_results, args=(str(tmp_path), i * 20)) for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    database = _database()
+    layout = database.DataLayout()
+    db = database.SQLiteDatabase(SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout))
+    assert len(db.read_all()) == 160
+    found = db.get_results_for_subset(SimpleNamespace(subset_id="%032x" % 75))
+    assert found.dtype == layout.data_type
+    assert sorted(found["model_id"]) == [b"GTR", b"JC"]
+    db.close()
+
+
+@pytest.mark.parametrize("source,dest", [("hdf5", "sqlite"), ("sqlite", "hdf5")])
+def test_existing_results_are_converted(tmp_path: Path, source, dest):
+    database = _database()
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout,
+                          database_backend=source)
+    db = database.make_database(cfg)
+    sub = _subset(layout, "%032x" % 1, ["JC", "GTR", "HKY"])
+    for n in range(3):
+        db.save_result(sub, n)
+    db.close()
+
+    cfg.database_backend = dest
+    db = database.make_database(cfg)
+    assert db.name == dest
+    found = db.get_results_for_subset(sub)
+    found.sort(order="model_id")
+    expected = sub.result_array.copy()
+    expected.sort(order="model_id")
+    assert found.tobytes() == expected.tobytes()
+    db.close()
+
+
+def test_old_subset_ids_survive_conversion(tmp_path: Path):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = _database()
+    subset = import_legacy_module("subset")
+    subset_ops = import_legacy_module("subset_ops")
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout,
+                          model_count=1, models=["GTR"])
+    columns = list(range(0, 30, 3))
+
+    # An old HDF5 database
+    db = database.HDF5Database(cfg)
+    db.add_records(_subset(layout, subset_ops.legacy_subset_name(columns), ["GTR"]).result_array)
+    del db.results.attrs.subset_ids
+    db.close()
+
+    database.convert(str(tmp_path / "data.db"), str(tmp_path / "data.sqlite"))
+    db = database.SQLiteDatabase(cfg)
+    assert db.legacy_ids
+    subset.clear_subsets()
+    sub = subset.Subset(cfg, columns)
+    assert [m.decode() for m in db.get_results_for_subset(sub)["model_id"]] == ["GTR"]
+    # Now it is under the new id
+    assert len(db.select(sub.subset_id)) == 1
+    db.close()
+    subset.clear_subsets()
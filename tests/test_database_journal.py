@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture
+def env(tmp_path: Path):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout)
+    return database, cfg
+
+
+def _subset(layout, sid, models):
+    arr = layout.get_empty_record().repeat(len(models))
+    arr["subset_id"] = sid
+    arr["model_id"] = models
+    return SimpleNamespace(subset_id=sid, result_array=arr)
+
+
+def test_results_are_batched_but_still_found(env):
+    database, cfg = env
+    db = database.HDF5Database(cfg)
+    sub = _subset(cfg.data_layout, "abc", ["JC", "GTR"])
+    db.save_result(sub, 0)
+    db.save_result(sub, 1)
+
+    # Nothing has gone to the table yet, but we can still see them
+    assert db.results.nrows == 0
+    assert not db.is_empty()
+    assert sorted(db.get_results_for_subset(sub)["model_id"]) == [b"GTR", b"JC"]
+
+    db.flush()
+    assert db.results.nrows == 2
+    assert Path(db.journal_path).stat().st_size == 0
+    db.close()
+    assert not Path(db.journal_path).exists()
+
+
+def test_a_crash_loses_nothing(env):
+    database, cfg = env
+    db = database.HDF5Database(cfg)
+    sub = _subset(cfg.data_layout, "abc", ["JC", "GTR", "HKY"])
+    db.save_result(sub, 0)
+    db.flush()
+    db.save_result(sub, 1)
+    db.save_result(sub, 2)
+    journal = Path(db.journal_path).read_bytes()
+    # Crash after the table was written, but before the journal was cleared,
+    # and with half a record on the end
+    db.flush()
+    db.journal.close()
+    db.h5.close()
+    Path(db.journal_path).write_bytes(journal + journal[:10])
+
+    db = database.HDF5Database(cfg)
+    assert db.results.nrows == 3
+    assert sorted(db.get_results_for_subset(sub)["model_id"]) == [b"GTR", b"HKY", b"JC"]
+    db.close()
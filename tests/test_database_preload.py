@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _subset(layout, sid, models):
+    arr = layout.get_empty_record().repeat(len(models))
+    arr["subset_id"] = sid
+    arr["model_id"] = models
+    arr["lnl"] = range(len(models))
+    return SimpleNamespace(subset_id=sid, result_array=arr)
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_preloaded_index_finds_every_result(tmp_path: Path, monkeypatch, in_memory):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    if not in_memory:
+        monkeypatch.setattr(database, "PRELOAD_MAX_BYTES", 0)
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout)
+
+    models = ["JC", "GTR", "HKY"]
+    subs = [_subset(layout, "%032x" % i, models) for i in range(20)]
+    db = database.HDF5Database(cfg)
+    # Interleave them, as the results come back in any order
+    for n in range(len(models)):
+        for sub in subs[:10]:
+            db.save_result(sub, n)
+    db.close()
+
+    db = database.HDF5Database(cfg)
+    found = db.get_results_for_subset(subs[3])
+    assert (db.preloaded is not None) == in_memory
+    assert sorted(found["model_id"]) == [b"GTR", b"HKY", b"JC"]
+    assert list(found["lnl"][found["model_id"].argsort()]) == [1, 2, 0]
+    assert len(db.get_results_for_subset(subs[15])) == 0
+
+    # Results written after the preload are found too
+    db.save_result(subs[15], 0)
+    db.flush()
+    db.save_result(subs[15], 1)
+    assert sorted(db.get_results_for_subset(subs[15])["model_id"]) == [b"GTR", b"JC"]
+    db.close()
+
+
+def test_results_written_after_the_preload_are_not_held_in_memory(tmp_path: Path):
+    import tracemalloc
+
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout)
+    db = database.HDF5Database(cfg)
+    batch = database.BATCH_ROWS
+    # The first lookup preloads the (empty) table
+    assert len(db.get_results_for_subset(_subset(layout, "%032x" % 0, ["JC"]))) == 0
+
+    def write(flushes, first):
+        for f in range(first, first + flushes):
+            sub = _subset(layout, "", ["JC"] * batch)
+            sub.result_array["subset_id"] = ["%032x" % (f * batch + i) for i in range(batch)]
+            for n in range(batch):
+                db.save_result(sub, n)
+
+    tracemalloc.start()
+    try:
+        write(5, 0)
+        before = tracemalloc.get_traced_memory()[0]
+        write(40, 5)
+        grown = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    assert db.results.nrows == 45 * batch
+    # Far less than the rows we wrote
+    assert grown < 40 * batch * db.dtype.itemsize / 10
+    # But we can still find them
+    found = db.get_results_for_subset(SimpleNamespace(subset_id="%032x" % (30 * batch + 7)))
+    assert list(found["model_id"]) == [b"JC"]
+    db.close()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import multiprocessing
+import sys
+from pathlib import Path
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+class _Context:
+    def install(self):
+        pass
+
+
+class _Task:
+    def __init__(self, i):
+        self.subset_id = "s%d" % (i // 3)
+        self.model = "m%d" % i
+        self.cpus = 1
+
+
+def _executors():
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module("executors")
+
+
+# The fake tasks below only reach the worker processes if they are forked
+BACKENDS = ["thread", "steal", pytest.param("process", marks=pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork", reason="needs forked worker processes"))]
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_every_task_runs_once_and_results_come_back(name: str, monkeypatch, tmp_path: Path):
+    ex = _executors()
+    # Somewhere the workers can tell us what they ran, whatever they are
+    seen_path = tmp_path / "seen"
+
+    def fake_run(task):
+        with open(seen_path, "a") as f:
+            f.write(task.model + "\n")
+        return ex.TaskOutcome(task, ex.DONE, record=task.model)
+
+    monkeypatch.setattr(ex, "run_model_task", fake_run)
+    executor = ex.make_executor(name, 3, _Context())
+    try:
+        for _ in range(2):
+            seen_path.write_text("")
+            got = []
+            tasks = [_Task(i) for i in range(20)]
+            executor.run(tasks, lambda o: got.append(o.record))
+            assert sorted(got) == sorted(t.model for t in tasks)
+            assert sorted(seen_path.read_text().split()) == sorted(got)
+    finally:
+        executor.close()
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_worker_errors_are_raised_in_the_coordinator(name: str, monkeypatch):
+    ex = _executors()
+
+    def fake_run(task):
+        if task.model == "m5":
+            raise RuntimeError("boom")
+        return ex.TaskOutcome(task, ex.DONE)
+
+    def on_result(outcome):
+        if outcome.status == ex.FAILED:
+            raise outcome.error
+
+    monkeypatch.setattr(ex, "run_model_task", fake_run)
+    executor = ex.make_executor(name, 2, _Context())
+    try:
+        with pytest.raises(RuntimeError, match="boom"):
+            executor.run([_Task(i) for i in range(10)], on_result)
+    finally:
+        executor.close()
+
+
+def test_single_thread_runs_serially():
+    ex = _executors()
+    assert isinstance(ex.make_executor("process", 1, _Context()), ex.SerialExecutor)
+
+
+def test_unknown_executor():
+    ex = _executors()
+    with pytest.raises(ex.ExecutorError):
+        ex.make_executor("nope", 2, _Context())
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_tasks_are_pulled_lazily_within_the_window(name: str, monkeypatch):
+    ex = _executors()
+    pulled = []
+    in_flight = []
+
+    def fake_run(task):
+        return ex.TaskOutcome(task, ex.DONE)
+
+    def generate():
+        for i in range(30):
+            pulled.append(i)
+            yield _Task(i)
+
+    def on_result(outcome):
+        in_flight.append(len(pulled) - len(in_flight))
+
+    monkeypatch.setattr(ex, "run_model_task", fake_run)
+    executor = ex.make_executor(name, 2, _Context(), window=4)
+    try:
+        executor.run(generate(), on_result)
+    finally:
+        executor.close()
+
+    assert len(pulled) == 30
+    assert max(in_flight) <= 4
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_multi_cpu_tasks_stay_within_the_cpu_budget(name: str, monkeypatch):
+    import time
+
+    ex = _executors()
+    # Shared memory, so this works for threads and processes
+    busy = multiprocessing.Value("i", 0)
+    peak = multiprocessing.Value("i", 0, lock=False)
+
+    def fake_run(task):
+        with busy.get_lock():
+            busy.value += task.cpus
+            peak.value = max(peak.value, busy.value)
+        time.sleep(0.005)
+        with busy.get_lock():
+            busy.value -= task.cpus
+        return ex.TaskOutcome(task, ex.DONE)
+
+    def generate():
+        for i in range(40):
+            task = _Task(i)
+            task.cpus = 3 if i % 7 == 0 else 1
+            yield task
+
+    monkeypatch.setattr(ex, "run_model_task", fake_run)
+    executor = ex.make_executor(name, 4, _Context())
+    done = []
+    try:
+        executor.run(generate(), done.append)
+    finally:
+        executor.close()
+
+    assert len(done) == 40
+    assert peak.value <= 4
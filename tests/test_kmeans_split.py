@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import itertools
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+def _sse(values, labels):
+    return sum(((values[labels == c] - values[labels == c].mean()) ** 2).sum()
+               for c in np.unique(labels))
+
+
+def _samples():
+    rng = np.random.default_rng(7)
+    yield rng.normal(size=500)
+    yield np.concatenate([rng.normal(0, 1, 300), rng.normal(4, 0.5, 50)])
+    yield rng.exponential(size=1000)
+    # Entropies have lots of ties, most of all at zero
+    yield np.round(rng.exponential(size=2000), 1) * (rng.random(2000) < 0.7)
+    alignment = _module("alignment").Alignment()
+    alignment.read(str(REPO_ROOT / "examples" / "nucleotide" / "Concatenated_SL.nexus"))
+    yield _module("entropy").observed_entropies(alignment.data)[:, 0]
+
+
+def test_two_way_split_is_at_least_as_good_as_sklearn():
+    pytest.importorskip("sklearn")
+    kmeans = _module("kmeans")
+
+    for values in _samples():
+        array = kmeans.scale(values)
+        exact, centroids = kmeans.optimal_1d_clusters(array[:, 0], 2)
+        restarts, _ = kmeans.sklearn_kmeans(array, 2)
+
+        assert _sse(array[:, 0], exact) <= _sse(array[:, 0], restarts) + 1e-9
+        assert list(np.unique(exact)) == [0, 1]
+        assert centroids[0, 0] < centroids[1, 0]
+        assert np.allclose(centroids[:, 0],
+                           [array[exact == c, 0].mean() for c in (0, 1)])
+
+
+def test_more_clusters_match_brute_force():
+    kmeans = _module("kmeans")
+    rng = np.random.default_rng(3)
+
+    for k in (2, 3, 4):
+        for _ in range(20):
+            values = np.round(rng.normal(size=12), 1)
+            labels, _ = kmeans.optimal_1d_clusters(values, k)
+
+            distinct = np.unique(values)
+            best = min(
+                _sse(values, np.searchsorted(np.array(cuts), np.searchsorted(distinct, values), side="right"))
+                for cuts in itertools.combinations(range(1, len(distinct)), k - 1)
+            )
+            assert len(np.unique(labels)) == k
+            assert _sse(values, labels) == pytest.approx(best, abs=1e-12)
+            # Clusters are runs of the sorted values
+            assert np.all(np.diff(labels[np.argsort(values, kind="stable")]) >= 0)
+
+
+def test_equal_values_are_not_split():
+    kmeans = _module("kmeans")
+
+    centroids, clusters = kmeans.kmeans(np.full((20, 1), 0.5), 2, 1)
+    assert clusters == {0: list(range(1, 21))}
+    assert centroids == [[0.0]]
+
+    labels, _ = kmeans.optimal_1d_clusters(np.array([1.0, 2.0, 1.0]), 3)
+    assert list(labels) == [0, 1, 0]
+
+
+@pytest.mark.parametrize("kmeans_type", ["entropy", "tiger"])
+def test_clustering_subsets_in_parallel_matches_serial(kmeans_type, monkeypatch):
+    ColumnSet = _module("columns").ColumnSet
+    config = _module("config")
+    kmeans = _module("kmeans")
+    aln = _module("alignment").Alignment()
+    aln.read(str(REPO_ROOT / "examples" / "morphology" / "test.phy"))
+
+    cfg = SimpleNamespace(kmeans=kmeans_type, datatype="morphology")
+    subsets = [kmeans.SubsetColumns(ColumnSet(columns))
+               for columns in [range(170), range(0, 170, 3), range(40, 90), [1, 5, 9, 120, 121]]]
+    monkeypatch.setattr(config.the_config, "datatype", "morphology", raising=False)
+    serial = kmeans.cluster_subsets(cfg, aln, subsets, 1)
+    parallel = kmeans.cluster_subsets(cfg, aln, subsets, 3)
+
+    assert len(parallel) == len(subsets)
+    for (stats, centroids, clusters), (p_stats, p_centroids, p_clusters) in zip(serial, parallel):
+        assert np.asarray(p_stats).tobytes() == np.asarray(stats).tobytes()
+        assert p_centroids == centroids
+        assert p_clusters == clusters
+
+
+def test_splitting_sites_does_not_import_sklearn():
+    code = (
+        "import sys, numpy\n"
+        "from partitionfinder.core._legacy_shim import import_legacy_module\n"
+        "kmeans = import_legacy_module('kmeans')\n"
+        "centroids, clusters = kmeans.kmeans(numpy.arange(10.0).reshape(-1, 1), 2, 1)\n"
+        "assert sorted(map(len, clusters.values())) == [5, 5]\n"
+        "assert not [m for m in sys.modules if m.startswith('sklearn')]\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, check=True)
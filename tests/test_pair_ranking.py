@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import scipy.spatial.distance
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+class _Subset:
+    def __init__(self, value):
+        self.value = value
+
+
+def _distances(subsets):
+    return scipy.spatial.distance.pdist(np.array([[s.value] for s in subsets]), "cityblock")
+
+
+def test_ranked_list_is_a_stable_argsort():
+    neighbour = _module("neighbour")
+    rng = np.random.default_rng(2)
+    subsets = [_Subset(v) for v in rng.integers(0, 20, size=60).astype(float)]
+    d = _distances(subsets)
+    ti = np.triu_indices(len(subsets), 1)
+
+    for N in (1, 10, 100, 1000, len(d), len(d) + 5):
+        order = np.argsort(d, kind="stable")[:N]
+        expected = [[subsets[i], subsets[j]] for i, j in zip(ti[0][order], ti[1][order])]
+        assert neighbour.get_ranked_list(d, subsets, N) == expected
+
+    # Greedy ranks a vector of infs
+    d[:] = np.inf
+    pairs = neighbour.get_ranked_list(d, subsets, len(d))
+    assert pairs == [[subsets[i], subsets[j]] for i, j in zip(*ti)]
+
+
+def test_pair_indices_match_triu_indices():
+    neighbour = _module("neighbour")
+    for n in (2, 3, 7, 50):
+        ti = np.triu_indices(n, 1)
+        k = np.arange(len(ti[0]))
+        i, j = neighbour.pair_indices(k, n)
+        assert np.array_equal(i, ti[0]) and np.array_equal(j, ti[1])
+
+
+@pytest.mark.parametrize("N", [1, 5, 40])
+def test_incremental_ranking_matches_ranking_again(N):
+    neighbour = _module("neighbour")
+    rng = np.random.default_rng(N)
+    subsets = [_Subset(v) for v in rng.integers(0, 30, size=40).astype(float)]
+    ranking = neighbour.PairRanking(subsets, _distances, N)
+
+    while len(subsets) > 2:
+        assert ranking.closest() == neighbour.get_ranked_list(_distances(subsets), subsets, N)
+        pair = ranking.closest(1)[0]
+        merged = _Subset(float(rng.integers(0, 30)))
+        subsets = [s for s in subsets if s not in pair]
+        ranking.merge(pair, merged, [abs(s.value - merged.value) for s in subsets])
+        subsets.append(merged)
+        assert ranking.subsets == subsets
+    assert ranking.closest() == neighbour.get_ranked_list(_distances(subsets), subsets, N)
+
+
+class _Fitted:
+    """A subset with the parameters of its best model"""
+
+    def __init__(self, rng, scale=1.0):
+        self.params = {
+            "rate": np.float32(rng.random() * scale),
+            "freqs": rng.random(4).astype(np.float32),
+            "model": rng.random(6).astype(np.float32),
+            "alpha": np.float32(rng.random()),
+        }
+
+    def get_param_values(self):
+        return self.params
+
+
+@pytest.mark.parametrize("weights", [
+    {"rate": 1, "freqs": 0, "model": 0, "alpha": 0},
+    {"rate": 1, "freqs": 0.5, "model": 2, "alpha": 1},
+])
+def test_distance_matrix_matches_measuring_again(weights):
+    neighbour = _module("neighbour")
+    rng = np.random.default_rng(4)
+    subsets = [_Fitted(rng) for _ in range(25)]
+    distances = neighbour.DistanceMatrix(subsets, weights)
+    ranking = neighbour.PairRanking(subsets, distances.condensed, 10)
+
+    renormalised = 0
+    while len(subsets) > 2:
+        expected = neighbour.get_distance_matrix(subsets, weights)
+        assert distances.condensed(subsets).tobytes() == expected.tobytes()
+        assert ranking.closest() == neighbour.get_ranked_list(expected, subsets, 10)
+
+        pair = ranking.closest(1)[0]
+        # Sometimes the new subset is further from everything than before
+        merged = _Fitted(rng, scale=3.0 if len(subsets) % 4 == 0 else 1.0)
+        if distances.merge(pair, merged):
+            renormalised += 1
+            ranking.invalidate()
+            ranking.merge(pair, merged)
+        else:
+            ranking.merge(pair, merged, distances.distances_to(merged))
+        subsets = [s for s in subsets if s not in pair] + [merged]
+        assert distances.subsets == subsets
+        assert ranking.subsets == subsets
+
+    assert renormalised
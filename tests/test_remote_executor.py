@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import socket
+import sys
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Context(SimpleNamespace):
+    def install(self):
+        pass
+
+
+class _Task:
+    def __init__(self, i, alignment_path):
+        self.subset_id = "s%d" % i
+        self.model = "GTR"
+        self.alignment_path = alignment_path
+        self.cpus = 1
+
+    def __repr__(self):
+        return self.subset_id
+
+
+@pytest.fixture
+def remote(monkeypatch, tmp_path):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    remote = import_legacy_module("remote")
+    executors = import_legacy_module("executors")
+    config = import_legacy_module("config")
+
+    port = _free_port()
+    monkeypatch.setattr(config.the_config, "listen", "127.0.0.1:%d" % port, raising=False)
+    monkeypatch.setattr(config.the_config, "authkey", "test-key", raising=False)
+    monkeypatch.setattr(config.the_config, "find_programs", lambda: None, raising=False)
+
+    def fake_run(task):
+        # The worker gets its own copy of the alignment
+        assert Path(task.alignment_path).read_text() == "alignment " + task.subset_id
+        return executors.TaskOutcome(task, executors.DONE, record=task.subset_id)
+
+    monkeypatch.setattr(executors, "run_model_task", fake_run)
+
+    tree = tmp_path / "tree.phy"
+    tree.write_text("(a,b);")
+    tasks = []
+    for i in range(6):
+        aln = tmp_path / ("s%d.phy" % i)
+        aln.write_text("alignment s%d" % i)
+        tasks.append(_Task(i, str(aln)))
+
+    context = _Context(tree_path=str(tree))
+    executor = remote.RemoteExecutor(1, context)
+    yield remote, executor, tasks, ("127.0.0.1", port)
+    executor.close()
+
+
+def _start_worker(remote, address):
+    t = threading.Thread(target=remote.run_worker, args=(address, b"test-key", 10))
+    t.daemon = True
+    t.start()
+    return t
+
+
+def _run(executor, tasks, timeout=60):
+    """Run the tasks, failing rather than hanging if they never finish"""
+    got = []
+    failed = []
+
+    def run():
+        try:
+            executor.run(tasks, lambda o: got.append(o.record))
+        except BaseException as e:
+            failed.append(e)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    t.join(timeout)
+    if t.is_alive():
+        pytest.fail("The tasks didn't finish within %d seconds" % timeout)
+    if failed:
+        raise failed[0]
+    return got
+
+
+def test_tasks_run_on_remote_workers(remote):
+    remote, executor, tasks, address = remote
+    workers = [_start_worker(remote, address) for _ in range(2)]
+
+    got = _run(executor, tasks)
+    assert sorted(got) == sorted(t.subset_id for t in tasks)
+
+    executor.close()
+    for w in workers:
+        w.join(5)
+        assert not w.is_alive()
+
+
+def test_lost_worker_task_is_retried(remote):
+    remote, executor, tasks, address = remote
+    lost = []
+
+    def flaky_worker():
+        # Like a real worker, wait for the analysis to start listening
+        conn = remote.connect(address, b"test-key", 10)
+        conn.send(("hello", "flaky"))
+        conn.recv()
+        kind, task, alignment = conn.recv()
+        lost.append(task.subset_id)
+        # Die without answering
+        conn.close()
+        _start_worker(remote, address)
+
+    threading.Thread(target=flaky_worker, daemon=True).start()
+
+    got = _run(executor, tasks)
+    assert sorted(got) == sorted(t.subset_id for t in tasks)
+    assert len(lost) == 1
+    assert executor.attempts[(lost[0], "GTR")] == 2
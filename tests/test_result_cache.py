@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _resultcache():
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module("resultcache")
+
+
+DTYPE = numpy.dtype([("subset_id", "S32"), ("model_id", "S30"), ("lnl", "f4"), ("freqs", "f4", (4,))])
+
+
+def _record(model, lnl):
+    r = numpy.zeros(1, DTYPE)[0]
+    r["model_id"] = model
+    r["lnl"] = lnl
+    r["freqs"] = [0.1, 0.2, 0.3, 0.4]
+    return r
+
+
+def test_results_are_found_by_alignment_and_model(tmp_path: Path):
+    rc = _resultcache()
+    cache = rc.ResultCache(str(tmp_path / "c.sqlite"), "ctx", DTYPE)
+    cache.put("aln1", "GTR", _record("GTR", -10.5))
+    assert cache.get("aln1", "JC") is None
+    assert cache.get("aln2", "GTR") is None
+    got = cache.get("aln1", "GTR")
+    assert got["lnl"] == -10.5 and list(got["freqs"]) == list(_record("GTR", 0)["freqs"])
+    cache.close()
+
+    # Different settings never see each other's results
+    other = rc.ResultCache(str(tmp_path / "c.sqlite"), "other-ctx", DTYPE)
+    assert other.get("aln1", "GTR") is None
+    other.close()
+
+
+def test_least_recently_used_results_are_dropped(tmp_path: Path):
+    rc = _resultcache()
+    # Room for about 10 records
+    cache = rc.ResultCache(str(tmp_path / "c.sqlite"), "ctx", DTYPE, size_mb=10 * DTYPE.itemsize / 1048576.0)
+    for i in range(10):
+        cache.put("aln%d" % i, "GTR", _record("GTR", i))
+    cache.get("aln0", "GTR")
+    for i in range(10, 15):
+        cache.put("aln%d" % i, "GTR", _record("GTR", i))
+
+    assert cache.size <= cache.max_bytes
+    assert cache.get("aln0", "GTR") is not None
+    assert cache.get("aln1", "GTR") is None
+    assert cache.get("aln14", "GTR") is not None
+    cache.close()
+
+
+def test_a_second_analysis_reuses_the_results(tmp_path: Path):
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    env = os.environ.copy()
+    env["PARTITIONFINDER_RESULT_CACHE"] = str(cache)
+
+    outputs = []
+    for selection in ["aicc", "bic"]:
+        work = tmp_path / selection
+        shutil.copytree(REPO_ROOT / "examples" / "aminoacid", work)
+        cfg = work / "partition_finder.cfg"
+        cfg.write_text(re.sub(r"model_selection\s*=\s*\w+", "model_selection = %s" % selection, cfg.read_text()))
+        proc = subprocess.run(
+            [sys.executable, str(REPO_ROOT / "PartitionFinderProtein.py"), "-n", "-p", "1", str(work)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        assert proc.returncode == 0, proc.stdout
+        outputs.append(proc.stdout)
+
+    pattern = r"Result cache: used (\d+) stored results, and added (\d+)"
+    first = re.search(pattern, outputs[0])
+    assert first and int(first.group(1)) == 0 and int(first.group(2)) > 0
+    # The second analysis didn't need to run anything
+    second = re.search(pattern, outputs[1])
+    assert second and int(second.group(1)) == int(first.group(2)) and int(second.group(2)) == 0
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+def _example(name):
+    aln = _module("alignment").Alignment()
+    aln.read(str(REPO_ROOT / "examples" / name / "test.phy"))
+    return aln
+
+
+def _subset(columns):
+    ColumnSet = _module("columns").ColumnSet
+    return SimpleNamespace(column_set=ColumnSet(columns))
+
+
+def test_patterns_rebuild_the_alignment():
+    aln = _module("alignment").Alignment()
+    aln.parse("3 6\nspA AACAAC\nspB GGTGGT\nspC AA-AA-\n")
+    patterns = aln.patterns
+    assert patterns.pattern_count == 2
+    assert sorted(patterns.weights) == [2, 4]
+    assert (patterns.data[:, patterns.site_pattern] == aln.data).all()
+    assert aln.patterns is patterns
+
+    # Changing the data throws them away
+    aln.data = aln.data[:, :2]
+    assert aln.patterns.pattern_count == 1
+
+
+@pytest.mark.parametrize("name, datatype", [("aminoacid", "protein"), ("morphology", "morphology")])
+def test_subset_entropies_match_the_subset_alignment(monkeypatch, name, datatype):
+    alignment = _module("alignment")
+    entropy = _module("entropy")
+    monkeypatch.setattr(entropy, "the_config", SimpleNamespace(datatype=datatype))
+    aln = _example(name)
+    sub = _subset(range(0, aln.sequence_length, 3))
+
+    expected = entropy.sitewise_entropies(alignment.SubsetAlignment(aln, sub))
+    assert np.array_equal(entropy.subset_entropies(aln, sub), expected)
+
+
+def test_subset_tiger_rates_match_the_subset_alignment():
+    alignment = _module("alignment")
+    mt = _module("morph_tiger")
+    aln = _example("morphology")
+    # Repeat some columns, so there are fewer patterns than sites
+    aln.data = aln.data[:, np.arange(120) % 40]
+    sub = _subset(range(0, 120, 2))
+
+    sub_aln = alignment.SubsetAlignment(aln, sub)
+    expected = mt.calculate_rates(mt.create_set_parts(sub_aln))
+    assert np.array_equal(mt.subset_rates(aln, sub), expected)
+
+
+def test_state_check_looks_at_patterns():
+    aln = _module("alignment").Alignment()
+    aln.parse("2 4\nspA ACGA\nspB ACTA\n")
+    cfg = SimpleNamespace(all_states=True, datatype="DNA")
+    assert aln.check_state_probs(_subset([0, 1, 3]), cfg)
+    assert not aln.check_state_probs(_subset([0, 1, 2]), cfg)
+
+
+def _missing_states_the_slow_way(aln, columns, datatype):
+    alignment = _module("alignment")
+    all_states, state_dict = {
+        "DNA": (alignment.dna_states, alignment.dna_dict),
+        "protein": (alignment.amino_states, alignment.amino_dict),
+        "morphology": (alignment.morph_states, alignment.morph_dict),
+    }[datatype]
+    observed = set()
+    for byte in np.unique(aln.data[:, columns]).tobytes().decode("latin1"):
+        observed |= state_dict.get(byte, set(byte))
+    return bool(all_states - observed)
+
+
+@pytest.mark.parametrize("name, datatype", [("aminoacid", "protein"), ("morphology", "morphology")])
+def test_state_masks_agree_with_expanding_the_states(name, datatype):
+    aln = _example(name)
+    cfg = SimpleNamespace(all_states=True, datatype=datatype)
+    rng = np.random.default_rng(0)
+    for size in [1, 2, 5, 20, 100]:
+        for _ in range(10):
+            columns = sorted(rng.choice(aln.sequence_length, size=size, replace=False).tolist())
+            assert aln.check_state_probs(_subset(columns), cfg) == \
+                _missing_states_the_slow_way(aln, columns, datatype)
+
+
+def test_dna_ambiguity_codes_count_towards_the_states():
+    aln = _module("alignment").Alignment()
+    aln.parse("2 3\nspA RYN\nspB RY-\n")
+    cfg = SimpleNamespace(all_states=True, datatype="DNA")
+    assert not aln.check_state_probs(_subset([0, 1]), cfg)
+    assert aln.check_state_probs(_subset([0, 2]), cfg)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+def _alignment():
+    aln = _module("alignment").Alignment()
+    aln.read(str(REPO_ROOT / "examples" / "aminoacid" / "test.phy"))
+    return aln
+
+
+def _subset(column_set):
+    return SimpleNamespace(column_set=column_set)
+
+
+def test_evenly_spaced_columns_are_views():
+    alignment = _module("alignment")
+    ColumnSet = _module("columns").ColumnSet
+    aln = _alignment()
+
+    for cs in [ColumnSet.from_range(10, 300), ColumnSet.from_range(2, 900, 3), ColumnSet([7])]:
+        sub = alignment.SubsetAlignment(aln, _subset(cs))
+        assert np.shares_memory(sub.data, aln.data)
+        assert np.array_equal(sub.data, aln.data[:, cs.to_array()])
+        assert sub.sequence_length == len(cs)
+        assert not sub.data.flags.writeable
+
+
+def test_other_subsets_are_gathered_once(monkeypatch):
+    alignment = _module("alignment")
+    ColumnSet = _module("columns").ColumnSet
+    monkeypatch.setattr(alignment, "SUBSET_DATA_CACHE", 2)
+    aln = _alignment()
+
+    a, b, c = ColumnSet([1, 2, 40]), ColumnSet([5, 9, 10]), ColumnSet([0, 3, 4])
+    first = alignment.SubsetAlignment(aln, _subset(a))
+    assert not np.shares_memory(first.data, aln.data)
+    assert np.array_equal(first.data, aln.data[:, [1, 2, 40]])
+    assert alignment.SubsetAlignment(aln, _subset(ColumnSet([40, 2, 1]))).data is first.data
+
+    alignment.SubsetAlignment(aln, _subset(b))
+    alignment.SubsetAlignment(aln, _subset(c))
+    # `a` was the least recently used, so it has gone
+    assert alignment.SubsetAlignment(aln, _subset(a)).data is not first.data
+
+    # The same bytes as the old copy, so the digests of existing files match
+    assert first.digest() == alignment.SubsetAlignment(aln, _subset(a)).digest()
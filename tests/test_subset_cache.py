@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import gc
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture
+def env(tmp_path: Path):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    subset = import_legacy_module("subset")
+    database = import_legacy_module("database")
+
+    layout = database.DataLayout()
+    cfg = SimpleNamespace(subsets_path=str(tmp_path), data_layout=layout,
+                          model_count=2, models=["JC", "GTR"],
+                          model_selection="aicc")
+    cfg.database = database.HDF5Database(cfg)
+    subset.clear_subsets()
+    yield subset, cfg
+    subset.clear_subsets()
+    subset.set_cache_budget(None)
+    cfg.database.close()
+
+
+def _finish(subset, cfg, sub, scores):
+    """What the analysis does, without running anything"""
+    for model, score in zip(cfg.models, scores):
+        record = cfg.data_layout.get_empty_record()[0]
+        record["subset_id"] = sub.subset_id
+        record["model_id"] = model
+        record["aicc"] = score
+        sub.add_model_record(cfg, model, record)
+        sub.models_not_done.remove(model)
+    sub.model_selection(cfg)
+    sub.status = subset.DONE
+    subset.Subset._cache.touch(sub)
+
+
+def test_finished_subsets_are_dropped_and_reloaded(env):
+    subset, cfg = env
+    subset.set_cache_budget(0.01)
+
+    first = subset.Subset(cfg, range(0, 10))
+    first_id = first.subset_id
+    _finish(subset, cfg, first, [5.0, 3.0])
+
+    for i in range(1, 20):
+        _finish(subset, cfg, subset.Subset(cfg, range(i * 10, i * 10 + 10)), [1.0, 2.0])
+
+    # Still in use, so it is the same object, but cut down to its best result
+    assert subset.Subset(cfg, range(0, 10)) is first
+    assert first.compacted and first.best_model == b"GTR"
+
+    # ...and the rest comes back from the database when it is asked for
+    assert sorted(m.decode() for m in first.result_array["model_id"]) == ["GTR", "JC"]
+    assert first.result_array[first.result_best]["model_id"] == b"GTR"
+
+    # Once nobody holds on to it, it goes away
+    del first
+    for i in range(20, 40):
+        _finish(subset, cfg, subset.Subset(cfg, range(i * 10, i * 10 + 10)), [1.0, 2.0])
+    gc.collect()
+    assert first_id not in subset.Subset._cache
+    assert subset.count_subsets() < 40
+
+    again = subset.Subset(cfg, range(0, 10))
+    assert again.is_fresh
+    again.load_results(cfg)
+    assert not again.models_not_done
+
+
+def test_subsets_being_analysed_are_held(env):
+    subset, cfg = env
+    subset.set_cache_budget(0.01)
+
+    busy = subset.Subset(cfg, range(0, 10))
+    busy.status = subset.PREPARED
+    busy_id = busy.subset_id
+    del busy
+    for i in range(1, 20):
+        _finish(subset, cfg, subset.Subset(cfg, range(i * 10, i * 10 + 10)), [1.0, 2.0])
+
+    gc.collect()
+    assert busy_id in subset.Subset._cache
+
+
+def test_subsets_with_per_site_statistics_are_held(env):
+    subset, cfg = env
+    subset.set_cache_budget(0.01)
+
+    # What kmeans leaves on a subset it has split
+    split = subset.Subset(cfg, range(0, 10))
+    _finish(subset, cfg, split, [1.0, 2.0])
+    split.add_per_site_statistics([[0.5]] * 10)
+    split.add_centroid([0.5])
+    split_id = split.subset_id
+    del split
+    for i in range(1, 40):
+        _finish(subset, cfg, subset.Subset(cfg, range(i * 10, i * 10 + 10)), [1.0, 2.0])
+
+    gc.collect()
+    assert subset.count_subsets() < 40
+    assert split_id in subset.Subset._cache
+    split = subset.Subset(cfg, range(0, 10))
+    assert split.site_lnls == [[0.5]] * 10
+    assert split.centroid == [0.5]
+
+
+def test_names_come_back_with_a_rebuilt_subset(env):
+    subset, cfg = env
+    subset.set_cache_budget(0.01)
+
+    named = subset.Subset(cfg, range(0, 10))
+    named.add_description(["Gene1_pos1"], [(1, 10, 1)])
+    _finish(subset, cfg, named, [1.0, 2.0])
+    named_id = named.subset_id
+    del named
+    for i in range(1, 40):
+        _finish(subset, cfg, subset.Subset(cfg, range(i * 10, i * 10 + 10)), [1.0, 2.0])
+
+    gc.collect()
+    assert named_id not in subset.Subset._cache
+    again = subset.Subset(cfg, range(0, 10))
+    assert again.names == ["Gene1_pos1"]
+    assert again.description == [(1, 10, 1)]
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+
+def _module(name):
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    return import_legacy_module(name)
+
+
+def _subset(columns):
+    ColumnSet = _module("columns").ColumnSet
+    return SimpleNamespace(column_set=ColumnSet(columns))
+
+
+def test_agreement_matches_axpi_exactly():
+    from partitionfinder.accel import tiger_agreement
+
+    mt = _module("morph_tiger")
+    rng = np.random.default_rng(1)
+    data = np.frombuffer(b"0123?-", dtype="u1")[rng.integers(0, 6, size=(30, 40))]
+    set_parts = mt.create_set_parts(SimpleNamespace(data=data))
+    labels = mt.set_part_labels(SimpleNamespace(data=data))
+
+    expected = [[mt.axpi(p, q) for q in set_parts] for p in set_parts]
+    assert np.array_equal(tiger_agreement(labels), expected)
+    assert np.array_equal(tiger_agreement(labels, threads=4), expected)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_rates_are_bit_for_bit_the_same_as_calculate_rates(n_jobs):
+    alignment = _module("alignment")
+    mt = _module("morph_tiger")
+    aln = alignment.Alignment()
+    aln.read(str(REPO_ROOT / "examples" / "morphology" / "test.phy"))
+    # Repeat columns so that some sites share a pattern
+    aln.data = aln.data[:, np.arange(300) % 170]
+
+    for columns in [range(300), range(0, 300, 7), [3, 173, 9, 50, 220]]:
+        sub = _subset(columns)
+        expected = mt.calculate_rates(mt.create_set_parts(alignment.SubsetAlignment(aln, sub)))
+        got = mt.subset_rates(aln, sub, n_jobs)
+        assert got.shape == (len(expected), 1)
+        assert got.tobytes() == np.array(expected).tobytes()
+
+
+def test_a_site_with_no_data_is_an_error():
+    alignment = _module("alignment")
+    mt = _module("morph_tiger")
+    aln = alignment.Alignment()
+    aln.parse("3 3\nspA 01?\nspB 10-\nspC 11?\n")
+    with pytest.raises(mt.PartitionFinderError):
+        mt.subset_rates(aln, _subset([0, 1, 2]))
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def _write_phylip(path: Path, taxa: int, sites: int, block: int | None) -> None:
+    import numpy
+
+    rng = numpy.random.default_rng(1)
+    data = numpy.frombuffer(b"ACGT-", dtype="u1")[rng.integers(0, 5, size=(taxa, sites))]
+    rows = [data[i].tobytes().decode("ascii") for i in range(taxa)]
+    with open(path, "w") as f:
+        f.write("%d %d\n" % (taxa, sites))
+        if block is None:
+            for i, row in enumerate(rows):
+                f.write("sp%d %s\n" % (i, row))
+            return
+        for i, row in enumerate(rows):
+            f.write("sp%d %s\n" % (i, row[:block]))
+        for start in range(block, sites, block):
+            f.write("\n")
+            for row in rows:
+                f.write("%s\n" % row[start:start + block])
+
+
+def _write_nexus(path: Path, taxa: int, sites: int, block: int) -> None:
+    import numpy
+
+    rng = numpy.random.default_rng(1)
+    data = numpy.frombuffer(b"ACGT-", dtype="u1")[rng.integers(0, 5, size=(taxa, sites))]
+    rows = [data[i].tobytes().decode("ascii") for i in range(taxa)]
+    with open(path, "w") as f:
+        f.write("#NEXUS\nBEGIN DATA;\n  DIMENSIONS NTAX=%d NCHAR=%d;\n" % (taxa, sites))
+        f.write("  FORMAT DATATYPE=DNA INTERLEAVE;\nMATRIX\n")
+        for start in range(0, sites, block):
+            for i, row in enumerate(rows):
+                f.write("sp%d %s\n" % (i, row[start:start + block]))
+            f.write("\n")
+        f.write(";\nEND;\n")
+
+
+def _old_style(path: Path) -> None:
+    """What the parser used to do for each line: one Python op per base"""
+    import numpy
+
+    with open(path) as f:
+        f.readline()
+        for line in f:
+            bits = line.split()
+            if not bits:
+                continue
+            upper = bits[-1].upper()
+            numpy.array([ord(c) for c in upper], dtype="u1")
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark reading phylip alignments")
+    p.add_argument("--taxa", type=int, default=200, help="Number of taxa (default: 200)")
+    p.add_argument("--sites", type=int, default=100_000, help="Number of sites (default: 100,000)")
+    p.add_argument("--block", type=int, default=60, help="Interleaved block width (default: 60)")
+    p.add_argument("--skip-old", action="store_true", help="Don't time the old per-base conversion")
+    args = p.parse_args()
+
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    alignment = import_legacy_module("alignment")
+
+    with tempfile.TemporaryDirectory() as d:
+        for layout, block in [("sequential", None), ("interleaved", args.block), ("nexus", args.block)]:
+            path = Path(d) / ("%s.phy" % layout)
+            if layout == "nexus":
+                _write_nexus(path, args.taxa, args.sites, block)
+            else:
+                _write_phylip(path, args.taxa, args.sites, block)
+            mb = path.stat().st_size / 1048576.0
+
+            t0 = time.perf_counter()
+            aln = alignment.Alignment()
+            aln.read(str(path))
+            dt = time.perf_counter() - t0
+            assert aln.data.shape == (args.taxa, args.sites)
+            print(f"{layout}_mb={mb:.1f} parse_seconds={dt:.3f} mb_per_sec={mb / dt:,.1f}")
+
+            # What a restart costs: it used to parse the source again, and
+            # the copy in start_tree, and compare them
+            cache = Path(d) / ("%s_cache" % layout)
+            cache.mkdir()
+            copy = cache / "source.phy"
+            aln.write(str(copy))
+            index = aln.save_cache(str(cache), alignment.file_digest(str(path)))
+            t2 = time.perf_counter()
+            again = alignment.Alignment()
+            again.read(str(path))
+            previous = alignment.Alignment()
+            previous.read(str(copy))
+            assert previous.same_as(again)
+            dt_restart = time.perf_counter() - t2
+
+            t3 = time.perf_counter()
+            assert alignment.file_digest(str(path)) == index["source_digest"]
+            assert alignment.Alignment().load_cache(str(cache), index)
+            dt_cache = time.perf_counter() - t3
+            print(f"{layout}_restart_seconds={dt_restart:.3f} cached_seconds={dt_cache:.3f} "
+                  f"speedup={dt_restart / dt_cache:.1f}x")
+
+            if not args.skip_old and layout != "nexus":
+                t1 = time.perf_counter()
+                _old_style(path)
+                dt_old = time.perf_counter() - t1
+                print(f"{layout}_old_seconds={dt_old:.3f} speedup={dt_old / dt:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
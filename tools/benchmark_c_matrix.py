@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+class _Subset:
+    def __init__(self, names):
+        self.names = names
+        self.name = names[0]
+
+
+def _old_merges(subsets, changes, merges):
+    """What reset_c_matrix and reset_subsets used to do for each merge"""
+    import numpy
+
+    subsets = list(subsets)
+    c_matrix = changes.copy()
+    for pair in merges:
+        indices = [subsets.index(r) for r in pair]
+        c_matrix = numpy.delete(c_matrix, indices, 1)
+        c_matrix = numpy.delete(c_matrix, indices, 0)
+        n = c_matrix.shape[0]
+        c_matrix = numpy.vstack((c_matrix, numpy.full(n, numpy.inf)))
+        c_matrix = numpy.hstack((c_matrix, numpy.append(numpy.full(n, numpy.inf), 0)[:, None]))
+        for r in pair:
+            subsets.pop(subsets.index(r))
+        subsets.append(_Subset(pair[0].names + pair[1].names))
+    return subsets
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark merging subsets in the search's c-matrix")
+    p.add_argument("--blocks", type=int, default=2_000, help="Subsets to start with (default: 2,000)")
+    p.add_argument("--merges", type=int, default=200, help="Merges to time (default: 200)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    neighbour = import_legacy_module("neighbour")
+    subsets = [_Subset(["b%d" % i]) for i in range(args.blocks)]
+    # Merge neighbouring pairs, which aren't at the end of the list
+    merges = [(subsets[2 * i], subsets[2 * i + 1]) for i in range(args.merges)]
+
+    changes = numpy.full((args.blocks, args.blocks), numpy.inf)
+    numpy.fill_diagonal(changes, 0)
+    t0 = time.perf_counter()
+    expected = _old_merges(subsets, changes, merges)
+    dt_old = time.perf_counter() - t0
+    print(f"blocks={args.blocks} merges={args.merges} "
+          f"matrix_mb={changes.nbytes / 1048576.0:.1f}")
+    print(f"old_seconds={dt_old:.3f} per_merge_ms={1000 * dt_old / args.merges:.2f}")
+
+    for sparse in (False, True):
+        t1 = time.perf_counter()
+        c_matrix = neighbour.CMatrix(subsets, sparse=sparse)
+        for pair in merges:
+            c_matrix.merge(list(pair), [_Subset(pair[0].names + pair[1].names)])
+        dt = time.perf_counter() - t1
+        assert [s.names for s in c_matrix.subsets] == [s.names for s in expected]
+        name = "sparse" if sparse else "dense"
+        print(f"{name}_seconds={dt:.3f} per_merge_ms={1000 * dt / args.merges:.2f} "
+              f"speedup={dt_old / dt:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
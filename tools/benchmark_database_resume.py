@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark looking up stored results when resuming")
+    p.add_argument("--subsets", type=int, default=2_000, help="Subsets in the database (default: 2,000)")
+    p.add_argument("--models", type=int, default=50, help="Models per subset (default: 50)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    layout = database.DataLayout()
+    rows = args.subsets * args.models
+    ids = ["%032x" % i for i in range(args.subsets)]
+
+    with tempfile.TemporaryDirectory() as d:
+        cfg = SimpleNamespace(subsets_path=d, data_layout=layout)
+        db = database.HDF5Database(cfg)
+        arr = layout.get_empty_record().repeat(rows)
+        arr["subset_id"] = [ids[i // args.models].encode() for i in range(rows)]
+        arr["model_id"] = [("M%d" % (i % args.models)).encode() for i in range(rows)]
+        db.results.append(arr[numpy.random.permutation(rows)])
+        db.close()
+
+        db = database.HDF5Database(cfg)
+        t0 = time.perf_counter()
+        for sid in ids:
+            # What get_results_for_subset used to do
+            db.results.read_where("subset_id == current_id", {"current_id": sid})
+        dt_query = time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        for sid in ids:
+            db.get_results_for_subset(SimpleNamespace(subset_id=sid))
+        dt_preload = time.perf_counter() - t1
+        db.close()
+
+    print(f"rows={rows}")
+    print(f"read_where_seconds={dt_query:.3f} per_subset_ms={1000 * dt_query / args.subsets:.3f}")
+    print(f"preload_seconds={dt_preload:.3f} per_subset_ms={1000 * dt_preload / args.subsets:.3f}")
+    print(f"speedup={dt_query / dt_preload:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def _flush_per_row(db, sub, n):
+    # What save_result used to do
+    db.results.append(sub.result_array[n:n + 1])
+    db.results.flush()
+
+
+def _run(database, cfg, rows, save):
+    db = database.HDF5Database(cfg)
+    arr = cfg.data_layout.get_empty_record().repeat(rows)
+    arr["subset_id"] = [("%032x" % (i // 50)).encode() for i in range(rows)]
+    arr["model_id"] = [("M%d" % (i % 50)).encode() for i in range(rows)]
+    sub = SimpleNamespace(subset_id="", result_array=arr)
+
+    t0 = time.perf_counter()
+    for n in range(rows):
+        save(db, sub, n)
+    db.close()
+    return time.perf_counter() - t0
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark writing results to the database")
+    p.add_argument("--rows", type=int, default=5_000, help="Results to write (default: 5,000)")
+    args = p.parse_args()
+
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    layout = database.DataLayout()
+
+    timings = {}
+    for name, save in [
+        ("flush_per_row", _flush_per_row),
+        ("write_behind", lambda db, sub, n: db.save_result(sub, n)),
+    ]:
+        with tempfile.TemporaryDirectory() as d:
+            cfg = SimpleNamespace(subsets_path=d, data_layout=layout)
+            timings[name] = _run(database, cfg, args.rows, save)
+
+    for name, dt in timings.items():
+        print(f"{name}_seconds={dt:.3f} rows_per_sec={args.rows / dt:,.0f}")
+    print(f"speedup={timings['flush_per_row'] / timings['write_behind']:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
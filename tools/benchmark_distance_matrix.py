@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+class _Fitted:
+    """A subset with the parameters of its best model"""
+
+    def __init__(self, rng):
+        import numpy
+
+        self.params = {
+            "rate": numpy.float32(rng.random()),
+            "freqs": rng.random(4).astype(numpy.float32),
+            "model": rng.random(6).astype(numpy.float32),
+            "alpha": numpy.float32(rng.random()),
+        }
+
+    def get_param_values(self):
+        return self.params
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark keeping subset distances up to date in rcluster")
+    p.add_argument("--blocks", type=int, default=2_000, help="Subsets to start with (default: 2,000)")
+    p.add_argument("--merges", type=int, default=20, help="Merges to time (default: 20)")
+    p.add_argument("--cutoff", type=int, default=1_000, help="Closest pairs to choose (default: 1,000)")
+    p.add_argument("--weights", default="1,0,0,0", help="rate,freqs,model,alpha weights (default: 1,0,0,0)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    neighbour = import_legacy_module("neighbour")
+    weights = dict(zip(("rate", "freqs", "model", "alpha"), map(float, args.weights.split(","))))
+    rng = numpy.random.default_rng(1)
+    subsets = [_Fitted(rng) for _ in range(args.blocks)]
+
+    distances = neighbour.DistanceMatrix(subsets, weights)
+    ranking = neighbour.PairRanking(subsets, distances.condensed, args.cutoff)
+    dt_old = dt_new = 0.0
+    renormalised = 0
+    for _ in range(args.merges):
+        pair = ranking.closest(1)[0]
+        merged = _Fitted(rng)
+        subsets = [s for s in subsets if s not in pair] + [merged]
+
+        # What each step used to do
+        t0 = time.perf_counter()
+        expected = neighbour.get_ranked_list(
+            neighbour.get_distance_matrix(subsets, weights), subsets, args.cutoff)
+        dt_old += time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        if distances.merge(pair, merged):
+            renormalised += 1
+            ranking.invalidate()
+            ranking.merge(pair, merged)
+        else:
+            ranking.merge(pair, merged, distances.distances_to(merged))
+        got = ranking.closest(args.cutoff)
+        dt_new += time.perf_counter() - t1
+        assert got == expected
+
+    print(f"blocks={args.blocks} merges={args.merges} weights={args.weights} "
+          f"renormalised={renormalised}")
+    print(f"measure_again_ms={1000 * dt_old / args.merges:.1f} "
+          f"incremental_ms={1000 * dt_new / args.merges:.1f} speedup={dt_old / dt_new:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def _old_entropies(data, states):
+    """What sitewise_entropies used to do: a pass per state, and a Python
+    call per column"""
+    import numpy as np
+
+    def entropy_calc(p):
+        p = p[p != 0]
+        return np.dot(-p, np.log2(p))
+
+    counts = np.array([np.sum(data == ord(s), axis=0) for s in states], dtype=float).T
+    totals = np.sum(counts, axis=1)
+    totals.shape = len(counts), 1
+    totals = np.where(totals == 0, 1, totals)
+    return np.array([[entropy_calc(t)] for t in counts / totals])
+
+
+def _old_morph_entropies(data):
+    import numpy as np
+
+    out = []
+    for col in data.T:
+        col = col[(col != ord('-')) & (col != ord('?'))]
+        counts = np.unique(col, return_counts=True)[1]
+        p = counts / float(np.sum(counts))
+        p = p[p != 0]
+        out.append(np.dot(-p, np.log2(p)))
+    return np.array(out).reshape(len(out), 1)
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark sitewise entropies")
+    p.add_argument("--taxa", type=int, default=100, help="Number of taxa (default: 100)")
+    p.add_argument("--sites", type=int, default=50_000, help="Number of sites (default: 50,000)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    alignment = import_legacy_module("alignment")
+    entropy = import_legacy_module("entropy")
+
+    rng = numpy.random.default_rng(1)
+    cases = [
+        ("protein", b"ARNDCQEGHILKMFPSTWYVX-", lambda d: _old_entropies(d, "ARNDCQEGHILKMFPSTWYV")),
+        ("morphology", b"0123456789-?", _old_morph_entropies),
+    ]
+    for datatype, alphabet, old in cases:
+        entropy.the_config = SimpleNamespace(datatype=datatype)
+        aln = alignment.Alignment()
+        aln.data = numpy.frombuffer(alphabet, dtype="u1")[rng.integers(0, len(alphabet), size=(args.taxa, args.sites))]
+
+        t0 = time.perf_counter()
+        expected = old(aln.data)
+        dt_old = time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        got = entropy.sitewise_entropies(aln)
+        dt_new = time.perf_counter() - t1
+        assert numpy.allclose(got, expected, rtol=0, atol=1e-12)
+        print(f"{datatype}_old_seconds={dt_old:.3f} new_seconds={dt_new:.3f} speedup={dt_old / dt_new:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
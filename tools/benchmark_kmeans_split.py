@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def _sse(values, labels):
+    import numpy
+
+    return sum(((values[labels == c] - values[labels == c].mean()) ** 2).sum()
+               for c in numpy.unique(labels))
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark splitting a subset on its per-site statistics")
+    p.add_argument("--sites", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                   help="Subset sizes (default: 1,000 10,000 100,000)")
+    p.add_argument("--skip-sklearn", action="store_true", help="Don't time KMeans(n_init=100)")
+    p.add_argument("--subsets", type=int, default=16, help="Subsets to split with TIGER rates (default: 16)")
+    p.add_argument("--subset-sites", type=int, default=400, help="Sites in each of those (default: 400)")
+    p.add_argument("--jobs", type=int, default=4, help="Processes to split them on (default: 4)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    kmeans = import_legacy_module("kmeans")
+    rng = numpy.random.default_rng(1)
+
+    for sites in args.sites:
+        # Something like entropies: a lot of invariant sites, then a spread
+        stats = numpy.round(rng.exponential(size=sites), 3) * (rng.random(sites) < 0.6)
+        array = kmeans.scale(stats)
+
+        t0 = time.perf_counter()
+        exact, _ = kmeans.optimal_1d_clusters(array[:, 0], 2)
+        dt = time.perf_counter() - t0
+        line = f"sites={sites} exact_seconds={dt:.4f}"
+
+        if not args.skip_sklearn:
+            t1 = time.perf_counter()
+            restarts, _ = kmeans.sklearn_kmeans(array, 2)
+            dt_old = time.perf_counter() - t1
+            line += (f" sklearn_seconds={dt_old:.3f} speedup={dt_old / dt:.0f}x"
+                     f" sse_exact={_sse(array[:, 0], exact):.6f}"
+                     f" sse_sklearn={_sse(array[:, 0], restarts):.6f}")
+        print(line)
+
+    # Splitting a whole scheme, where each subset needs its own TIGER rates
+    from types import SimpleNamespace
+
+    ColumnSet = import_legacy_module("columns").ColumnSet
+    the_config = import_legacy_module("config").the_config
+    the_config.datatype = "morphology"
+    taxa = 40
+    aln = import_legacy_module("alignment").Alignment()
+    aln.species = ["sp%d" % i for i in range(taxa)]
+    aln.data = numpy.frombuffer(b"0123?", dtype="u1")[
+        rng.integers(0, 5, size=(taxa, args.subsets * args.subset_sites))]
+    aln.sequence_length = aln.data.shape[1]
+    cfg = SimpleNamespace(kmeans="tiger", datatype="morphology")
+    subsets = [kmeans.SubsetColumns(ColumnSet(range(i, aln.sequence_length, args.subsets)))
+               for i in range(args.subsets)]
+
+    timings = {}
+    for jobs in (1, args.jobs):
+        t0 = time.perf_counter()
+        kmeans.cluster_subsets(cfg, aln, subsets, jobs)
+        timings[jobs] = time.perf_counter() - t0
+        print(f"subsets={args.subsets} sites_each={args.subset_sites} jobs={jobs} "
+              f"seconds={timings[jobs]:.3f}")
+    print(f"speedup={timings[1] / timings[args.jobs]:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
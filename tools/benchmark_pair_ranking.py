@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+class _Subset:
+    def __init__(self, value):
+        self.value = value
+
+
+def _old_ranked_list(distance_matrix, subsets, N):
+    """What get_ranked_list used to do"""
+    import numpy
+
+    closest = distance_matrix.argsort()[:N]
+    ti = numpy.triu_indices(len(subsets), 1)
+    return [[subsets[i], subsets[j]] for i, j in zip(ti[0][closest], ti[1][closest])]
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark choosing the closest pairs of subsets")
+    p.add_argument("--blocks", type=int, default=5_000, help="Subsets (default: 5,000)")
+    p.add_argument("--cutoff", type=int, default=1_000, help="Pairs to choose (default: 1,000)")
+    p.add_argument("--merges", type=int, default=20, help="Merges to time re-ranking over (default: 20)")
+    args = p.parse_args()
+
+    import numpy
+    import scipy.spatial.distance
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    neighbour = import_legacy_module("neighbour")
+    rng = numpy.random.default_rng(1)
+    subsets = [_Subset(v) for v in rng.random(args.blocks)]
+
+    def distances(subs):
+        return scipy.spatial.distance.pdist(numpy.array([[s.value] for s in subs]), "cityblock")
+
+    d = distances(subsets)
+    print(f"blocks={args.blocks} pairs={len(d):,} cutoff={args.cutoff}")
+
+    t0 = time.perf_counter()
+    expected = _old_ranked_list(d, subsets, args.cutoff)
+    dt_old = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    got = neighbour.get_ranked_list(d, subsets, args.cutoff)
+    dt = time.perf_counter() - t1
+    assert got == expected
+    print(f"argsort_seconds={dt_old:.3f} argpartition_seconds={dt:.3f} speedup={dt_old / dt:.1f}x")
+
+    # Merging the closest pair each step, and ranking again
+    ranking = neighbour.PairRanking(subsets, distances, args.cutoff)
+    dt_full = dt_incremental = 0.0
+    for _ in range(args.merges):
+        pair = ranking.closest(1)[0]
+        merged = _Subset((pair[0].value + pair[1].value) / 2)
+        subsets = [s for s in subsets if s not in pair]
+        t2 = time.perf_counter()
+        expected = neighbour.get_ranked_list(distances(subsets + [merged]), subsets + [merged], args.cutoff)
+        dt_full += time.perf_counter() - t2
+        t3 = time.perf_counter()
+        ranking.merge(pair, merged, [abs(s.value - merged.value) for s in subsets])
+        got = ranking.closest()
+        dt_incremental += time.perf_counter() - t3
+        subsets.append(merged)
+        assert got == expected
+    print(f"merges={args.merges} distances_and_rank_ms={1000 * dt_full / args.merges:.1f} "
+          f"incremental_ms={1000 * dt_incremental / args.merges:.2f} "
+          f"speedup={dt_full / dt_incremental:.0f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark making subset alignments")
+    p.add_argument("--taxa", type=int, default=200, help="Number of taxa (default: 200)")
+    p.add_argument("--sites", type=int, default=100_000, help="Number of sites (default: 100,000)")
+    p.add_argument("--repeat", type=int, default=20, help="Times to make each subset (default: 20)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    alignment = import_legacy_module("alignment")
+    columns = import_legacy_module("columns")
+
+    rng = numpy.random.default_rng(1)
+    aln = alignment.Alignment()
+    aln.species = ["sp%d" % i for i in range(args.taxa)]
+    aln.sequence_length = args.sites
+    aln.data = numpy.frombuffer(b"ACGT-", dtype="u1")[rng.integers(0, 5, size=(args.taxa, args.sites))]
+
+    half = args.sites // 2
+    cases = [
+        ("block", columns.ColumnSet.from_range(0, half)),
+        ("codon", columns.ColumnSet.from_range(1, args.sites, 3)),
+        ("scattered", columns.ColumnSet(rng.choice(args.sites, size=half, replace=False))),
+    ]
+    for name, cs in cases:
+        sub = SimpleNamespace(column_set=cs)
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            # What SubsetAlignment used to do
+            aln.data[:, cs.to_array()]
+        dt_old = time.perf_counter() - t0
+
+        t1 = time.perf_counter()
+        for _ in range(args.repeat):
+            alignment.SubsetAlignment(aln, sub)
+        dt_new = time.perf_counter() - t1
+        print(f"{name}_fancy_index_ms={1000 * dt_old / args.repeat:.2f} "
+              f"subset_alignment_ms={1000 * dt_new / args.repeat:.2f} speedup={dt_old / dt_new:.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description="Benchmark TIGER rates as the number of characters grows")
+    p.add_argument("--taxa", type=int, default=60, help="Number of taxa (default: 60)")
+    p.add_argument("--sites", type=str, default="250,500,1000,2000,5000,10000",
+                   help="Comma separated character counts (default: 250,500,1000,2000,5000,10000)")
+    p.add_argument("--old-max", type=int, default=1000,
+                   help="Largest size to run calculate_rates on (default: 1,000)")
+    p.add_argument("--threads", type=int, default=1, help="Threads for the agreement kernel (default: 1)")
+    args = p.parse_args()
+
+    import numpy
+    from partitionfinder.accel import backend
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    alignment = import_legacy_module("alignment")
+    columns = import_legacy_module("columns")
+    mt = import_legacy_module("morph_tiger")
+
+    print(f"backend={backend()} threads={args.threads}")
+    rng = numpy.random.default_rng(1)
+    for sites in [int(s) for s in args.sites.split(",")]:
+        aln = alignment.Alignment()
+        aln.species = ["sp%d" % i for i in range(args.taxa)]
+        aln.sequence_length = sites
+        aln.data = numpy.frombuffer(b"0123?", dtype="u1")[rng.integers(0, 5, size=(args.taxa, sites))]
+        sub = SimpleNamespace(column_set=columns.ColumnSet.from_range(0, sites))
+
+        t0 = time.perf_counter()
+        rates = mt.subset_rates(aln, sub, args.threads)
+        dt_new = time.perf_counter() - t0
+        line = f"sites={sites} engine_seconds={dt_new:.3f}"
+
+        if sites <= args.old_max:
+            t1 = time.perf_counter()
+            expected = mt.calculate_rates(mt.create_set_parts(aln))
+            dt_old = time.perf_counter() - t1
+            assert rates.tobytes() == numpy.array(expected).tobytes()
+            line += f" calculate_rates_seconds={dt_old:.3f} speedup={dt_old / dt_new:.1f}x"
+        print(line)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+# Allow running without installing the package.
+import sys
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(
+        description="Copy the results from one PartitionFinder database to another. "
+        "The kind of database comes from the file name: .db is HDF5, .sqlite is SQLite."
+    )
+    p.add_argument("source", help="e.g. analysis/subsets/data.db")
+    p.add_argument("dest", help="e.g. analysis/subsets/data.sqlite")
+    args = p.parse_args()
+
+    from partitionfinder.core._legacy_shim import import_legacy_module
+
+    database = import_legacy_module("database")
+    if Path(args.dest).exists():
+        print(f"{args.dest} already exists, not overwriting it", file=sys.stderr)
+        return 1
+    count = database.convert(args.source, args.dest)
+    print(f"converted={count}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())